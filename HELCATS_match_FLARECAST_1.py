@@ -5,157 +5,64 @@ Created on Mon May 22 16:23:10 2017
 @author: guerraaj
 """
 
-import requests
 import datetime
+import itertools
 import numpy as np
 
-def download_range(service_url, dataset, start, end, step=datetime.timedelta(days=30), **params):
-    """
-    service_url:    URL to get to the service. This is all the part before '/ui', e.g.
-                    'http://cluster-r730-1:8002'
-                    'http://api.flarecast.eu/property'
-                    'http://localhost:8002'
-                    Type: string
-    dataset:        The dataset to download from
-                    Type: string
-    start, end:     Total start and end time of the data to download
-                    Type: datetime
-    step:           Time range of a single download slice
-                    The total range (start - end) will be splitted up in smaller time ranges
-                    with the size of 'step' and then every time range will be downloaded separately
-                    Type: timedelta
-    params:         Keyword argument, will be passed as query parameters to the http request url:
-                    Examples:
-                    property_type="sfunction_blos,sfunction_br"
-                    nar=3120
-
-    returns:        List with all entries, like you would download the whole time range in one request
-                    Type: List of dicts
-    """
-    all_data = []
-
-    while start < end:
-        response = None
-        end_step = min(start + step, end)
-        try:
-            params["time_start"] = "between(%s,%s)" % (
-                start.isoformat(),
-                end_step.isoformat()
-            ),
-            response = requests.get(
-                "%s/region/%s/list" % (service_url, dataset),
-                params=params
-            )
-        except requests.exceptions.BaseHTTPError as ex:
-            print("exception while downloading: " % ex)
-
-        if response is not None and response.status_code == 200:
-            all_data.extend(response.json()["data"])
-        else:
-            resp_msg = response.json() if response is not None else ""
-            print("error while downloading time range (%s - %s): %s" % (
-                start, start + step, resp_msg
-            ))
-        start += step
-
-    return all_data
-    
-# FUNCTION TO TRANSFORM LOCATION FORMAT
-def location(loc):
+from helcats_match import location, comp_location, rot_regions, match_position, \
+    match_latlon, event_locations, format_locations
+from flarecast_client import download_range, download_records, plan_windows
+from flarecast_index import RegionIndex
 
-    loc1 = []
-    if loc != ' ':
-        slat1 = loc[0:1]
-        slon1 = loc[3:4]
-        if slat1 == 'N':
-            slat = 1
-        else:
-            slat = -1
-        if slon1 == 'E':
-            slon = -1
-        else:
-            slon = 1
-        lat = int(float(loc[1:3]))
-        lon = int(float(loc[4:6]))
-        loc1.append(slat)
-        loc1.append(slon)
-        loc1.append(lat)
-        loc1.append(lon)
-        return loc1
-
-# FUNCTION TO MATCH REGIONS
-def comp_location(hc_loc,fc_lon,fc_lat,tol):
-    # FIRST CONVERT HELCATS LOCATION FORMAT
-    region_match = False
-    #if len(hc_loc) == 1:
-    hg_coor = location(hc_loc)
-    #else:
-    #hg_coor = hc_loc
-    if fc_lon < 0:
-        sfc_lon = -1
-    else:
-        sfc_lon = 1
-    if fc_lat < 0:
-        sfc_lat = -1
-    else:
-        sfc_lat = 1
-    
-    if (sfc_lon == hg_coor[1] and sfc_lat == hg_coor[0]):
-        fc_d = np.sqrt(fc_lon*fc_lon + fc_lat*fc_lat)
-        hc_d = np.sqrt(hg_coor[2]*hg_coor[2] + hg_coor[3]*hg_coor[3])
-        diff_ = np.abs(fc_d - hc_d)       
-        
-        if diff_ < tol:    # TOL DEGREE IS THE TOLERANCE TO MATCH REGIONS
-            region_match = True
-    
-    return region_match
-
-# FUNCTION TO ROTATE REGIONS LOCATION
-def rot_regions(nloc,ntime,srstime):
-    loc = location(nloc)
-    ar_lat = loc[0]*loc[2]
-    ar_lon = loc[1]*loc[3]
-    a=14.713
-    b=-2.396
-    c=-1.787
-    minn = ntime - srstime
-    if ntime > srstime:
-        m = ntime - srstime
-        minn = int(m.total_seconds()/60.)
-    if ntime < srstime:
-        m = srstime - ntime
-        minn = -int(m.total_seconds()/60.)
-    #
-    rotation=a + b*(np.sin(ar_lat))**2.0 + c*(np.sin(ar_lat))**4.0 # In deg/day
-    rotation=rotation/1440.0 # In deg/min
-    ar_lon=ar_lon + minn*rotation # In degree
-    if ar_lon > 0.:
-        s1 = 'W'
-    if ar_lon < 0.:
-        s1 = 'E'
-    if ar_lat < 0.:
-        s2 = 'S'
-    if ar_lat > 0.:
-        s2 = 'N'
-    nloc_lat = s2+"%02d" % loc[2]
-    nloc_lon = s1+"%02d" % abs(ar_lon)
-    new_loc = nloc_lat+nloc_lon
-    
-    return new_loc
 
 if __name__ == "__main__":
     import iso8601
     import json
     import io
-    import dateutil
+    import os
+    import dateutil.parser
+    from flarecast_cache import ResponseCache
+    from flarecast_rate import SliceSizer, TokenBucket
+    from flarecast_store import RegionStore
+    from helcats_catalogue import iter_events
+    from helcats_columnar import event_table, write_columns
+    from helcats_checkpoint import Checkpoint
+    from helcats_jsonl import JsonLinesWriter
     
     # SHARP DATA ONLY EXISTS SINCE SEPT 2012
     sharp_date = datetime.datetime(2012,9,1)
     # HELCATS/LOWCAT CATALOGUE FILENAME
-    json_data=open("helcats_list.json").read()
-    helcats_list = json.loads(json_data)
+    helcats_file = "helcats_list.json"
     # FLARECAST ACTIVE REGION PROPERTY -
     ps = "*" #ALL OR SELECT FROM LIST BELOW
+    # TWO PHASE DOWNLOAD -- MATCH ON METADATA ONLY, THEN GET THE PROPERTIES OF THE MATCHED REGIONS ONLY
+    two_phase = True
+    match_fields = "time_start,lat_hg,long_hg,meta" # REGION FIELDS NEEDED TO MATCH
+    # TIME WINDOW OF THE CANDIDATE REGIONS AROUND FL_STARTTIME, AND MAXIMUM DISTANCE (DEGREES) TO MATCH BY POSITION
+    # helcats_sweep.py COMPARES MANY OF THESE VALUES WITH A SINGLE DOWNLOAD
+    pre_window = datetime.timedelta(minutes=60)
+    post_window = datetime.timedelta(minutes=5)
+    tolerance = 15.0 # Degrees of angular distance between FC region and HC source region
+    # LOCAL CACHE OF FLARECAST RESPONSES -- SET offline=True TO RUN ONLY FROM THE CACHE
+    cache = ResponseCache("flarecast_cache", max_bytes=10 * 1024 ** 3, offline=False)
+    # LOCAL SQLITE STORE OF THE DOWNLOADED RECORDS (flarecast_store.py) -- TIME RANGES ALREADY IN IT ARE READ FROM IT
+    # AND NOT ASKED AGAIN, THE OTHERS ARE ADDED TO IT, e.g. RegionStore("flarecast_store.sqlite"). None FOR THE CACHE ONLY
+    store = None
+    # MAXIMUM REQUESTS PER SECOND SENT TO FLARECAST (AND AT ONCE AFTER A QUIET PERIOD) -- FLARECAST_RATE OVERRIDES IT
+    limiter = TokenBucket(rate=float(os.environ.get("FLARECAST_RATE", 10)), burst=20)
+    # BULK REQUESTS CUT IN SLICES OF ABOUT target_records RECORDS, None FOR THE FIXED 30 DAYS STEP
+    adaptive = SliceSizer(target_records=5000)
+    #KEEP production_02 CHECK API.FLARECAST.EU FOR MOST COMPLETE DATA PRODUCTION
+    # FLARECAST_URL OVERRIDES THE SERVICE, e.g. THE LOCAL STAND-IN OF flarecast_mock.py
+    service_url = os.environ.get("FLARECAST_URL", "http://api.flarecast.eu/property")
+    # PER-EVENT CHECKPOINTS -- A STOPPED RUN STARTS AGAIN WHERE IT STOPPED, EVENTS ALREADY DONE
+    # WITH THE SAME INPUTS ARE SKIPPED. None TO DISABLE, DELETE THE FILE AFTER CHANGING THE MATCHING
+    checkpoint_file = "output_file.checkpoint.jsonl"
+    # STREAMING OUTPUT -- EVERY EVENT IS WRITTEN TO THIS JSON LINES FILE AS SOON AS IT IS DONE (READ IT WITH
+    # helcats_jsonl.iter_jsonl, ALSO DURING THE RUN) AND NOT KEPT, NOR IS THE CATALOGUE. None TO WRITE output_file.txt AT THE END
+    stream_file = None
+    # EVENTS READ AT ONCE FROM THE CATALOGUE, THEIR WINDOWS ARE MERGED IN BULK REQUESTS
+    chunk_events = 500
     
     """
     LIST OF FLARECAST AR PROPERTY NAMES
@@ -179,104 +86,203 @@ if __name__ == "__main__":
     gs_slf,                                                      #SUNSPOT-MAGNETIC PROPERTIES
     """    
     
-    # EXTRACT FROM HELCATS LIST THOSE EVENTS WITH ASSOCIATED SOURCE REGIONS
-    reduced_list = []
-    for i in helcats_list:
-        ind = i["FL_TYPE"]
-        if ind == 'swpc' or ind == 'hessi':
-            reduced_list.append(i)
-    print 'Total CMEs with associatted Flare source region: ', len(reduced_list)
+    # EXTRACT FROM HELCATS LIST THOSE EVENTS WITH ASSOCIATED SOURCE REGIONS, AFTER SHARP_DATE
+    # THE LIST IS STREAMED AND FILTERED WHILE READING, OTHER EVENTS ARE NEVER DECODED
+    events_in = iter_events(helcats_file, fl_types=('swpc','hessi'), since=sharp_date)
+    reduced_list = None
+    if not stream_file:
+        reduced_list = list(events_in)
+        events_in = iter(reduced_list)
+        print 'Total CMEs with associatted Flare source region: ', len(reduced_list)
+    
     
+    checkpoint = None
+    if checkpoint_file:
+        checkpoint = Checkpoint(checkpoint_file, settings={"ps": ps, "two_phase": two_phase,
+                                                           "service_url": service_url,
+                                                           "dataset": "production_02",
+                                                           "window": [pre_window.total_seconds(), post_window.total_seconds()],
+                                                           "tolerance": tolerance})
     
-    # FOR THOSE EVENTS IN THE REDUCED LIST, WE KEEP THOSE AFTER SHARP DATA IS AVAILABLE (SHARP_DATE)
-    for jj in enumerate(reduced_list):
-        j = jj[1]
-        print 'HELCATS CME event source region: ', jj[0],'.......'
-        hel_date = j["FL_STARTTIME"]
-        hel_date = dateutil.parser.parse(hel_date)
-        idate = hel_date - datetime.timedelta(minutes=60)  # PLAY WITH THESE VALUES TO MATCH TIMES BETTER
-        edate = hel_date + datetime.timedelta(minutes=5)   #
+    stream = None
+    if stream_file:
+        stream = JsonLinesWriter(stream_file, batch=20)
+    one = 0
+    total = 0
+    # THE CATALOGUE IS MATCHED chunk_events CONSECUTIVE EVENTS AT A TIME (CLOSE IN TIME, SO THEIR WINDOWS STILL MERGE)
+    while True:
+        chunk = list(itertools.islice(events_in, chunk_events))
+        if not chunk:
+            break
+        first = total
+        total += len(chunk)
+        
+        # SOURCE REGION POSITIONS OF ALL EVENTS OF THE CHUNK AT ONCE
+        ev_lats, ev_lons, ev_srs = event_locations(chunk, "FL_LOC")
         
-        if idate > sharp_date:
-            print 'HELCATS date', hel_date
-            nar = int(j["SRS_NO"])
-            #
-            loc1a = j["FL_LOC"]
-            loc1 = loc1a.encode('ascii','ignore')
-            print "Location according to event list", loc1
+        # FOR THOSE EVENTS IN THE REDUCED LIST, WE KEEP THOSE AFTER SHARP DATA IS AVAILABLE (SHARP_DATE)
+        candidates = []
+        for k, j in enumerate(chunk):
+            print 'HELCATS CME event source region: ', first + k,'.......'
+            if checkpoint is not None:
+                done, fc_data = checkpoint.get(j)
+                if done:
+                    if fc_data:
+                        j["FC_data"] = fc_data
+                    print 'Already done in a previous run'
+                    continue
+            hel_date = j["FL_STARTTIME"]
+            hel_date = dateutil.parser.parse(hel_date)
+            idate = hel_date - pre_window
+            edate = hel_date + post_window
             
-            if loc1 == ' ':
-                loc1a = j["SRS_LOC"]
-                loc1a = loc1a.encode('ascii','ignore')
-                print 'NOAA source region location at midnight', loc1a
-                #CORRECT NOAA LOCATION (MIDNIGHT) TO EVENT ACTUAL TIME
-                if loc1a == ' ':
+            if idate > sharp_date:
+                print 'HELCATS date', hel_date
+                nar = int(j["SRS_NO"])
+                #
+                # POSITION PRECOMPUTED FOR THE WHOLE CHUNK, NOAA MIDNIGHT LOCATION ROTATED TO EVENT TIME IF NEEDED
+                if np.isnan(ev_lats[k]):
+                    print 'No source region location'
                     continue
-                stime = j["SRS_TIME"].encode('ascii','ignore')
-                print 'SRS file time', stime
-                srstime = dateutil.parser.parse(stime)
-                loc1 = rot_regions(loc1a,hel_date,srstime)
-                print 'Corrected location from NOAA', loc1
+                loc1 = (ev_lats[k], ev_lons[k])
+                if ev_srs[k]:
+                    print 'NOAA location at midnight', j["SRS_LOC"], 'SRS file time', j["SRS_TIME"]
+                    print 'Corrected location from NOAA', format_locations([loc1[0]], [loc1[1]])[0]
+                else:
+                    print "Location according to event list", format_locations([loc1[0]], [loc1[1]])[0]
                 
-            yes = False
+                if nar or loc1:
+                    nar = nar + 10000
+                    print 'NOAA number from HELCATS', nar
+                    
+                    idate = datetime.datetime.strftime(idate,'%Y-%m-%dT%H:%M:00Z')
+                    edate = datetime.datetime.strftime(edate,'%Y-%m-%dT%H:%M:00Z')
+                    start = iso8601.parse_date(idate)
+                    end   = iso8601.parse_date(edate)
+                    candidates.append((first + k, j, nar, loc1, start, end))
+        
+        # EVENTS WITHOUT A CANDIDATE WINDOW (DONE IN A PREVIOUS RUN, NO LOCATION) ARE ALREADY DONE
+        if stream is not None:
+            waiting = set(c[0] - first for c in candidates)
+            for k, j in enumerate(chunk):
+                if k not in waiting:
+                    one += 1 if j.get("FC_data") else 0
+                    stream.write(j)
+        del chunk
+        
+        # requesting data from FLARECAST property DB
+        # ALL EVENT WINDOWS ARE MERGED IN AS FEW BULK REQUESTS AS POSSIBLE
+        plan = plan_windows([(c[4], c[5]) for c in candidates], gap=datetime.timedelta(minutes=30))
+        print '%d time windows merged in %d bulk requests' % (len(candidates), len(plan))
+        # EVERY BULK REQUEST IS MATCHED AS SOON AS IT IS DOWNLOADED, AND ITS RECORDS ARE DROPPED AFTER
+        # MATCHED (EVENT, FLARECAST RECORD, MATCH QUALITY) AND EVENTS WAITING FOR THE SECOND PHASE
+        matched = []
+        events = []
+        # TIME RANGES THAT COULD NOT BE DOWNLOADED -- THEIR EVENTS ARE NOT CHECKPOINTED AS UNMATCHED
+        failed = []
+        fc_index = None
+        for w, (wstart, wend, covered) in enumerate(plan):
+            group = [candidates[i] for i in covered]
+            if two_phase:
+                # FIRST PHASE -- NO PROPERTIES, ONLY THE FIELDS NEEDED TO MATCH
+                fields = dict(property_type="", region_fields=match_fields)
+            else:
+                fields = dict(property_type=ps, region_fields="*")
+            if store is not None:
+                rdata = store.download(service_url, wstart, wend, cache=cache, limiter=limiter, adaptive=adaptive, errors=failed, **fields)
+            else:
+                rdata = download_range(service_url, "production_02", wstart, wend, cache=cache, limiter=limiter, adaptive=adaptive, errors=failed, **fields)
+            if fc_index is not None:
+                # WINDOWS STARTING IN THE PREVIOUS BULK REQUEST (WHEN IT WAS CUT AT ITS MAXIMUM SPAN) ALSO NEED ITS RECORDS
+                rdata = fc_index.window(min(c[4] for c in group), max(c[5] for c in group)) + rdata
+            fc_index = RegionIndex(rdata)
+            del rdata
             
-            if nar or loc1:
-                nar = nar + 10000
-                print 'NOAA number from HELCATS', nar
-                
-                # requesting data from FLARECAST property DB
-                idate = datetime.datetime.strftime(idate,'%Y-%m-%dT%H:%M:00Z')
-                edate = datetime.datetime.strftime(edate,'%Y-%m-%dT%H:%M:00Z')
-                start = iso8601.parse_date(idate)
-                end   = iso8601.parse_date(edate)
-                #KEEP production_02 CHECK API.FLARECAST.EU FOR MOST COMPLETE DATA PRODUCTION
-                rdata = download_range("http://api.flarecast.eu/property", "production_02", start, end, property_type=ps, region_fields="*")
+            for c in group:
+                jj, j, nar, loc1, start, end = c
+                events.append(j)
+                print 'Matching HELCATS CME event source region: ', jj,'.......'
+                yes = False
+                # CANDIDATE REGIONS OF THE EVENT, TAKEN FROM THE TIME AND NOAA NUMBER INDEXES
+                rdata = fc_index.window(start, end)
+                nar_data = fc_index.by_nar(nar, start, end)
                 
                 if rdata:
                     print 'FLARECAST date', rdata[0]["time_start"]
                 
                 if yes == False:
-                    for m in range(len(rdata)):
-                        nnar = rdata[m]["meta"]["nar"]
+                    for m in range(len(nar_data)):
+                        nnar = nar_data[m]["meta"]["nar"]
                         
                         if nnar:
                             if nar in nnar and len(nnar) == 1:
                                 print 'Region matched by NOAA No', nar
                                 # ADD A FIELD FOR QUALITY OF THE MATCH -- 0 MEANS MATCHED BY NOAA NUMBER
-                                mm = rdata[m]["data"]
-                                mm["fc_data_q"] = 0
-                                j["FC_data"] = mm
+                                matched.append((j, nar_data[m], 0))
                                 yes = True
                                 break
                    
                 if yes == False:
-                    for m in range(len(rdata)):
-                        tolerance = 15.0 # Degrees of total distance between FC region and HC source region
-                        comp_regions = comp_location(loc1,rdata[m]["long_hg"],rdata[m]["lat_hg"],tolerance)
-                        if comp_regions:
-                            print 'Region matched by position'
-                            print 'Region location from FLARECAST',rdata[m]["lat_hg"],rdata[m]["long_hg"]
-                            # ADD A FIELD FOR QUALITY OF THE MATCH -- !=0 MEANS SOURCE REGION IS "fl_data_q" DEGREES FROM FLARECAST REGION
-                            mm = rdata[m]["data"]
-                            mm["fc_data_q"] = comp_regions
-                            j["FC_data"] = mm
-                            yes = True
-                            break
+                    # CLOSEST CANDIDATE REGION, ALL CANDIDATES COMPARED AT ONCE ON THE POSITIONS OF THE INDEX
+                    rec, comp_regions = fc_index.closest(loc1[0],loc1[1],start,end,tolerance)
+                    if rec is not None:
+                        print 'Region matched by position'
+                        print 'Region location from FLARECAST',rec["lat_hg"],rec["long_hg"]
+                        # ADD A FIELD FOR QUALITY OF THE MATCH -- !=0 MEANS SOURCE REGION IS "fl_data_q" DEGREES FROM FLARECAST REGION
+                        matched.append((j, rec, comp_regions))
+                        yes = True
                 
                 if not yes:
                     print 'No SHARP Region matched to candidate source region'
+                    if checkpoint is not None and not any(s0 <= end and s1 >= start for s0, s1 in failed):
+                        checkpoint.put(j, None)
+            # SECOND PHASE BY BLOCKS OF ABOUT 50 MATCHED EVENTS, SO THAT EVERY BLOCK IS CHECKPOINTED
+            if len(matched) < 50 and w < len(plan) - 1:
+                continue
+            
+            if two_phase:
+                # SECOND PHASE -- PROPERTIES OF THE MATCHED REGIONS ONLY
+                full = download_records(service_url, "production_02", [m[1] for m in matched], property_type=ps, region_fields="*", cache=cache, limiter=limiter, store=store)
+                # RECORDS NOT DOWNLOADED ARE NOT CHECKPOINTED, THEY ARE ASKED AGAIN BY THE NEXT RUN
+                matched = [(m[0], f, m[2]) for m, f in zip(matched, full) if f is not None]
+            for j, rec, q in matched:
+                mm = dict(rec["data"])
+                mm["fc_data_q"] = q
+                j["FC_data"] = mm
+                if checkpoint is not None:
+                    checkpoint.put(j, mm)
+            if stream is not None:
+                # EVENTS WHOSE RECORD COULD NOT BE DOWNLOADED ARE WRITTEN WITHOUT FC_data
+                for j in events:
+                    one += 1 if j.get("FC_data") else 0
+                    stream.write(j)
+            matched = []
+            events = []
+        del candidates, fc_index
+    if checkpoint is not None:
+        print 'Events done in a previous run:', checkpoint.skipped
+        checkpoint.close()
+    if store is not None:
+        store.close()
 
-    # FIND THE NUMBER OF REGIONS MATCHED
-    one = 0
-    for l in reduced_list:
-        try:
-            ind = l["FC_data"]
-            if ind:
-                one += 1
-        except:
-            continue
-    print 'Number of HELCATS events matched to FLARECAST regions:', one
-    #
-    with io.open('output_file.txt', 'w', encoding='utf-8') as f:
-        f.write(json.dumps(reduced_list , ensure_ascii=False))
+    if stream is not None:
+        stream.close()
+        print 'Total CMEs with associatted Flare source region: ', total
+        print 'Number of HELCATS events matched to FLARECAST regions:', one
+        print 'Events written to', stream_file
+    else:
+        # FIND THE NUMBER OF REGIONS MATCHED
+        for l in reduced_list:
+            try:
+                ind = l["FC_data"]
+                if ind:
+                    one += 1
+            except:
+                continue
+        print 'Number of HELCATS events matched to FLARECAST regions:', one
+        #
+        with io.open('output_file.txt', 'w', encoding='utf-8') as f:
+            f.write(json.dumps(reduced_list , ensure_ascii=False))
+        # SAME OUTPUT AS TYPED COLUMNS (ONE .npy FILE PER COLUMN), SEE helcats_columnar.py
+        write_columns('output_file_columns', event_table(reduced_list, snapshots=[l.get("FC_data") for l in reduced_list]))
     
\ No newline at end of file
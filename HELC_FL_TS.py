@@ -12,157 +12,49 @@ Created on Mon May 22 16:23:10 2017
 @author: guerraaj
 """
 
-import requests
 import datetime
 import numpy as np
 
-def download_range(service_url, dataset, start, end, step=datetime.timedelta(days=30), **params):
-    """
-    service_url:    URL to get to the service. This is all the part before '/ui', e.g.
-                    'http://cluster-r730-1:8002'
-                    'http://api.flarecast.eu/property'
-                    'http://localhost:8002'
-                    Type: string
-    dataset:        The dataset to download from
-                    Type: string
-    start, end:     Total start and end time of the data to download
-                    Type: datetime
-    step:           Time range of a single download slice
-                    The total range (start - end) will be splitted up in smaller time ranges
-                    with the size of 'step' and then every time range will be downloaded separately
-                    Type: timedelta
-    params:         Keyword argument, will be passed as query parameters to the http request url:
-                    Examples:
-                    property_type="sfunction_blos,sfunction_br"
-                    nar=3120
-
-    returns:        List with all entries, like you would download the whole time range in one request
-                    Type: List of dicts
-    """
-    all_data = []
-
-    while start < end:
-        response = None
-        end_step = min(start + step, end)
-        try:
-            params["time_start"] = "between(%s,%s)" % (
-                start.isoformat(),
-                end_step.isoformat()
-            ),
-            response = requests.get(
-                "%s/region/%s/list" % (service_url, dataset),
-                params=params
-            )
-        except requests.exceptions.BaseHTTPError as ex:
-            print("exception while downloading: " % ex)
-
-        if response is not None and response.status_code == 200:
-            all_data.extend(response.json()["data"])
-        else:
-            resp_msg = response.json() if response is not None else ""
-            print("error while downloading time range (%s - %s): %s" % (
-                start, start + step, resp_msg
-            ))
-        start += step
-
-    return all_data
-    
-# FUNCTION TO TRANSFORM LOCATION FORMAT
-def location(loc):
-
-    loc1 = []
-    if loc != ' ':
-        slat1 = loc[0:1]
-        slon1 = loc[3:4]
-        if slat1 == 'N':
-            slat = 1
-        else:
-            slat = -1
-        if slon1 == 'E':
-            slon = -1
-        else:
-            slon = 1
-        lat = int(float(loc[1:3]))
-        lon = int(float(loc[4:6]))
-        loc1.append(slat)
-        loc1.append(slon)
-        loc1.append(lat)
-        loc1.append(lon)
-        return loc1
-
-# FUNCTION TO MATCH REGIONS
-def comp_location(hc_loc,fc_lon,fc_lat,tol):
-    # FIRST CONVERT HELCATS LOCATION FORMAT
-    region_match = False
-    #if len(hc_loc) == 1:
-    hg_coor = location(hc_loc)
-    #else:
-    #hg_coor = hc_loc
-    if fc_lon < 0:
-        sfc_lon = -1
-    else:
-        sfc_lon = 1
-    if fc_lat < 0:
-        sfc_lat = -1
-    else:
-        sfc_lat = 1
-    
-    if (sfc_lon == hg_coor[1] and sfc_lat == hg_coor[0]):
-        fc_d = np.sqrt(fc_lon*fc_lon + fc_lat*fc_lat)
-        hc_d = np.sqrt(hg_coor[2]*hg_coor[2] + hg_coor[3]*hg_coor[3])
-        diff_ = np.abs(fc_d - hc_d)       
-        
-        if diff_ < tol:    # TOL DEGREE IS THE TOLERANCE TO MATCH REGIONS
-            region_match = True
-    
-    return region_match
+from helcats_match import location, comp_location, rot_regions, match_position, \
+    match_latlon, event_locations, format_locations
+from flarecast_client import download_range, download_region
+from flarecast_ts import TS_PROPERTIES, PropertySpec, load_spec, build_timeseries, timeseries_dict
 
-# FUNCTION TO ROTATE REGIONS LOCATION
-def rot_regions(nloc,ntime,srstime):
-    loc = location(nloc)
-    ar_lat = loc[0]*loc[2]
-    ar_lon = loc[1]*loc[3]
-    a=14.713
-    b=-2.396
-    c=-1.787
-    minn = ntime - srstime
-    if ntime > srstime:
-        m = ntime - srstime
-        minn = int(m.total_seconds()/60.)
-    if ntime < srstime:
-        m = srstime - ntime
-        minn = -int(m.total_seconds()/60.)
-    #
-    rotation=a + b*(np.sin(ar_lat))**2.0 + c*(np.sin(ar_lat))**4.0 # In deg/day
-    rotation=rotation/1440.0 # In deg/min
-    ar_lon=ar_lon + minn*rotation # In degree
-    if ar_lon > 0.:
-        s1 = 'W'
-    if ar_lon < 0.:
-        s1 = 'E'
-    if ar_lat < 0.:
-        s2 = 'S'
-    if ar_lat > 0.:
-        s2 = 'N'
-    nloc_lat = s2+"%02d" % loc[2]
-    nloc_lon = s1+"%02d" % abs(ar_lon)
-    new_loc = nloc_lat+nloc_lon
-    
-    return new_loc
 
 if __name__ == "__main__":
     import iso8601
     import json
     import io
-    import dateutil
+    import os
+    import dateutil.parser
+    from flarecast_cache import ResponseCache
+    from flarecast_dedup import SingleFlight
+    from flarecast_rate import TokenBucket
+    from flarecast_store import RegionStore
+    from helcats_catalogue import iter_events
+    from helcats_columnar import event_table, write_columns
     
     # SHARP DATA ONLY EXISTS SINCE SEPT 2012
     sharp_date = datetime.datetime(2012,9,1)
     # HELCATS/LOWCAT CATALOGUE FILENAME
-    json_data=open("helcats_list.json").read()
-    helcats_list = json.loads(json_data)
-    # FLARECAST ACTIVE REGION PROPERTY -
-    ps = "*" #ALL OR SELECT FROM LIST BELOW
+    helcats_file = "helcats_list.json"
+    # PROPERTIES OF THE TIME SERIES -- ONE DOTTED PATH PER LINE IN ts_properties.txt, DEFAULT TS_PROPERTIES
+    ts_spec = load_spec("ts_properties.txt") if os.path.exists("ts_properties.txt") else PropertySpec(TS_PROPERTIES)
+    # FLARECAST ACTIVE REGION PROPERTY - ONLY THOSE NEEDED BY THE TIME SERIES ARE DOWNLOADED
+    ps = ts_spec.property_type #ALL ("*") OR SELECT FROM LIST BELOW
+    # LOCAL CACHE OF FLARECAST RESPONSES -- SET offline=True TO RUN ONLY FROM THE CACHE
+    cache = ResponseCache("flarecast_cache", max_bytes=10 * 1024 ** 3, offline=False)
+    # LOCAL SQLITE STORE OF THE DOWNLOADED RECORDS (flarecast_store.py) -- TIME RANGES ALREADY IN IT ARE READ FROM IT
+    # AND NOT ASKED AGAIN, THE OTHERS ARE ADDED TO IT, e.g. RegionStore("flarecast_store.sqlite"). None FOR THE CACHE ONLY
+    store = None
+    # TS REQUESTS SHARED BETWEEN EVENTS (SAME REGION ASKED FOR OVERLAPPING WINDOWS)
+    dedup = SingleFlight(grid=datetime.timedelta(hours=1))
+    # NUMBER OF HOURLY SLICES DOWNLOADED AT THE SAME TIME (WHEN THE SERVICE CANNOT FILTER BY HARP)
+    nworkers = 8
+    # FLARECAST SERVICE -- FLARECAST_URL OVERRIDES IT, e.g. THE LOCAL STAND-IN OF flarecast_mock.py
+    service_url = os.environ.get("FLARECAST_URL", "http://cluster-r730-1:8002")
+    # MAXIMUM REQUESTS PER SECOND SENT TO FLARECAST (AND AT ONCE AFTER A QUIET PERIOD) -- FLARECAST_RATE OVERRIDES IT
+    limiter = TokenBucket(rate=float(os.environ.get("FLARECAST_RATE", 10)), burst=20)
     
     """
     LIST OF FLARECAST AR PROPERTY NAMES
@@ -186,15 +78,15 @@ if __name__ == "__main__":
     gs_slf,                                                      #SUNSPOT-MAGNETIC PROPERTIES
     """  
     
-    # EXTRACT FROM HELCATS LIST THOSE EVENTS WITH ASSOCIATED SOURCE REGIONS
-    reduced_list = []
-    for i in helcats_list:
-        ind = i["FL_TYPE"]
-        if ind == 'swpc' or ind == 'hessi':
-            reduced_list.append(i)
+    # EXTRACT FROM HELCATS LIST THOSE EVENTS WITH ASSOCIATED SOURCE REGIONS, AFTER SHARP_DATE
+    # THE LIST IS STREAMED AND FILTERED WHILE READING, OTHER EVENTS ARE NEVER DECODED
+    reduced_list = list(iter_events(helcats_file, fl_types=('swpc','hessi'), since=sharp_date))
     print 'Total CMEs with associatted Flare source region: ', len(reduced_list)
     
     
+    # SOURCE REGION POSITIONS OF ALL EVENTS AT ONCE
+    ev_lats, ev_lons, ev_srs = event_locations(reduced_list, "SMART_HGLATLON")
+    
     # FOR THOSE EVENTS IN THE REDUCED LIST, WE KEEP THOSE AFTER SHARP DATA IS AVAILABLE (SHARP_DATE)
     for jj in enumerate(reduced_list):
         j = jj[1]
@@ -208,23 +100,17 @@ if __name__ == "__main__":
             print 'HELCATS date', hel_date
             nar = int(j["SRS_NO"])
             #
-            loc1a = j["SMART_HGLATLON"]
-            loc1 = loc1a.encode('ascii','ignore')
-            print "Location according to Smart", loc1
+            # POSITION PRECOMPUTED FOR THE WHOLE LIST, NOAA MIDNIGHT LOCATION ROTATED TO EVENT TIME IF NEEDED
+            if np.isnan(ev_lats[jj[0]]):
+                print 'No source region location'
+                continue
+            loc1 = (ev_lats[jj[0]], ev_lons[jj[0]])
+            if ev_srs[jj[0]]:
+                print 'NOAA location at midnight', j["SRS_LOC"], 'SRS file time', j["SRS_TIME"]
+                print 'Corrected location from NOAA', format_locations([loc1[0]], [loc1[1]])[0]
+            else:
+                print "Location according to Smart", format_locations([loc1[0]], [loc1[1]])[0]
             
-            if loc1 == ' ':
-                loc1a = j["SRS_LOC"]
-                loc1a = loc1a.encode('ascii','ignore')
-                print 'NOAA location at midnight', loc1a
-                #CORRECT NOAA LOCATION TO EVENT ACTIAL TIME
-                if loc1a == ' ':
-                    continue
-                stime = j["SRS_TIME"].encode('ascii','ignore')
-                print 'SRS file time', stime
-                srstime = dateutil.parser.parse(stime)
-                loc1 = rot_regions(loc1a,hel_date,srstime)
-                print 'Corrected location from NOAA', loc1
-                
             yes = False
             
             if nar or loc1:
@@ -237,7 +123,10 @@ if __name__ == "__main__":
                 end   = iso8601.parse_date(edate)
                 #KEEP production_02 CHECK API.FLARECAST.EU FOR MOST COMPLETE DATA PRODUCTION
                 #DON'T NEED PROPERTIES AT THIS POINT, ONLY METADATA
-                rdata = download_range("http://cluster-r730-1:8002", "production_02", start, end, property_type="", region_fields="*")
+                if store is not None:
+                    rdata = store.download(service_url, start, end, property_type="", region_fields="*", cache=cache, limiter=limiter)
+                else:
+                    rdata = download_range(service_url, "production_02", start, end, property_type="", region_fields="*", cache=cache, limiter=limiter)
                 
                 if rdata:
                     print 'FLARECAST date', rdata[0]["time_start"]
@@ -260,20 +149,19 @@ if __name__ == "__main__":
                                 break
                    
                 if yes == False:
-                    for m in range(len(rdata)):
-                        tolerance = 15.0 # Degrees of total distance between FC region and HC source region
-                        comp_regions = comp_location(loc1,rdata[m]["long_hg"],rdata[m]["lat_hg"],tolerance)
-                        if comp_regions:
-                            print 'Region matched by position'
-                            print 'Region location from FLARECAST',rdata[m]["lat_hg"],rdata[m]["long_hg"]
-                            # ADD A FIELD FOR QUALITY OF THE MATCH -- !=0 MEANS SOURCE REGION IS "fl_data_q" DEGREES FROM FLARECAST REGION
-                            mm = rdata[m]["data"]
-                            mm["fc_data_q"] = comp_regions
-                            yes = True
-                            print 'Matched region HARP num ', rdata[m]["meta"]["harp"]
-                            harpnum = rdata[m]["meta"]["harp"]
-                            pass_time = dateutil.parser.parse(rdata[m]["time_start"],ignoretz=True)
-                            break
+                    tolerance = 15.0 # Degrees of angular distance between FC region and HC source region
+                    # CLOSEST CANDIDATE REGION, ALL CANDIDATES COMPARED AT ONCE
+                    m, comp_regions = match_latlon(loc1[0],loc1[1],rdata,tolerance)
+                    if m is not None:
+                        print 'Region matched by position'
+                        print 'Region location from FLARECAST',rdata[m]["lat_hg"],rdata[m]["long_hg"]
+                        # ADD A FIELD FOR QUALITY OF THE MATCH -- !=0 MEANS SOURCE REGION IS "fl_data_q" DEGREES FROM FLARECAST REGION
+                        mm = rdata[m]["data"]
+                        mm["fc_data_q"] = comp_regions
+                        yes = True
+                        print 'Matched region HARP num ', rdata[m]["meta"]["harp"]
+                        harpnum = rdata[m]["meta"]["harp"]
+                        pass_time = dateutil.parser.parse(rdata[m]["time_start"],ignoretz=True)
                 
                 if not yes:
                     print 'No SHARP Region matched to candidate source region'
@@ -287,78 +175,25 @@ if __name__ == "__main__":
                     start = iso8601.parse_date(idate)
                     end   = iso8601.parse_date(edate)
                     # 
-                    rdatam = download_range("http://cluster-r730-1:8002", "production_02", start, end, step=datetime.timedelta(minutes=60), property_type=ps, region_fields="*")#, nar=str(narnum))
+                    # ONE REQUEST FOR THE MATCHED HARP ONLY -- HOURLY SLICES FILTERED HERE IF THE SERVICE CANNOT FILTER
+                    if store is not None:
+                        rdatam = store.download(service_url, start, end, harp=harpnum, fallback_step=datetime.timedelta(minutes=60), workers=nworkers, property_type=ps, region_fields="*", cache=cache, dedup=dedup, limiter=limiter)
+                    else:
+                        rdatam = download_region(service_url, "production_02", start, end, harp=harpnum, fallback_step=datetime.timedelta(minutes=60), workers=nworkers, property_type=ps, region_fields="*", cache=cache, dedup=dedup, limiter=limiter)
                     
-                    #LOOPS FOR ALL REGIONS WITH THE SAME HARP NUMBER
-                    #CREATE HERE A LIST OF THE PROPERTIES YOU WANT A TS
+                    #HOURLY TIME SERIES OF THE MATCHED HARP, EVERY RECORD PUT IN ITS HOUR IN ONE PASS
+                    #LIST THE PROPERTIES YOU WANT A TS IN ts_properties.txt
                     #CHECK OUTPUT OF HELCATS_match_FLARECAST_1.py FOR STTRUCTURE OF PROPERTIES
                     #25 IS THE NUMBER OF HOURS FOR TS
-                    time = [str(np.nan) for i in range(25)]
-                    r_values_br = [np.nan for i in range(25)]
-                    alpha_fft_br = [np.nan for i in range(25)]
-                    usiz_tot = [np.nan for i in range(25)]
-                    di4_br = [np.nan for i in range(25)]
-                    wlsg_br = [np.nan for i in range(25)]
-                    usflux_total = [np.nan for i in range(25)]
-                    ushz_ave = [np.nan for i in range(25)]
-                    hgrad_bh_max = [np.nan for i in range(25)]
-                    ushz_tot = [np.nan for i in range(25)]
-                    ising_energy_blos = [np.nan for i in range(25)]
-                    usiz_max = [np.nan for i in range(25)]
-                    hz_max = [np.nan for i in range(25)]
-                    jz_max = [np.nan for i in range(25)]
-                    helicity_tot_dhdt = [np.nan for i in range(25)]
-                    helicity_tot_dedt = [np.nan for i in range(25)]
-                    #
-                    delta_time = [i*1.0 for i in range(25)]
-                    delta_time = delta_time[::-1]
-                    #
-                    for l in rdatam:
-                        #
-                        nharp = l["meta"]["harp"]
-                        ttime = l["time_start"]
-                        #
-                        ttime = dateutil.parser.parse(ttime,ignoretz=True)
-                        #
-                        ddelta = pass_time - ttime
-                        #
-                        diff1 = ddelta.days*24 + ddelta.seconds//3600.
-                        #
-                        for t,i1 in zip(delta_time,range(25)):
-                            if nharp == harpnum:
-                                #
-                                if diff1 == t:
-                                    try:
-                                        time[i1] = l["time_start"]
-                                        r_values_br[i1] = l["data"]["r_value_br_logr"]
-                                        alpha_fft_br[i1] = l["data"]["alpha_exp_fft_br"]['alpha']
-                                        usiz_tot[i1] = l["data"]["sharp_kw"]['usiz']['total']
-                                        di4_br[i1] = l["data"]["decay_index_br"]['max_l_over_hmin']
-                                        wlsg_br[i1] = l["data"]["wlsg_br"]['value_int']
-                                        usflux_total[i1] = l["data"]["sharp_kw"]['usflux']['total']
-                                        ushz_ave[i1] = l["data"]["sharp_kw"]['ushz']['ave']
-                                        hgrad_bh_max[i1] = l["data"]["sharp_kw"]['hgradbh']['max']
-                                        ushz_tot[i1] = l["data"]["sharp_kw"]['ushz']['total']
-                                        ising_energy_blos[i1] = l["data"]["ising_energy_blos"]['ising_energy']
-                                        usiz_max[i1] = l["data"]["sharp_kw"]['usiz']['max']
-                                        hz_max[i1] = l["data"]["sharp_kw"]['hz']['max']
-                                        jz_max[i1] = l["data"]["sharp_kw"]['jz']['max']
-                                        helicity_tot_dhdt[i1] = l["data"]["helicity_energy_bvec"]['abs_tot_dhdt']
-                                        helicity_tot_dedt[i1] = l["data"]["helicity_energy_bvec"]['abs_tot_dedt']
-                                    except:
-                                        continue
-                                else:
-                                    continue
+                    time, values = build_timeseries(rdatam, harpnum, pass_time, ts_spec, nhours=25)
                     #MAKE A STRUCTURE WITH TS
-                    fc_data = {'time': time, 'r_values_br':r_values_br,'alpha_fft_br':alpha_fft_br, 'usiz_tot': usiz_tot, 
-                    'di4_br':di4_br, 'wlsg_br':wlsg_br, 'usflux_total':usflux_total, 'ushz_ave':ushz_ave, 
-                    'hgrad_bh_max':hgrad_bh_max, 'usflux_total':usflux_total, 'ushz_tot':ushz_tot, 
-                    'ising_energy_blos':ising_energy_blos, 'usiz_max': usiz_max, 'hz_max':hz_max,
-                    'jz_max':jz_max, 'helicity_tot_dhdt':helicity_tot_dhdt, 'helicity_tot_dedt':helicity_tot_dedt}
+                    fc_data = timeseries_dict(time, values, ts_spec)
                     j["FC_data"] = fc_data
                     #
                     
             print ' '
+    if store is not None:
+        store.close()
     # FIND THE NUMBER OF REGIONS MATCHED
     one = 0
     for l in reduced_list:
@@ -372,4 +207,6 @@ if __name__ == "__main__":
     #
     with io.open('helcats_list_flarecast_properties_28July17_TS_top15_predictors_1.txt', 'w', encoding='utf-8') as f:
         f.write(json.dumps(reduced_list , ensure_ascii=False))
+    # SAME OUTPUT AS TYPED COLUMNS, THE TIME SERIES IN ONE (EVENT x HOUR x PROPERTY) ARRAY, SEE helcats_columnar.py
+    write_columns('helcats_list_flarecast_properties_28July17_TS_top15_predictors_1_columns', event_table(reduced_list, series=[l.get("FC_data") for l in reduced_list], properties=ts_spec))
     
\ No newline at end of file
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+End to end throughput of the matcher scripts, run against the local FLARECAST stand-in of
+flarecast_mock.py (no network needed). For every script it reports events/sec,
+requests/event, bytes/event and the peak memory of the script, e.g.
+
+    python benchmark.py --python python2 --latency 0.05 --payload 2000 --save baseline.json
+    python benchmark.py --python python2 --latency 0.05 --payload 2000 --baseline baseline.json
+
+Every script runs in a new temporary directory, so its response cache starts empty.
+"""
+from __future__ import print_function
+
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from flarecast_mock import MockService, regions_from_events, start
+from helcats_catalogue import iter_events, iter_json_array
+
+SCRIPTS = ["HELCATS_match_FLARECAST_1.py", "HELC_FL_TS.py"]
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# FUNCTION TO RUN A SCRIPT IN ITS OWN DIRECTORY, RETURNS (EXIT CODE, SECONDS, PEAK RSS IN MB)
+def run_script(python, script, workdir, service_url, rate=None):
+    env = dict(os.environ)
+    env["FLARECAST_URL"] = service_url
+    if rate is not None:
+        env["FLARECAST_RATE"] = str(rate)
+    env["PYTHONPATH"] = HERE + os.pathsep + env.get("PYTHONPATH", "")
+    with open(os.path.join(workdir, "stdout.txt"), "w") as out:
+        t0 = time.time()
+        proc = subprocess.Popen([python, os.path.join(HERE, script)], cwd=workdir, env=env,
+                                stdout=out, stderr=subprocess.STDOUT)
+        # wait4 GIVES THE RESOURCES OF THIS CHILD ONLY (ru_maxrss IN KB ON LINUX)
+        _, status, usage = os.wait4(proc.pid, 0)
+        seconds = time.time() - t0
+    return os.WEXITSTATUS(status), seconds, usage.ru_maxrss/1024.
+
+
+def benchmark(catalogue, python=sys.executable, scripts=SCRIPTS, nevents=None, latency=0.05,
+              payload=2000, background=10, page_size=None, rate=None, synthetic=None, seed=0,
+              keep=False):
+    """
+    catalogue:      HELCATS/LOWCAT catalogue, the scripts run on it and the stand-in serves
+                    one region at every event
+                    Type: string
+    python:         Interpreter of the scripts (they need Python 2)
+                    Type: string
+    scripts:        Scripts to run, from this directory
+                    Type: List of strings
+    nevents:        Only the first nevents events of the catalogue are used, None for all
+                    Type: int
+    latency, payload, background, page_size:    See flarecast_mock.MockService
+    rate:           Request rate limit of the scripts (FLARECAST_RATE), None for their own.
+                    Their limit is meant for the real service, a high rate measures the
+                    scripts themselves
+                    Type: float
+    synthetic:      If given, a synthetic catalogue of this many events (helcats_synthetic.py)
+                    is used instead of catalogue, and the stand-in serves its regions
+                    Type: int
+    seed:           Seed of the synthetic catalogue
+                    Type: int
+    keep:           Keep the working directories (outputs and stdout.txt of every script)
+                    Type: bool
+
+    returns:        Measures of every script
+                    Type: dict of dicts
+    """
+    from helcats_pipeline import SHARP_DATE
+
+    regions = None
+    if synthetic is not None:
+        from helcats_synthetic import generate
+        regions, events = generate(synthetic, seed=seed)
+        events = list(events)
+    else:
+        with io.open(catalogue, encoding="utf-8") as fp:
+            events = list(iter_json_array(fp))
+    if nevents is not None:
+        events = events[:nevents]
+    workdirs = [tempfile.mkdtemp(prefix="helcats_bench_") for _ in scripts]
+    for workdir in workdirs:
+        with open(os.path.join(workdir, "helcats_list.json"), "w") as f:
+            json.dump(events, f)
+    # THE EVENTS THE SCRIPTS TRY TO MATCH, EACH ONE GETS ITS REGION IN THE STAND-IN
+    matched = list(iter_events(os.path.join(workdirs[0], "helcats_list.json"), since=SHARP_DATE))
+    if regions is None:
+        regions = regions_from_events(matched)
+    service = MockService(regions, background=background, latency=latency, payload=payload,
+                          page_size=page_size)
+    server, url = start(service)
+    results = {}
+    try:
+        for script, workdir in zip(scripts, workdirs):
+            before = service.stats()
+            code, seconds, rss = run_script(python, script, workdir, url, rate)
+            after = service.stats()
+            n = max(len(matched), 1)
+            requests = after["requests"] - before["requests"]
+            nbytes = after["bytes"] - before["bytes"]
+            results[script] = {"exit_code": code, "events": len(matched), "seconds": seconds,
+                               "events_per_sec": len(matched)/seconds if seconds > 0 else 0.,
+                               "requests": requests, "requests_per_event": requests/float(n),
+                               "bytes": nbytes, "bytes_per_event": nbytes/float(n),
+                               "peak_rss_mb": rss}
+    finally:
+        server.shutdown()
+        if not keep:
+            for w in workdirs:
+                shutil.rmtree(w, ignore_errors=True)
+        else:
+            print("working directories kept:", " ".join(workdirs))
+    return results
+
+
+# FUNCTION TO PRINT THE MEASURES, AND THEIR RATIO TO A BASELINE IF GIVEN
+def report(results, baseline=None):
+    columns = ["events_per_sec", "requests_per_event", "bytes_per_event", "peak_rss_mb"]
+    print("%-30s %8s %8s" % ("script", "events", "seconds") +
+          "".join(" %18s" % c for c in columns))
+    for script, r in sorted(results.items()):
+        line = "%-30s %8d %8.2f" % (script, r["events"], r["seconds"])
+        for c in columns:
+            cell = "%.4g" % r[c]
+            if baseline and script in baseline and baseline[script].get(c):
+                cell += " (x%.2f)" % (r[c]/baseline[script][c])
+            line += " %18s" % cell
+        if r["exit_code"] != 0:
+            line += "  FAILED (exit code %d)" % r["exit_code"]
+        print(line)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Throughput of the matcher scripts against the "
+                                                 "local FLARECAST stand-in")
+    parser.add_argument("--catalogue", default=os.path.join(HERE, "data", "lowcat.json"))
+    parser.add_argument("--python", default=sys.executable, help="interpreter of the scripts")
+    parser.add_argument("--scripts", nargs="+", default=SCRIPTS)
+    parser.add_argument("--events", type=int, default=None, help="first N events only")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per answer")
+    parser.add_argument("--payload", type=int, default=2000, help="extra bytes per record")
+    parser.add_argument("--background", type=int, default=10, help="random regions per day")
+    parser.add_argument("--page-size", type=int, default=None)
+    parser.add_argument("--rate", type=float, default=None, help="request rate limit of the scripts")
+    parser.add_argument("--save", help="write the measures to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of a previous --save to compare with")
+    parser.add_argument("--synthetic", type=int, default=None,
+                        help="use a synthetic catalogue of this many events")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the working directories")
+    args = parser.parse_args()
+
+    results = benchmark(args.catalogue, python=args.python, scripts=args.scripts,
+                        nevents=args.events, latency=args.latency, payload=args.payload,
+                        background=args.background, page_size=args.page_size, rate=args.rate,
+                        synthetic=args.synthetic, seed=args.seed, keep=args.keep)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
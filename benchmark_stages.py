@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Scaling of the matching stages (catalogue reading, event locations, region index,
+matching, time series) with the size of the catalogue, on synthetic catalogues from
+helcats_synthetic.py. No service is needed, the region records are made locally, e.g.
+
+    python benchmark_stages.py 10000 100000 1000000 --save stages.json
+    python benchmark_stages.py 10000 100000 1000000 --baseline stages.json
+"""
+from __future__ import print_function
+
+import datetime
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import iso8601
+
+from flarecast_client import plan_windows
+from flarecast_index import RegionIndex, to_seconds
+from flarecast_mock import MockService
+from flarecast_ts import TS_PROPERTIES, PropertySpec, build_timeseries, timeseries_dict
+from helcats_catalogue import iter_events
+from helcats_match import event_locations
+from helcats_pipeline import SHARP_DATE, match_candidate, prepare_events
+from helcats_synthetic import generate, write_catalogue
+
+STAGES = ["catalogue", "locations", "prepare", "index", "match", "timeseries"]
+
+
+# FUNCTION TO GET THE PEAK MEMORY OF THIS PROCESS SO FAR (MB)
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+
+
+def run_stages(nevents, seed=0, max_records=2000000, ts_sample=2000, tol=15.0):
+    """
+    nevents:        Number of events of the synthetic catalogue
+                    Type: int
+    seed:           Seed of the catalogue
+                    Type: int
+    max_records:    At most this many region records are indexed, the candidates of the
+                    windows left out are not matched
+                    Type: int
+    ts_sample:      Number of matched events whose time series is built
+                    Type: int
+    tol:            Matching tolerance (degrees)
+                    Type: float
+
+    returns:        For every stage, the number of items processed, the time taken and the
+                    peak memory of the process at the end of the stage
+                    Type: dict of dicts
+    """
+    out = {}
+
+    def measure(stage, items, t0):
+        seconds = time.time() - t0
+        out[stage] = {"items": items, "seconds": seconds,
+                      "items_per_sec": items/seconds if seconds > 0 else 0.,
+                      "peak_rss_mb": peak_rss()}
+
+    workdir = tempfile.mkdtemp(prefix="helcats_stages_")
+    try:
+        regions, events = generate(nevents, seed=seed)
+        path = os.path.join(workdir, "helcats_list.json")
+        write_catalogue(path, events)
+
+        t0 = time.time()
+        events = list(iter_events(path, since=SHARP_DATE))
+        measure("catalogue", nevents, t0)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    t0 = time.time()
+    event_locations(events, "FL_LOC")
+    measure("locations", len(events), t0)
+
+    t0 = time.time()
+    candidates = prepare_events(events)
+    measure("prepare", len(events), t0)
+
+    # RECORDS OF THE MERGED WINDOWS, LIKE THE BULK DOWNLOAD OF THE MATCHER (METADATA ONLY)
+    service = MockService(regions, background=0)
+    plan = plan_windows([(c["start"], c["end"]) for c in candidates])
+    records = []
+    covered = []
+    for start, end, indices in plan:
+        if len(records) >= max_records:
+            break
+        records.extend(service.synthetic(to_seconds(start), to_seconds(end), properties=set()))
+        covered.extend(indices)
+    candidates = [candidates[i] for i in sorted(covered)]
+
+    t0 = time.time()
+    index = RegionIndex(records)
+    measure("index", len(records), t0)
+
+    t0 = time.time()
+    matches = []
+    for c in candidates:
+        r, q, _ = match_candidate(c, index, tol)
+        if r is not None:
+            matches.append((c, r, q))
+    measure("match", len(candidates), t0)
+    out["match"]["matched"] = len(matches)
+    del records, index
+
+    # THE RECORDS OF EVERY TIME SERIES ARE MADE BEFORE, ONLY THE BINNING IS TIMED
+    spec = PropertySpec(TS_PROPERTIES)
+    seconds = 0.
+    for c, r, q in matches[:ts_sample]:
+        harp = r["meta"]["harp"]
+        t = iso8601.parse_date(r["time_start"])
+        data = service.synthetic(to_seconds(t - datetime.timedelta(hours=24)),
+                                 to_seconds(t + datetime.timedelta(minutes=5)), harp=harp)
+        t0 = time.time()
+        timeseries_dict(*build_timeseries(data, harp, t, spec), properties=spec)
+        seconds += time.time() - t0
+    measure("timeseries", min(len(matches), ts_sample), time.time() - seconds)
+    return out
+
+
+# FUNCTION TO PRINT THE MEASURES, AND THE items/sec RATIO TO A BASELINE IF GIVEN
+def report(results, baseline=None):
+    print("%10s %-12s %10s %10s %18s %12s" % ("events", "stage", "items", "seconds",
+                                              "items_per_sec", "peak_rss_mb"))
+    for nevents in sorted(results, key=int):
+        for stage in STAGES:
+            r = results[nevents].get(stage)
+            if r is None:
+                continue
+            rate = "%.4g" % r["items_per_sec"]
+            b = (baseline or {}).get(nevents, {}).get(stage)
+            if b and b.get("items_per_sec"):
+                rate += " (x%.2f)" % (r["items_per_sec"]/b["items_per_sec"])
+            print("%10s %-12s %10d %10.3f %18s %12.1f" % (nevents, stage, r["items"], r["seconds"],
+                                                          rate, r["peak_rss_mb"]))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Scaling of the matching stages on synthetic "
+                                                 "catalogues")
+    parser.add_argument("sizes", type=int, nargs="*", default=[10000, 100000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-records", type=int, default=2000000)
+    parser.add_argument("--ts-sample", type=int, default=2000)
+    parser.add_argument("--save", help="write the measures to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of a previous --save to compare with")
+    args = parser.parse_args()
+
+    results = {}
+    # SMALLEST FIRST, THE PEAK MEMORY OF A SIZE INCLUDES THE SIZES BEFORE IT
+    for n in sorted(args.sizes):
+        print("catalogue of %d events..." % n)
+        results[str(n)] = run_stages(n, seed=args.seed, max_records=args.max_records,
+                                     ts_sample=args.ts_sample)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of FLARECAST property service responses, see download_range
+"""
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class ResponseCache(object):
+    """
+    Content addressed cache of downloaded time slices. Every slice is stored as a json
+    file named after the hash of the request (service url, dataset, time window and
+    query parameters), so the same request always hits the same file.
+
+    Several processes can share the directory (see helcats_pipeline.run_parallel): the
+    size of the cache is read again from disk every 1% of max_bytes written by this
+    process and before deleting anything, so the responses written by the others count too.
+
+    path:           Directory where the responses are stored, created if missing
+                    Type: string
+    max_bytes:      Total size of the cache. When it is exceeded the least recently
+                    used responses are deleted
+                    Type: int
+    ttl:            Age in seconds after which a response is downloaded again,
+                    None to keep responses forever (production data does not change)
+                    Type: float
+    offline:        If True never go to the network, slices missing from the cache are
+                    not downloaded and are reported like failed downloads (None, and
+                    added to the errors= of download_range)
+                    Type: bool
+    """
+
+    def __init__(self, path, max_bytes=2 * 1024 ** 3, ttl=None, offline=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._size = sum(size for _, _, size in self._entries())
+        # BYTES WRITTEN BY THIS PROCESS SINCE THE SIZE WAS READ FROM DISK
+        self._written = 0
+
+    # FUNCTION TO BUILD THE CACHE KEY OF A REQUEST
+    @staticmethod
+    def key(service_url, dataset, start, end, params):
+        params = sorted((str(k), str(v)) for k, v in params.items())
+        raw = json.dumps([service_url.rstrip("/"), dataset,
+                          start.isoformat(), end.isoformat(), params])
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + ".json")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                if name.endswith(".json"):
+                    f = os.path.join(root, name)
+                    try:
+                        st = os.stat(f)
+                    except OSError:
+                        # DELETED BY ANOTHER PROCESS
+                        continue
+                    yield f, st.st_mtime, st.st_size
+
+    def get(self, key, count=True):
+        """
+        count:      If False the lookup is not counted in hits and misses
+                    Type: bool
+
+        returns:    The cached list of records or None if missing or expired
+        """
+        f = self._file(key)
+        try:
+            mtime = os.path.getmtime(f)
+            if self.ttl is not None and time.time() - mtime > self.ttl:
+                self.misses += count
+                return None
+            with open(f) as fp:
+                data = json.load(fp)
+        except (IOError, OSError, ValueError):
+            self.misses += count
+            return None
+        # mtime IS THE LAST ACCESS TIME, USED FOR THE LRU EVICTION
+        try:
+            os.utime(f, None)
+        except OSError:
+            pass
+        self.hits += count
+        return data
+
+    def put(self, key, data):
+        f = self._file(key)
+        d = os.path.dirname(f)
+        if not os.path.isdir(d):
+            try:
+                os.makedirs(d)
+            except OSError:
+                pass
+        tmp = "%s.%d.%d.tmp" % (f, os.getpid(), threading.current_thread().ident)
+        with open(tmp, "w") as fp:
+            json.dump(data, fp)
+        # SIZES TAKEN BEFORE THE RENAME, ANOTHER PROCESS CAN DELETE f AT ANY TIME
+        size = os.path.getsize(tmp)
+        try:
+            old = os.path.getsize(f)
+        except OSError:
+            old = 0
+        try:
+            os.rename(tmp, f)
+        except OSError:
+            # WINDOWS DOES NOT REPLACE AN EXISTING FILE
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+            os.rename(tmp, f)
+        with self._lock:
+            self._size += size - old
+            self._written += size - old
+            if self._size > self.max_bytes or self._written > 0.01 * self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # READ THE SIZE FROM DISK (OTHER PROCESSES WRITE TOO), THEN DELETE LEAST RECENTLY USED
+        # RESPONSES UNTIL THE CACHE IS BACK TO 90% OF max_bytes
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        self._size = sum(size for _, _, size in entries)
+        self._written = 0
+        if self._size <= self.max_bytes:
+            return
+        for f, _, size in entries:
+            if self._size <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(f)
+                self._size -= size
+            except OSError:
+                continue
+
+    def clear(self):
+        with self._lock:
+            for f, _, _ in list(self._entries()):
+                try:
+                    os.remove(f)
+                except OSError:
+                    pass
+            self._size = 0
+            self._written = 0
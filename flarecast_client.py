@@ -0,0 +1,585 @@
+# -*- coding: utf-8 -*-
+"""
+Shared client for the FLARECAST property service, used by both
+HELCATS_match_FLARECAST_1.py and HELC_FL_TS.py
+"""
+from __future__ import print_function
+
+import codecs
+import datetime
+import threading
+import time
+
+try:
+    from urllib.parse import urljoin
+except ImportError:
+    from urlparse import urljoin
+
+import requests
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# MAXIMUM NUMBER OF KEEP-ALIVE CONNECTIONS KEPT OPEN PER HOST
+POOL_SIZE = 32
+
+_session = None
+_session_lock = threading.Lock()
+
+
+# FUNCTION TO GET THE SHARED (POOLED, KEEP-ALIVE) HTTP SESSION
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE,
+                                                    pool_maxsize=POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+    return _session
+
+
+# FUNCTION TO SPLIT A TIME RANGE IN DOWNLOAD SLICES
+def time_slices(start, end, step):
+    slices = []
+    while start < end:
+        end_step = min(start + step, end)
+        slices.append((start, end_step))
+        start += step
+    return slices
+
+
+# FIELDS OF AN ANSWER GIVING THE URL OF ITS NEXT PAGE, IF THE SERVICE PAGINATES
+NEXT_KEYS = ("next", "next_page")
+
+
+# FUNCTION TO GET THE URL OF THE NEXT PAGE OF AN ANSWER (FIELD OR Link HEADER) -- None IF LAST PAGE
+def next_page(url, answer, response):
+    for k in NEXT_KEYS:
+        if answer.get(k):
+            return urljoin(url, answer[k])
+    if "next" in response.links:
+        return urljoin(url, response.links["next"]["url"])
+    return None
+
+
+# FUNCTION TO DOWNLOAD A SINGLE TIME SLICE, ALL ITS PAGES -- RETURNS None ON ERROR
+def download_slice(session, service_url, dataset, start, end, params):
+    params = dict(params)
+    params["time_start"] = "between(%s,%s)" % (
+        start.isoformat(),
+        end.isoformat()
+    )
+    url = "%s/region/%s/list" % (service_url, dataset)
+    data = []
+    while url is not None:
+        response = None
+        try:
+            response = session.get(url, params=params)
+        except requests.exceptions.RequestException as ex:
+            print("exception while downloading: %s" % ex)
+
+        if response is None or response.status_code != 200:
+            try:
+                resp_msg = response.json() if response is not None else ""
+            except ValueError:
+                resp_msg = response.text
+            print("error while downloading time range (%s - %s): %s" % (
+                start, end, resp_msg
+            ))
+            return None
+        answer = response.json()
+        data.extend(answer["data"])
+        # THE NEXT PAGE URL ALREADY HAS ALL THE QUERY PARAMETERS
+        url = next_page(url, answer, response)
+        params = None
+    return data
+
+
+# FUNCTION TO GET A SINGLE TIME SLICE FROM THE CACHE, OR DOWNLOAD IT -- RETURNS None ON ERROR
+# -- ON A CACHE MISS, lookup((start, end)) CAN STILL FIND THE RECORDS IN OTHER CACHED SLICES
+def fetch_slice(session, service_url, dataset, start, end, params, cache=None, limiter=None,
+                lookup=None):
+    if cache is not None:
+        key = cache.key(service_url, dataset, start, end, params)
+        data = cache.get(key, count=lookup is None)
+        if lookup is not None:
+            if data is None:
+                data = lookup((start, end))
+            cache.hits += data is not None
+            cache.misses += data is None
+        if data is not None:
+            return data
+        if cache.offline:
+            print("time range (%s - %s) not in cache, skipped (offline)" % (start, end))
+            return None
+    # ONLY THE REQUESTS ACTUALLY SENT TO THE SERVICE COUNT IN THE RATE LIMIT
+    if limiter is not None:
+        limiter.acquire()
+    data = download_slice(session, service_url, dataset, start, end, params)
+    if cache is None:
+        return data
+    if data is not None:
+        cache.put(key, data)
+    return data
+
+
+# FUNCTION TO FIND AN ADAPTIVE SLICE IN THE CACHE WHEN A PREVIOUS RUN CUT THE SAME TIME RANGE
+# IN BIGGER OR SMALLER CELLS OF THE GRID OF sizer -- None IF IT IS NOT ALL CACHED
+def _cached_cells(cache, sizer, s, start, end, key, up=True):
+    from flarecast_dedup import trim_records
+
+    if up:
+        for c in sizer.covering(s, start, end):
+            data = cache.get(key(c), count=False)
+            if data is not None:
+                return trim_records(data, s[0], s[1])
+    halves = sizer.halves(s)
+    if halves is None:
+        return None
+    data = []
+    for h in halves:
+        part = cache.get(key(h), count=False)
+        if part is None:
+            part = _cached_cells(cache, sizer, h, start, end, key, up=False)
+        if part is None:
+            return None
+        data.extend(part)
+    return data
+
+
+# FUNCTION TO DOWNLOAD A TIME RANGE IN SLICES SIZED BY sizer, workers SLICES AT THE SAME TIME
+# -- WITH offline=True A MISSING SLICE IS NOT A FAILURE, THE SIZES ARE NOT CHANGED FOR IT
+def _download_adaptive(get, start, end, sizer, workers, offline=False):
+    def timed(s):
+        t0 = time.time()
+        data = get(s)
+        return data, time.time() - t0
+
+    results = {}
+    pending = {}
+    retry = []
+    cursor = start
+    pool = ThreadPoolExecutor(max_workers=min(workers, POOL_SIZE))
+    try:
+        while cursor < end or retry or pending:
+            # THE SIZE OF EVERY NEW SLICE USES ALL THE ANSWERS RECEIVED SO FAR
+            while len(pending) < workers and (retry or cursor < end):
+                if retry:
+                    s = retry.pop()
+                else:
+                    s = sizer.next_slice(cursor, start, end)
+                    cursor = s[1]
+                pending[pool.submit(timed, s)] = s
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for f in done:
+                s = pending.pop(f)
+                data, latency = f.result()
+                if data is None and offline:
+                    results[s] = data
+                    continue
+                sizer.update(s[1] - s[0], len(data) if data is not None else None, latency)
+                halves = sizer.halves(s) if data is None else None
+                if halves is not None:
+                    # FAILED SLICES ARE ASKED AGAIN IN THE TWO HALVES OF THEIR CELL
+                    print("time range (%s - %s) failed, asked again in two halves" % s)
+                    retry.extend(reversed(halves))
+                else:
+                    results[s] = data
+    finally:
+        pool.shutdown()
+    return sorted(results.items())
+
+
+def download_range(service_url, dataset, start, end, step=datetime.timedelta(days=30),
+                   workers=1, session=None, cache=None, keep=None, dedup=None,
+                   adaptive=None, limiter=None, errors=None, **params):
+    """
+    service_url:    URL to get to the service. This is all the part before '/ui', e.g.
+                    'http://cluster-r730-1:8002'
+                    'http://api.flarecast.eu/property'
+                    'http://localhost:8002'
+                    Type: string
+    dataset:        The dataset to download from
+                    Type: string
+    start, end:     Total start and end time of the data to download
+                    Type: datetime
+    step:           Time range of a single download slice
+                    The total range (start - end) will be splitted up in smaller time ranges
+                    with the size of 'step' and then every time range will be downloaded separately
+                    Type: timedelta
+    workers:        Maximum number of slices downloaded at the same time. With workers=1 the
+                    slices are downloaded one after the other
+                    Type: int
+    session:        HTTP session to download with, the shared pooled session is used if None
+                    Type: requests.Session
+    cache:          If given, slices are read from / stored in this on-disk cache, and only
+                    the slices missing from it are downloaded
+                    Type: flarecast_cache.ResponseCache
+    keep:           If given, only the records for which keep(record) is True are returned.
+                    Every slice is filtered as soon as it arrives
+                    Type: function(dict) -> bool
+    dedup:          If given, the time range is cut on the grid of dedup instead of 'step', and
+                    slices already downloaded (or being downloaded) by another call are shared
+                    Type: flarecast_dedup.SingleFlight
+    adaptive:       If given (and dedup is None), 'step' is ignored and the size of every slice is
+                    chosen from the answers already received, to get about the same number of
+                    records per request. Failed slices are asked again in smaller slices.
+                    Slices are cut on a fixed grid, and with a cache the slices cut
+                    differently by a previous run are reused
+                    Type: flarecast_rate.SliceSizer
+    limiter:        If given, the requests sent to the service (not those answered by the
+                    cache) wait for it, shared by all the downloads of a run
+                    Type: flarecast_rate.TokenBucket
+    errors:         If given, the (start, end) of the slices that could not be downloaded are
+                    added to it, so that callers can tell "no records" from "not downloaded"
+                    Type: list
+    params:         Keyword argument, will be passed as query parameters to the http request url:
+                    Examples:
+                    property_type="sfunction_blos,sfunction_br"
+                    nar=3120
+
+    returns:        List with all entries, like you would download the whole time range in one request
+                    Entries are in time order of the slices, whatever the order the slices arrived in
+                    Type: List of dicts
+    """
+    if session is None:
+        session = get_session()
+    if dedup is not None:
+        get_slice = dedup.fetch_slice
+        slices = time_slices(*dedup.align(start, end), step=dedup.grid)
+    else:
+        get_slice = fetch_slice
+        slices = time_slices(start, end, step)
+
+    def get(s):
+        return get_slice(session, service_url, dataset, s[0], s[1], params, cache, limiter)
+
+    def fetch(s):
+        data = get(s)
+        if data and keep is not None:
+            data = [r for r in data if keep(r)]
+        return data
+
+    if adaptive is not None and dedup is None:
+        def key(s):
+            return cache.key(service_url, dataset, s[0], s[1], params)
+
+        def lookup(s):
+            return _cached_cells(cache, adaptive, s, start, end, key)
+
+        def get_cell(s):
+            return fetch_slice(session, service_url, dataset, s[0], s[1], params, cache, limiter,
+                               lookup=lookup)
+
+        slices, results = [], []
+        offline = cache is not None and cache.offline
+        for s, data in _download_adaptive(get_cell, start, end, adaptive, workers, offline):
+            slices.append(s)
+            results.append([r for r in data if keep(r)] if data and keep is not None else data)
+    elif workers > 1 and len(slices) > 1:
+        pool = ThreadPoolExecutor(max_workers=min(workers, len(slices), POOL_SIZE))
+        try:
+            results = list(pool.map(fetch, slices))
+        finally:
+            pool.shutdown()
+    else:
+        results = [fetch(s) for s in slices]
+
+    all_data = []
+    for s, data in zip(slices, results):
+        if data:
+            all_data.extend(data)
+        elif data is None and errors is not None:
+            errors.append(s)
+    if dedup is not None:
+        from flarecast_dedup import trim_records
+        all_data = trim_records(all_data, start, end)
+
+    return all_data
+
+
+# FUNCTION TO STREAM THE RECORDS OF A SINGLE TIME SLICE, FOLLOWING THE PAGES -- NOTHING ON ERROR
+def stream_slice(session, service_url, dataset, start, end, params, chunk_size=1 << 16):
+    from helcats_catalogue import iter_json_items
+
+    params = dict(params)
+    params["time_start"] = "between(%s,%s)" % (
+        start.isoformat(),
+        end.isoformat()
+    )
+    url = "%s/region/%s/list" % (service_url, dataset)
+    while url is not None:
+        try:
+            response = session.get(url, params=params, stream=True)
+        except requests.exceptions.RequestException as ex:
+            print("exception while downloading: %s" % ex)
+            return
+        try:
+            if response.status_code != 200:
+                print("error while downloading time range (%s - %s): %s" % (
+                    start, end, response.text
+                ))
+                return
+            # THE RECORDS ARE DECODED AS THE BYTES ARRIVE, THE ANSWER IS NEVER HELD WHOLE
+            decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")()
+            chunks = (decoder.decode(b) for b in response.iter_content(chunk_size))
+            meta = {}
+            for r in iter_json_items(chunks, key="data", meta=meta):
+                yield r
+        finally:
+            response.close()
+        url = next_page(url, meta, response)
+        params = None
+
+
+def iter_range(service_url, dataset, start, end, step=datetime.timedelta(days=30),
+               session=None, cache=None, keep=None, **params):
+    """
+    Same as download_range, but the records are given one by one as they arrive instead
+    of in a list, so a whole range can be processed (e.g. by flarecast_ts.build_timeseries)
+    in constant memory. Slices are downloaded one after the other, and pages of the
+    service (next URL in the answer or in the Link header) are followed.
+
+    service_url, dataset, start, end, step, session, keep, params:  See download_range
+    cache:          If given, slices found in this cache are read from it. Streamed slices
+                    are not stored in it (that would need the whole slice in memory)
+                    Type: flarecast_cache.ResponseCache
+
+    returns:        Generator of the records, in time order of the slices
+                    Type: generator of dicts
+    """
+    if session is None:
+        session = get_session()
+    for s in time_slices(start, end, step):
+        records = None
+        if cache is not None:
+            records = cache.get(cache.key(service_url, dataset, s[0], s[1], params))
+            if records is None and cache.offline:
+                print("time range (%s - %s) not in cache, skipped (offline)" % s)
+                continue
+        if records is None:
+            records = stream_slice(session, service_url, dataset, s[0], s[1], params)
+        for r in records:
+            if keep is None or keep(r):
+                yield r
+
+
+# SERVICES THAT DO NOT FILTER BY REGION, {(service_url, parameter): False}
+_server_filters = {}
+
+
+def download_region(service_url, dataset, start, end, harp=None, nar=None,
+                    fallback_step=datetime.timedelta(minutes=60), workers=1,
+                    session=None, cache=None, dedup=None, limiter=None, errors=None, **params):
+    """
+    Downloads the records of a single region (HARP or NOAA number) for the whole time range
+    in one request, asking the service to filter by region. If the service cannot filter
+    (records of other regions in the answer) the range is downloaded in slices of
+    fallback_step and filtered here, slice by slice, for this and all the next calls. If
+    the filtered request fails, only this call falls back to the slices.
+
+    service_url:    See download_range
+    dataset:        See download_range
+    start, end:     See download_range
+    harp:           HARP number of the region
+                    Type: int
+    nar:            NOAA number of the region (+10000, like in meta.nar), used if harp is None
+                    Type: int
+    fallback_step:  Slice size when the service cannot filter by region
+                    Type: timedelta
+    workers, session, cache, limiter, errors, params:   See download_range
+    dedup:          If given, the window is extended to the grid of dedup so that identical
+                    windows share the same request, and a window inside one already
+                    downloaded for the same region is served from memory
+                    Type: flarecast_dedup.SingleFlight
+
+    returns:        Records of the region, in time order
+                    Type: List of dicts
+    """
+    if harp is not None:
+        name, value = "harp", harp
+        keep = lambda r: r.get("meta", {}).get("harp") == harp
+    else:
+        name, value = "nar", nar
+        keep = lambda r: nar in (r.get("meta", {}).get("nar") or [])
+    if session is None:
+        session = get_session()
+
+    if _server_filters.get((service_url, name), True):
+        filtered = dict(params)
+        filtered[name] = value
+        if dedup is not None:
+            from flarecast_dedup import trim_records
+            data = dedup.fetch_slice(session, service_url, dataset, *dedup.align(start, end),
+                                     params=filtered, cache=cache, limiter=limiter)
+            data = trim_records(data, start, end) if data is not None else None
+        else:
+            data = fetch_slice(session, service_url, dataset, start, end, filtered, cache, limiter)
+        if data is None:
+            # AN ERROR (TIMEOUT, CONNECTION...) SAYS NOTHING ABOUT THE FILTER, ONLY THIS CALL FALLS BACK
+            print("time range (%s - %s) of %s %s failed, asked again in slices" % (start, end, name, value))
+        elif all(keep(r) for r in data):
+            return data
+        else:
+            print("service does not filter by %s, filtering the records here" % name)
+            _server_filters[(service_url, name)] = False
+
+    return download_range(service_url, dataset, start, end, step=fallback_step, workers=workers,
+                          session=session, cache=cache, keep=keep, dedup=dedup, limiter=limiter,
+                          errors=errors, **params)
+
+
+# FUNCTION TO MERGE OVERLAPPING OR NEARBY TIME WINDOWS INTO BULK REQUESTS
+def plan_windows(windows, gap=datetime.timedelta(minutes=30), max_span=datetime.timedelta(days=2)):
+    """
+    windows:        (start, end) time window of every event
+                    Type: List of (datetime, datetime)
+    gap:            Windows closer than this are merged into the same bulk request
+                    Type: timedelta
+    max_span:       A bulk request is never extended beyond this total length
+                    Type: timedelta
+
+    returns:        Bulk requests, with the indices of the windows each one covers. Bulk
+                    requests never overlap: when max_span stops a merge, the next request
+                    starts where the previous one ends, and the first windows it covers can
+                    start in the previous request
+                    Type: List of (datetime, datetime, List of int)
+    """
+    order = sorted(range(len(windows)), key=lambda i: windows[i])
+    plan = []
+    for i in order:
+        start, end = windows[i]
+        if plan and end <= plan[-1][1]:
+            # ALREADY DOWNLOADED BY THE PREVIOUS REQUEST (LONGER THAN max_span IF IT IS A SINGLE WINDOW)
+            plan[-1][2].append(i)
+        elif plan and start - plan[-1][1] <= gap and end - plan[-1][0] <= max_span:
+            plan[-1][1] = end
+            plan[-1][2].append(i)
+        else:
+            # A MERGE STOPPED BY max_span ALWAYS ENDS AFTER THE PREVIOUS REQUEST
+            plan.append([max(start, plan[-1][1]) if plan else start, end, [i]])
+    return [tuple(p) for p in plan]
+
+
+def download_bulk(service_url, dataset, windows, gap=datetime.timedelta(minutes=30),
+                  max_span=datetime.timedelta(days=2), **kwargs):
+    """
+    Downloads the records of many (possibly overlapping) time windows with the smallest
+    number of requests: windows are merged with plan_windows and every merged window is
+    downloaded once with download_range.
+
+    service_url:    See download_range
+    dataset:        See download_range
+    windows:        (start, end) time window of every event, timezone aware
+                    Type: List of (datetime, datetime)
+    gap, max_span:  See plan_windows
+    kwargs:         Passed to download_range (step, workers, cache, query parameters...)
+
+    returns:        All the records of the merged windows
+                    Type: List of dicts
+    """
+    plan = plan_windows(windows, gap=gap, max_span=max_span)
+    print("%d time windows merged in %d bulk requests" % (len(windows), len(plan)))
+    all_data = []
+    for start, end, _ in plan:
+        all_data.extend(download_range(service_url, dataset, start, end, **kwargs))
+    return all_data
+
+
+def download_windows(service_url, dataset, windows, gap=datetime.timedelta(minutes=30),
+                     max_span=datetime.timedelta(days=2), **kwargs):
+    """
+    Same as download_bulk, but the records are given back to each window
+
+    returns:        For every window, the list of records whose time_start is inside it,
+                    like download_range(service_url, dataset, start, end) would return
+                    Type: List of List of dicts
+    """
+    from flarecast_index import RegionIndex
+
+    index = RegionIndex(download_bulk(service_url, dataset, windows, gap=gap,
+                                      max_span=max_span, **kwargs))
+    return [index.window(start, end) for start, end in windows]
+
+
+# FUNCTION TO TELL IF TWO RECORDS ARE THE SAME REGION AT THE SAME TIME
+def same_region(a, b):
+    from flarecast_index import to_seconds
+
+    if to_seconds(a["time_start"]) != to_seconds(b["time_start"]):
+        return False
+    ma, mb = a.get("meta", {}), b.get("meta", {})
+    if ma.get("harp") is not None or mb.get("harp") is not None:
+        return ma.get("harp") == mb.get("harp")
+    return (a.get("lat_hg"), a.get("long_hg")) == (b.get("lat_hg"), b.get("long_hg"))
+
+
+def download_records(service_url, dataset, records, margin=datetime.timedelta(minutes=1),
+                     workers=8, store=None, **kwargs):
+    """
+    Second phase of a two phase download: the candidates are downloaded with metadata only,
+    and the properties are downloaded afterwards only for the matched records. The records
+    of the same HARP at the same (or close) times share one request, filtered by HARP
+    (see download_region).
+
+    service_url:    See download_range
+    dataset:        See download_range
+    records:        Matched records (at least time_start and meta.harp)
+                    Type: List of dicts
+    margin:         Time range downloaded around the time_start of every record
+                    Type: timedelta
+    workers:        Maximum number of requests sent at the same time
+                    Type: int
+    store:          If given, the records are read from this local store when they were
+                    downloaded before, and the downloaded ones are added to it
+                    Type: flarecast_store.RegionStore (of dataset)
+    kwargs:         Passed to download_region (cache, property_type, region_fields...)
+
+    returns:        Full record for every matched record, None if it was not found
+                    Type: List of dicts
+    """
+    import iso8601
+
+    # {harp: ([window of every record], [position of every record in records])}
+    by_harp = {}
+    for k, record in enumerate(records):
+        t = iso8601.parse_date(record["time_start"])
+        windows, positions = by_harp.setdefault(record.get("meta", {}).get("harp"), ([], []))
+        windows.append((t - margin, t + margin))
+        positions.append(k)
+    batches = []
+    for harp, (windows, positions) in by_harp.items():
+        for start, end, covered in plan_windows(windows, gap=datetime.timedelta(0)):
+            batches.append((harp, start, end, [positions[i] for i in covered]))
+
+    def fetch(batch):
+        harp, start, end, positions = batch
+        if store is not None:
+            data = store.download(service_url, start, end, harp=harp, **kwargs)
+        elif harp is not None:
+            data = download_region(service_url, dataset, start, end, harp=harp, **kwargs)
+        else:
+            data = download_range(service_url, dataset, start, end, **kwargs)
+        found = []
+        for k in positions:
+            full = next((r for r in data if same_region(r, records[k])), None)
+            if full is None:
+                print("properties of region %s at %s not found" % (harp, records[k]["time_start"]))
+            found.append((k, full))
+        return found
+
+    # THE CONNECTION OF A STORE BELONGS TO THIS THREAD, ITS REQUESTS ARE ASKED ONE AFTER THE OTHER
+    if workers > 1 and len(batches) > 1 and store is None:
+        pool = ThreadPoolExecutor(max_workers=min(workers, len(batches), POOL_SIZE))
+        try:
+            parts = list(pool.map(fetch, batches))
+        finally:
+            pool.shutdown()
+    else:
+        parts = [fetch(b) for b in batches]
+    out = [None]*len(records)
+    for part in parts:
+        for k, full in part:
+            out[k] = full
+    return out
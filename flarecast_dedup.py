@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+De-duplication of FLARECAST requests: identical requests made at the same time share a
+single download, and requests already made are answered from memory
+"""
+import collections
+import datetime
+import json
+import threading
+
+from concurrent.futures import Future
+
+from flarecast_index import EPOCH, to_seconds
+
+
+# FUNCTION TO REMOVE RECORDS OUTSIDE [start, end] AND RECORDS RETURNED TWICE (BY ADJACENT SLICES)
+def trim_records(records, start, end):
+    t0, t1 = to_seconds(start), to_seconds(end)
+    seen = set()
+    out = []
+    for r in records:
+        t = to_seconds(r["time_start"])
+        if t < t0 or t > t1:
+            continue
+        meta = r.get("meta", {})
+        key = (t, meta.get("harp"), tuple(meta.get("nar") or ()), r.get("lat_hg"), r.get("long_hg"))
+        if key in seen:
+            continue
+        seen.add(key)
+        out.append(r)
+    return out
+
+
+class SingleFlight(object):
+    """
+    Shared in front of download_range (dedup= argument) by all the downloads of a run.
+    Time ranges are cut on a fixed time grid, so overlapping windows ask for the same
+    slices: a slice already downloaded is served from memory, a slice being downloaded by
+    another thread is waited for instead of being asked again. A request inside a longer
+    window already downloaded with the same parameters (e.g. the same HARP) is served from
+    that window.
+
+    grid:           Size of the slices of the grid, slices start at multiples of grid
+                    since 1970-01-01
+                    Type: timedelta
+    max_bytes:      Size (as JSON) of the downloaded slices kept in memory, the least recently
+                    used are dropped. In memory the records take a few times more
+                    Type: int
+    """
+
+    def __init__(self, grid=datetime.timedelta(hours=1), max_bytes=4 * 1024 ** 2):
+        self.grid = grid
+        self.max_bytes = max_bytes
+        self.shared = 0
+        self.size = 0
+        # {key: (records, size)}, {key: (group, t0, t1)} AND {group: set of keys}
+        self._done = collections.OrderedDict()
+        self._spans = {}
+        self._groups = {}
+        self._running = {}
+        self._lock = threading.Lock()
+
+    # FUNCTION TO EXTEND A WINDOW TO THE GRID
+    def align(self, start, end):
+        g = self.grid.total_seconds()
+        t0 = to_seconds(start) // g * g
+        t1 = -(-to_seconds(end) // g) * g
+        return (EPOCH + datetime.timedelta(seconds=t0),
+                EPOCH + datetime.timedelta(seconds=max(t1, t0 + g)))
+
+    def _keep(self, key, data, span):
+        # CALLED WITH THE LOCK HELD -- THE RECORDS OF A SLICE HAVE THE SAME FIELDS, THE FIRST
+        # ONE GIVES THE SIZE OF ALL (EMPTY SLICES COUNT THEIR KEY, SO THAT THEY ARE DROPPED TOO)
+        size = len(key) + (len(json.dumps(data[0]))*len(data) if data else 0)
+        if size > self.max_bytes:
+            return
+        self._done[key] = (data, size)
+        self.size += size
+        if span is not None:
+            self._spans[key] = span
+            self._groups.setdefault(span[0], set()).add(key)
+        while self.size > self.max_bytes:
+            old, (_, old_size) = self._done.popitem(last=False)
+            self.size -= old_size
+            if old in self._spans:
+                group = self._spans.pop(old)[0]
+                self._groups[group].discard(old)
+                if not self._groups[group]:
+                    del self._groups[group]
+
+    def fetch(self, key, func, span=None):
+        """
+        key:        Normalised request, e.g. flarecast_cache.ResponseCache.key(...)
+                    Type: string
+        func:       Downloads the request, returns None on error
+                    Type: function() -> List of dicts
+        span:       (group, t0, t1) time window of the request (seconds since 1970) and
+                    its other parameters, so that later requests inside it are served from it
+                    Type: tuple
+
+        returns:    Result of func, shared by all the calls with the same key. An exception
+                    raised by func is raised by all the calls that waited for it
+                    Type: List of dicts
+        """
+        with self._lock:
+            if key in self._done:
+                self._done[key] = self._done.pop(key)
+                self.shared += 1
+                return list(self._done[key][0])
+            future = self._running.get(key)
+            owner = future is None
+            if owner:
+                future = self._running[key] = Future()
+            else:
+                self.shared += 1
+        if not owner:
+            data = future.result()
+            return list(data) if data is not None else None
+        try:
+            data = func()
+        except BaseException as e:
+            with self._lock:
+                del self._running[key]
+            # THE CALLS WAITING FOR THIS ONE GET THE SAME EXCEPTION
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._running[key]
+            # ERRORS ARE NOT KEPT, THE NEXT CALL TRIES AGAIN
+            if data is not None:
+                self._keep(key, data, span)
+        future.set_result(data)
+        return list(data) if data is not None else None
+
+    # FUNCTION TO GET THE RECORDS OF A WINDOW FROM A LONGER ONE IN MEMORY, None IF THERE IS NONE
+    def covering(self, group, start, end):
+        t0, t1 = to_seconds(start), to_seconds(end)
+        with self._lock:
+            for key in self._groups.get(group, ()):
+                _, a, b = self._spans[key]
+                if a <= t0 and t1 <= b:
+                    self._done[key] = self._done.pop(key)
+                    self.shared += 1
+                    data = self._done[key][0]
+                    break
+            else:
+                return None
+        return trim_records(data, start, end)
+
+    def fetch_slice(self, session, service_url, dataset, start, end, params, cache=None,
+                    limiter=None):
+        """
+        Same as flarecast_client.fetch_slice, shared between identical requests
+        """
+        from flarecast_cache import ResponseCache
+        from flarecast_client import fetch_slice
+
+        group = (service_url.rstrip("/"), dataset,
+                 tuple(sorted((str(k), str(v)) for k, v in params.items())))
+        data = self.covering(group, start, end)
+        if data is not None:
+            return data
+        key = ResponseCache.key(service_url, dataset, start, end, params)
+        return self.fetch(key, lambda: fetch_slice(session, service_url, dataset, start, end,
+                                                   params, cache, limiter),
+                          span=(group, to_seconds(start), to_seconds(end)))
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory index over downloaded FLARECAST region records
+"""
+import datetime
+
+import iso8601
+import numpy as np
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=iso8601.UTC)
+
+
+# FUNCTION TO TRANSFORM A DATETIME OR ISO STRING TO SECONDS SINCE 1970 (UTC)
+def to_seconds(t):
+    if not isinstance(t, datetime.datetime):
+        t = iso8601.parse_date(t)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=iso8601.UTC)
+    return (t - EPOCH).total_seconds()
+
+
+class RegionIndex(object):
+    """
+    Records sorted by time_start, plus hash indexes on meta.nar and meta.harp.
+    Every lookup is a binary search, so getting the candidates of an event does not
+    depend on how many records were downloaded.
+
+    records:        Region records as returned by download_range
+                    Type: List of dicts
+    """
+
+    def __init__(self, records):
+        times = np.array([to_seconds(r["time_start"]) for r in records], dtype=float)
+        order = np.argsort(times, kind="mergesort")
+        self.times = times[order]
+        self.records = [records[k] for k in order]
+        # POSITIONS OF THE RECORDS (NaN IF UNKNOWN), READ ONCE FOR ALL THE EVENTS MATCHED ON THE INDEX
+        self.lats = np.array([r.get("lat_hg") for r in self.records], dtype=float)
+        self.lons = np.array([r.get("long_hg") for r in self.records], dtype=float)
+        self.nar = self._hash("nar")
+        self.harp = self._hash("harp")
+
+    def __len__(self):
+        return len(self.records)
+
+    def _hash(self, field):
+        positions = {}
+        for k, r in enumerate(self.records):
+            value = r.get("meta", {}).get(field)
+            if value is None:
+                continue
+            for v in (value if isinstance(value, list) else [value]):
+                positions.setdefault(v, []).append(k)
+        # POSITIONS ARE ALREADY IN TIME ORDER, KEEP THEIR TIMES FOR THE WINDOW SEARCH
+        return dict((v, (np.array(p, dtype=int), self.times[p])) for v, p in positions.items())
+
+    def _span(self, times, start, end):
+        lo = np.searchsorted(times, to_seconds(start), side="left")
+        hi = np.searchsorted(times, to_seconds(end), side="right")
+        return lo, hi
+
+    def window(self, start, end):
+        """
+        returns:    Records with start <= time_start <= end, in time order
+                    Type: List of dicts
+        """
+        lo, hi = self._span(self.times, start, end)
+        return self.records[lo:hi]
+
+    def closest(self, lat, lon, start, end, tol):
+        """
+        lat, lon:   Position of the source region (degrees)
+                    Type: float
+        tol:        Maximum angular distance (degrees), see helcats_match.closest_region
+
+        returns:    Record with start <= time_start <= end closest to the position and its
+                    angular distance (degrees), (None, None) if none is within tol
+                    Type: (dict, float)
+        """
+        from helcats_match import closest_region
+
+        lo, hi = self._span(self.times, start, end)
+        m, dist = closest_region(lat, lon, self.lats[lo:hi], self.lons[lo:hi], tol)
+        if m is None:
+            return None, None
+        return self.records[lo + m], dist
+
+    def _lookup(self, table, value, start, end):
+        if value not in table:
+            return []
+        positions, times = table[value]
+        if start is not None:
+            lo, hi = self._span(times, start, end)
+            positions = positions[lo:hi]
+        return [self.records[k] for k in positions]
+
+    def by_nar(self, nar, start=None, end=None):
+        """
+        returns:    Records with NOAA number nar in meta.nar (and inside [start, end] if given)
+                    Type: List of dicts
+        """
+        return self._lookup(self.nar, nar, start, end)
+
+    def by_harp(self, harp, start=None, end=None):
+        """
+        returns:    Records of HARP harp (and inside [start, end] if given)
+                    Type: List of dicts
+        """
+        return self._lookup(self.harp, harp, start, end)
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the /region/<dataset>/list endpoint of the FLARECAST property service,
+serving synthetic (or recorded) region records with a configurable latency and payload,
+so that the scripts can be run and timed without the real service, e.g.
+
+    python flarecast_mock.py --catalogue helcats_list.json --port 8002 --latency 0.2
+    FLARECAST_URL=http://localhost:8002 python HELC_FL_TS.py
+"""
+from __future__ import print_function
+
+import bisect
+import datetime
+import json
+import math
+import random
+import re
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlencode, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import urlencode
+    from urlparse import parse_qs, urlparse
+
+import iso8601
+
+from flarecast_index import EPOCH, RegionIndex, to_seconds
+from flarecast_ts import TS_PROPERTIES
+
+_BETWEEN = re.compile(r"between\((.*),(.*)\)")
+# SOLAR DIFFERENTIAL ROTATION (DEGREES PER DAY), SAME AS helcats_match.rot_locations
+_ROT = (14.713, -2.396, -1.787)
+
+
+class Region(object):
+    """
+    Synthetic region, seen from t0 to t1 (seconds since 1970), at latitude lat and at
+    longitude lon at time tref, rotating with the Sun.
+    """
+
+    def __init__(self, harp, nar, lat, lon, tref, t0, t1):
+        self.harp = harp
+        self.nar = nar
+        self.lat = lat
+        self.lon = lon
+        self.tref = tref
+        self.t0 = t0
+        self.t1 = t1
+        s2 = math.sin(math.radians(lat))**2
+        self.rate = (_ROT[0] + _ROT[1]*s2 + _ROT[2]*s2*s2)/86400.
+
+    def longitude(self, t):
+        return self.lon + (t - self.tref)*self.rate
+
+
+# FUNCTION TO CREATE A REGION AT THE SOURCE REGION OF EVERY EVENT OF A CATALOGUE
+def regions_from_events(events, loc_key="FL_LOC", before=datetime.timedelta(days=3),
+                        after=datetime.timedelta(days=1)):
+    """
+    events:         HELCATS/LOWCAT events
+                    Type: List of dicts
+    loc_key:        Location field of the events, see helcats_match.event_locations
+                    Type: string
+    before, after:  Time the region is seen before and after the flare
+                    Type: timedelta
+
+    returns:        One region per event with a known location, at the event location at
+                    FL_STARTTIME, with the NOAA number SRS_NO (+10000) if any
+                    Type: List of Region
+    """
+    from helcats_catalogue import parse_time
+    from helcats_match import event_locations
+
+    lats, lons, _ = event_locations(events, loc_key)
+    regions = []
+    for i, e in enumerate(events):
+        t = parse_time(e["FL_STARTTIME"])
+        if t is None or math.isnan(lats[i]):
+            continue
+        try:
+            nar = [int(e["SRS_NO"]) + 10000] if int(e["SRS_NO"]) > 0 else []
+        except (KeyError, ValueError):
+            nar = []
+        tref = to_seconds(t)
+        regions.append(Region(i + 1, nar, float(lats[i]), float(lons[i]), tref,
+                              tref - before.total_seconds(), tref + after.total_seconds()))
+    return regions
+
+
+class MockService(object):
+    """
+    Answers the queries of the stand-in service, and counts them.
+
+    regions:        Synthetic regions, e.g. regions_from_events(...)
+                    Type: List of Region
+    records:        Recorded region records served as they are, instead of the synthetic ones
+                    Type: List of dicts
+    background:     Number of extra random regions seen every day (not matching any event)
+                    Type: int
+    cadence:        Time between two records of a region (synthetic records)
+                    Type: timedelta
+    latency:        Time (seconds) taken by every answer, plus latency_per_record per record
+                    Type: float
+    payload:        Size (bytes) added to the properties of every record
+                    Type: int
+    page_size:      If given, answers hold at most page_size records and give the URL of
+                    the next page in the field 'next'
+                    Type: int
+    seed:           Seed of the background regions and property values
+                    Type: int
+    """
+
+    def __init__(self, regions=(), records=None, background=10,
+                 cadence=datetime.timedelta(minutes=12), latency=0., latency_per_record=0.,
+                 payload=0, page_size=None, seed=0):
+        self.regions = sorted(regions, key=lambda r: r.t0)
+        self._starts = [r.t0 for r in self.regions]
+        self._span = max([r.t1 - r.t0 for r in self.regions] or [0.])
+        self.index = RegionIndex(records) if records is not None else None
+        self.background = background
+        self.cadence = cadence.total_seconds()
+        self.latency = latency
+        self.latency_per_record = latency_per_record
+        self.payload = payload
+        self.page_size = page_size
+        self.seed = seed
+        self.requests = 0
+        self.bytes = 0
+        self.records = 0
+        self._lock = threading.Lock()
+
+    # FUNCTION TO GET THE BACKGROUND REGIONS OF A DAY (ALWAYS THE SAME FOR A GIVEN DAY AND SEED)
+    def _background(self, day):
+        rnd = random.Random(self.seed*1000003 + day)
+        out = []
+        for k in range(self.background):
+            tref = day*86400.
+            out.append(Region(1000000 + day*100 + k, [], rnd.uniform(-35., 35.),
+                              rnd.uniform(-80., 80.), tref, tref, tref + 86400. - 1))
+        return out
+
+    def _data(self, region, t, properties):
+        if properties is not None and not properties:
+            return {}
+        rnd = random.Random(hash((self.seed, region.harp, int(t))))
+        data = {}
+        for _, path in TS_PROPERTIES:
+            keys = path.split('.')
+            if properties is not None and keys[0] not in properties:
+                continue
+            d = data
+            for k in keys[:-1]:
+                d = d.setdefault(k, {})
+            d[keys[-1]] = rnd.lognormvariate(0., 1.)
+        if self.payload and data:
+            pad = max(self.payload//len(data), 1)
+            for v in data.values():
+                if isinstance(v, dict):
+                    v["padding"] = "x"*pad
+        return data
+
+    def synthetic(self, t0, t1, properties=None, harp=None):
+        """
+        returns:    Synthetic records with time_start between t0 and t1 (seconds since 1970),
+                    only those of the region harp if given
+                    Type: List of dicts
+        """
+        lo = bisect.bisect_left(self._starts, t0 - self._span)
+        hi = bisect.bisect_right(self._starts, t1)
+        regions = [r for r in self.regions[lo:hi] if r.t1 >= t0]
+        for day in range(int(t0//86400), int(t1//86400) + 1):
+            regions.extend(self._background(day))
+        if harp is not None:
+            regions = [r for r in regions if r.harp == harp]
+        out = []
+        for r in regions:
+            t = math.ceil(max(t0, r.t0)/self.cadence)*self.cadence
+            while t <= min(t1, r.t1):
+                time_start = EPOCH + datetime.timedelta(seconds=t)
+                out.append({"time_start": time_start.strftime('%Y-%m-%dT%H:%M:%S+00:00'),
+                            "lat_hg": round(r.lat, 3), "long_hg": round(r.longitude(t), 3),
+                            "meta": {"harp": r.harp, "nar": r.nar},
+                            "data": self._data(r, t, properties)})
+                t += self.cadence
+        out.sort(key=lambda x: (x["time_start"], x["meta"]["harp"]))
+        return out
+
+    def query(self, params):
+        """
+        params:     Query parameters of a /region/<dataset>/list request
+                    Type: dict of strings
+
+        returns:    Answer, as the service would give it
+                    Type: dict
+        """
+        m = _BETWEEN.match(params.get("time_start", ""))
+        if m is None:
+            return {"has_error": True, "data": [], "result-count": 0}
+        start, end = iso8601.parse_date(m.group(1)), iso8601.parse_date(m.group(2))
+        ps = params.get("property_type", "*")
+        properties = None if ps == "*" else set(p for p in ps.split(",") if p)
+        if self.index is not None:
+            records = self.index.window(start, end)
+        else:
+            harp = int(params["harp"]) if "harp" in params else None
+            records = self.synthetic(to_seconds(start), to_seconds(end), properties, harp)
+        if "harp" in params:
+            records = [r for r in records if str(r["meta"]["harp"]) == params["harp"]]
+        if "nar" in params:
+            records = [r for r in records if int(params["nar"]) in (r["meta"]["nar"] or [])]
+        fields = params.get("region_fields", "*")
+        if fields != "*":
+            fields = fields.split(",")
+            records = [dict((k, r[k]) for k in fields if k in r) for r in records]
+        answer = {"has_error": False, "result-count": len(records)}
+        if self.page_size:
+            offset = int(params.get("offset", 0))
+            if offset + self.page_size < len(records):
+                answer["next"] = "?" + urlencode(dict(params, offset=offset + self.page_size))
+            records = records[offset:offset + self.page_size]
+        answer["data"] = records
+        return answer
+
+    def count(self, nbytes, nrecords):
+        with self._lock:
+            self.requests += 1
+            self.bytes += nbytes
+            self.records += nrecords
+
+    def stats(self):
+        """
+        returns:    Number of requests, bytes and records served so far
+                    Type: dict
+        """
+        with self._lock:
+            return {"requests": self.requests, "bytes": self.bytes, "records": self.records}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code, body):
+        body = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def do_GET(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            self._send(200, service.stats())
+            return
+        if not re.match(r"^/region/[^/]+/list$", url.path):
+            self._send(404, {"has_error": True, "error": "not found"})
+            return
+        params = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        answer = service.query(params)
+        wait = service.latency + service.latency_per_record*len(answer["data"])
+        if wait > 0:
+            time.sleep(wait)
+        nbytes = self._send(400 if answer["has_error"] else 200, answer)
+        service.count(nbytes, len(answer["data"]))
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start(service, host="127.0.0.1", port=0):
+    """
+    Serves service in a background thread.
+
+    service:        The stand-in service
+                    Type: MockService
+    port:           Port to listen on, 0 for any free port
+
+    returns:        The running server (server.shutdown() stops it) and its service URL,
+                    to give to download_range or FLARECAST_URL
+                    Type: (HTTPServer, string)
+    """
+    server = _Server((host, port), _Handler)
+    server.service = service
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, "http://%s:%d" % (host, server.server_address[1])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local stand-in of the FLARECAST property service")
+    parser.add_argument("--catalogue", default="helcats_list.json",
+                        help="HELCATS/LOWCAT catalogue, one region is created at every event")
+    parser.add_argument("--records", help="JSON list of recorded region records to serve instead")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per answer")
+    parser.add_argument("--latency-per-record", type=float, default=0.)
+    parser.add_argument("--payload", type=int, default=2000, help="extra bytes per record")
+    parser.add_argument("--background", type=int, default=10, help="random regions per day")
+    parser.add_argument("--page-size", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.records:
+        with open(args.records) as f:
+            service = MockService(records=json.load(f))
+    else:
+        from helcats_catalogue import iter_events
+        service = MockService(regions_from_events(list(iter_events(args.catalogue))),
+                              background=args.background, payload=args.payload)
+    service.latency = args.latency
+    service.latency_per_record = args.latency_per_record
+    service.page_size = args.page_size
+    server, url = start(service, port=args.port)
+    print("FLARECAST stand-in serving on %s (%d regions), Ctrl-C to stop" % (url, len(service.regions)))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Client side control of the FLARECAST requests: a rate limit, and slices sized from the
+answers already received instead of a fixed step
+"""
+import datetime
+import threading
+import time
+
+from flarecast_index import EPOCH, to_seconds
+
+_clock = getattr(time, "monotonic", time.time)
+
+
+class TokenBucket(object):
+    """
+    Limits the number of requests sent to the service, shared by all the downloads (and
+    threads) of a run (limiter= argument of download_range).
+
+    rate:           Sustained number of requests per second
+                    Type: float
+    burst:          Number of requests that can be sent at once after a quiet period
+                    Type: int
+    """
+
+    def __init__(self, rate=5.0, burst=10):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.waited = 0.
+        self._tokens = self.burst
+        self._last = _clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Waits until a request can be sent
+        """
+        while True:
+            with self._lock:
+                now = _clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._last)*self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens)/self.rate
+                self.waited += wait
+            time.sleep(wait)
+
+
+class SliceSizer(object):
+    """
+    Chooses the time range of the next slice of download_range (adaptive= argument) from
+    the slices already downloaded: the slice is sized so that it holds about
+    target_records records at the record density seen so far, and is shrunk when the
+    service answers slower than max_latency or fails. Slices are cut on a fixed grid
+    (see next_slice).
+
+    target_records: Number of records wanted per request
+                    Type: int
+    step:           First slice size, before any answer is known
+                    Type: timedelta
+    min_step, max_step:     Limits of the slice size
+                    Type: timedelta
+    max_latency:    Slices answered slower than this (seconds) are shrunk in proportion
+                    Type: float
+    max_growth:     A slice is at most this many times bigger than the previous one
+                    Type: float
+    smoothing:      Weight of the last slice in the record density (0 to 1)
+                    Type: float
+    """
+
+    def __init__(self, target_records=5000, step=datetime.timedelta(hours=6),
+                 min_step=datetime.timedelta(minutes=12), max_step=datetime.timedelta(days=30),
+                 max_latency=30., max_growth=4., smoothing=0.5):
+        self.target_records = target_records
+        self.min_step = min_step.total_seconds()
+        self.max_step = max_step.total_seconds()
+        self.max_latency = max_latency
+        self.max_growth = max_growth
+        self.smoothing = smoothing
+        self.density = None
+        self._step = min(max(step.total_seconds(), self.min_step), self.max_step)
+        self._lock = threading.Lock()
+
+    @property
+    def step(self):
+        """
+        returns:    Size of the next slice
+                    Type: timedelta
+        """
+        return datetime.timedelta(seconds=self._step)
+
+    # FUNCTION TO GET THE SIZE (SECONDS) OF THE SMALLEST CELL OF THE GRID HOLDING [a, b]
+    def _cell(self, a, b):
+        g = self.min_step
+        while a // g * g + g < b:
+            g *= 2
+        return g
+
+    def _clip(self, c0, c1, start, end):
+        return (max(start, EPOCH + datetime.timedelta(seconds=c0)),
+                min(end, EPOCH + datetime.timedelta(seconds=c1)))
+
+    def next_slice(self, cursor, start, end):
+        """
+        Slices are cells of a fixed grid (min_step times a power of two, from 1970-01-01)
+        clipped to [start, end], so that the same time range is cut at the same times
+        whatever the latencies and failures of the run, and cached slices are found again.
+
+        cursor:     Start of the slice, start or the end of the previous slice
+                    Type: datetime
+        start, end: Time range being downloaded
+                    Type: datetime
+
+        returns:    The next slice, of about the size of step
+                    Type: (datetime, datetime)
+        """
+        t = to_seconds(cursor)
+        g = self.min_step
+        # THE SIZE OF THE GRID CLOSEST TO step
+        while g*1.5 <= self._step and g*2 <= self.max_step:
+            g *= 2
+        # A CELL STARTS AT THE END OF THE PREVIOUS ONE, ONLY THE FIRST ONE IS CLIPPED BY start
+        while cursor > start and g > self.min_step and t % g:
+            g /= 2
+        return (cursor, self._clip(t // g * g, t // g * g + g, start, end)[1])
+
+    def halves(self, s):
+        """
+        returns:    The two cells of the grid (clipped like s) the slice s is made of, None
+                    if s is a single cell of size min_step
+                    Type: List of (datetime, datetime)
+        """
+        a, b = to_seconds(s[0]), to_seconds(s[1])
+        g = self._cell(a, b)/2
+        if g < self.min_step:
+            return None
+        mid = EPOCH + datetime.timedelta(seconds=a // g * g + g)
+        return [(s[0], mid), (mid, s[1])]
+
+    def covering(self, s, start, end):
+        """
+        returns:    The bigger cells of the grid (clipped to [start, end]) holding the slice s,
+                    smallest first
+                    Type: List of (datetime, datetime)
+        """
+        a = to_seconds(s[0])
+        g = self._cell(a, to_seconds(s[1]))
+        out = []
+        while g*2 <= self.max_step and (not out or out[-1] != (start, end)):
+            g *= 2
+            out.append(self._clip(a // g * g, a // g * g + g, start, end))
+        return out
+
+    def update(self, step, nrecords, latency):
+        """
+        step:       Time range of the downloaded slice
+                    Type: timedelta
+        nrecords:   Number of records in the answer, None if the download failed
+                    Type: int
+        latency:    Time taken by the request (seconds)
+                    Type: float
+        """
+        size = step.total_seconds()
+        with self._lock:
+            if nrecords is None:
+                # ERROR OR TIMEOUT, MOST LIKELY A TOO BIG ANSWER
+                new = size/2
+            else:
+                density = nrecords/size if size > 0 else 0.
+                if self.density is None:
+                    self.density = density
+                else:
+                    self.density += self.smoothing*(density - self.density)
+                if self.density > 0:
+                    new = self.target_records/self.density
+                else:
+                    new = size*self.max_growth
+                # THE LAST SLICE OF A RANGE IS OFTEN CUT SHORT, GROW FROM THE CURRENT SIZE
+                new = min(new, max(size, self._step)*self.max_growth)
+                if latency > self.max_latency:
+                    new = min(new, size*self.max_latency/latency)
+            self._step = min(max(new, self.min_step), self.max_step)
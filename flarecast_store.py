@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+"""
+Local SQLite store of FLARECAST region records, so that the records already downloaded
+are queried here instead of asking the service again. The records are indexed on
+time_start, meta.harp, meta.nar and lat_hg/long_hg, and every property of "data" is a
+column (named after its dotted path, e.g. "data.sharp_kw.usiz.total").
+"""
+import datetime
+import json
+import math
+import pickle
+import sqlite3
+
+import numpy as np
+
+from flarecast_client import download_range, download_region
+from flarecast_index import to_seconds
+from flarecast_ts import TS_PROPERTIES, PropertySpec, flatten
+
+# ARGUMENTS OF download_range / download_region THAT ARE NOT QUERY PARAMETERS
+DOWNLOAD_ARGS = ("step", "workers", "session", "cache", "keep", "dedup", "adaptive", "limiter",
+                 "fallback_step")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY, dataset TEXT NOT NULL, time_start REAL NOT NULL,
+    region TEXT NOT NULL, harp INTEGER, lat_hg REAL, long_hg REAL, record TEXT NOT NULL,
+    UNIQUE (dataset, time_start, region));
+CREATE INDEX IF NOT EXISTS records_time ON records (dataset, time_start);
+CREATE INDEX IF NOT EXISTS records_harp ON records (dataset, harp, time_start);
+CREATE INDEX IF NOT EXISTS records_position ON records (dataset, lat_hg, long_hg);
+CREATE TABLE IF NOT EXISTS nar (
+    record INTEGER NOT NULL, dataset TEXT NOT NULL, nar INTEGER NOT NULL,
+    time_start REAL NOT NULL, UNIQUE (record, nar));
+CREATE INDEX IF NOT EXISTS nar_time ON nar (dataset, nar, time_start);
+CREATE TABLE IF NOT EXISTS properties (path TEXT PRIMARY KEY, kind TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS coverage (
+    dataset TEXT NOT NULL, harp INTEGER, property_type TEXT NOT NULL,
+    region_fields TEXT NOT NULL, t0 REAL NOT NULL, t1 REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS coverage_time ON coverage (dataset, t0);
+"""
+
+
+# FUNCTION TO QUOTE A COLUMN NAME FOR SQLITE
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+# FUNCTION TO TELL IF THE FIELDS HAVE COVERS THE FIELDS NEED ('*' FOR ALL, OR COMMA SEPARATED)
+def _includes(have, need):
+    if have == "*":
+        return True
+    if need == "*":
+        return False
+    have = set(x.strip() for x in have.split(","))
+    return all(x.strip() in have for x in need.split(",") if x.strip())
+
+
+class RegionStore(object):
+    """
+    Region records of one dataset in a SQLite file. The queries are the same as those of
+    flarecast_index.RegionIndex (window, by_nar, by_harp), so the store can be given to
+    anything matching or building time series on an index.
+
+    The store also remembers which time ranges (and properties, fields and HARP) were
+    downloaded entirely, see download.
+
+    Several processes can use the same file: a store given to another process (e.g. in the
+    arguments of helcats_pipeline.run_parallel) is opened again there from its path.
+
+    path:           SQLite filename, e.g. 'flarecast_store.sqlite' (':memory:' for a store
+                    that is not kept, and not shared with other processes)
+                    Type: string
+    dataset:        FLARECAST dataset of the records
+                    Type: string
+    timeout:        Time (seconds) to wait for another process writing to the file
+                    Type: float
+    """
+
+    def __init__(self, path, dataset="production_02", timeout=60.):
+        self.path = path
+        self.dataset = dataset
+        self.timeout = timeout
+        self.db = sqlite3.connect(path, timeout=timeout)
+        # WRITE-AHEAD LOG: A DOWNLOAD ADDED IS ONE APPEND, NOT A SYNC OF THE WHOLE FILE
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+        self.columns = []
+        self._kinds = {}
+        self._refresh()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        if self.path == ":memory:":
+            raise pickle.PicklingError("a ':memory:' store cannot be given to another process")
+        return {"path": self.path, "dataset": self.dataset, "timeout": self.timeout}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["dataset"], state["timeout"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM records WHERE dataset = ?",
+                               (self.dataset,)).fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    # OTHER PROCESSES CAN ADD PROPERTIES TO THE SAME FILE, READ THEIR COLUMNS TOO
+    def _refresh(self):
+        n = self.db.execute("SELECT COUNT(*) FROM properties").fetchone()[0]
+        if n != len(self.columns):
+            self.columns = [tuple(row) for row in
+                            self.db.execute("SELECT path, kind FROM properties ORDER BY rowid")]
+            self._kinds = dict(self.columns)
+
+    def _add_column(self, path, value):
+        # NUMBERS AND STRINGS ARE KEPT AS THEY ARE, OTHER VALUES (LISTS, BOOLS) AS JSON
+        scalar = isinstance(value, (int, float, str, type(u""))) and not isinstance(value, bool)
+        kind = "value" if scalar else "json"
+        try:
+            self.db.execute("ALTER TABLE records ADD COLUMN %s" % _quote(path))
+        except sqlite3.OperationalError:
+            # ADDED BY ANOTHER PROCESS SINCE THE LAST REFRESH
+            self._refresh()
+            if path in self._kinds:
+                return
+            raise
+        self.db.execute("INSERT INTO properties (path, kind) VALUES (?, ?)", (path, kind))
+        self.columns.append((path, kind))
+        self._kinds[path] = kind
+
+    def ingest(self, records):
+        """
+        Adds records to the store. A record already in the store (same time_start and
+        HARP, or same position without HARP) is completed: the properties given are
+        updated, the others are kept, so metadata-only records can be completed later.
+
+        records:    Region records as returned by download_range
+                    Type: List (or iterable) of dicts
+
+        returns:    Number of records added or updated
+                    Type: int
+        """
+        n = 0
+        self._refresh()
+        with self.db:
+            for r in records:
+                meta = r.get("meta", {})
+                harp = meta.get("harp")
+                t = to_seconds(r["time_start"])
+                region = str(harp) if harp is not None else "%s,%s" % (r.get("lat_hg"), r.get("long_hg"))
+                rest = dict((k, v) for k, v in r.items() if k != "data")
+                text = json.dumps(rest, sort_keys=True)
+                values = []
+                for path, v in flatten(r.get("data") or {}):
+                    if v is None:
+                        continue
+                    if path not in self._kinds:
+                        self._add_column(path, v)
+                    if self._kinds[path] == "json" or not isinstance(v, (int, float, str, type(u""))):
+                        v = json.dumps(v)
+                    values.append((path, v))
+                cols = "".join(", %s" % _quote(p) for p, _ in values)
+                find = ("SELECT id, record FROM records WHERE dataset = ? AND time_start = ? AND "
+                        "region = ?", (self.dataset, t, region))
+                row = self.db.execute(*find).fetchone()
+                if row is None:
+                    try:
+                        cur = self.db.execute(
+                            "INSERT INTO records (dataset, time_start, region, harp, lat_hg, "
+                            "long_hg, record%s) VALUES (?, ?, ?, ?, ?, ?, ?%s)" % (
+                                cols, ", ?"*len(values)),
+                            [self.dataset, t, region, harp, r.get("lat_hg"), r.get("long_hg"),
+                             text] + [v for _, v in values])
+                        rowid = cur.lastrowid
+                    except sqlite3.IntegrityError:
+                        # ADDED BY ANOTHER PROCESS SINCE THE SELECT
+                        row = self.db.execute(*find).fetchone()
+                if row is not None:
+                    rowid, old = row
+                    # KEEP THE RECORD WITH THE MOST FIELDS (region_fields='*' AFTER A METADATA ONLY ONE)
+                    if len(rest) >= len(json.loads(old)):
+                        values.append(("record", text))
+                    if values:
+                        self.db.execute("UPDATE records SET %s WHERE id = ?" %
+                                        ", ".join("%s = ?" % _quote(p) for p, _ in values),
+                                        [v for _, v in values] + [rowid])
+                nar = meta.get("nar") or []
+                for v in (nar if isinstance(nar, list) else [nar]):
+                    self.db.execute("INSERT OR IGNORE INTO nar (record, dataset, nar, time_start) "
+                                    "VALUES (?, ?, ?, ?)", (rowid, self.dataset, v, t))
+                n += 1
+        return n
+
+    def _select(self, where, args, data=True):
+        if data:
+            self._refresh()
+        columns = self.columns if data else []
+        sql = "SELECT r.record%s FROM records r %s ORDER BY r.time_start, r.id" % (
+            "".join(", r.%s" % _quote(p) for p, _ in columns), where)
+        out = []
+        for row in self.db.execute(sql, args):
+            record = json.loads(row[0])
+            d = {}
+            for (path, kind), v in zip(columns, row[1:]):
+                if v is None:
+                    continue
+                keys = path.split(".")[1:]
+                x = d
+                for k in keys[:-1]:
+                    x = x.setdefault(k, {})
+                x[keys[-1]] = json.loads(v) if kind == "json" else v
+            record["data"] = d
+            out.append(record)
+        return out
+
+    def window(self, start, end, data=True):
+        """
+        start, end: Time range
+                    Type: datetime or ISO string
+        data:       Read the properties too, False for the metadata only ("data" empty)
+                    Type: bool
+
+        returns:    Records with start <= time_start <= end, in time order
+                    Type: List of dicts
+        """
+        return self._select("WHERE r.dataset = ? AND r.time_start BETWEEN ? AND ?",
+                            (self.dataset, to_seconds(start), to_seconds(end)), data)
+
+    def _range(self, column, start, end):
+        if start is None:
+            return "", ()
+        return " AND %s BETWEEN ? AND ?" % column, (to_seconds(start), to_seconds(end))
+
+    def by_nar(self, nar, start=None, end=None, data=True):
+        """
+        returns:    Records with NOAA number nar in meta.nar (and inside [start, end] if given)
+                    Type: List of dicts
+        """
+        cond, args = self._range("n.time_start", start, end)
+        return self._select("JOIN nar n ON n.record = r.id WHERE n.dataset = ? AND n.nar = ?" + cond,
+                            (self.dataset, nar) + args, data)
+
+    def by_harp(self, harp, start=None, end=None, data=True):
+        """
+        returns:    Records of HARP harp (and inside [start, end] if given)
+                    Type: List of dicts
+        """
+        cond, args = self._range("r.time_start", start, end)
+        return self._select("WHERE r.dataset = ? AND r.harp = ?" + cond,
+                            (self.dataset, harp) + args, data)
+
+    def near(self, lat, lon, tol, start, end, data=True):
+        """
+        lat, lon:   Heliographic position (degrees)
+                    Type: float
+        tol:        Half size of the box around the position (degrees)
+                    Type: float
+
+        returns:    Records inside the box, with start <= time_start <= end
+                    Type: List of dicts
+        """
+        return self._select("WHERE r.dataset = ? AND r.lat_hg BETWEEN ? AND ? AND "
+                            "r.long_hg BETWEEN ? AND ? AND r.time_start BETWEEN ? AND ?",
+                            (self.dataset, lat - tol, lat + tol, lon - tol, lon + tol,
+                             to_seconds(start), to_seconds(end)), data)
+
+    def closest(self, lat, lon, start, end, tol, data=True):
+        """
+        Same as RegionIndex.closest, only the positions of the window are read to find it
+
+        returns:    Closest record and its angular distance (degrees), (None, None) if none
+                    is within tol
+                    Type: (dict, float)
+        """
+        from helcats_match import closest_region
+
+        rows = self.db.execute("SELECT id, lat_hg, long_hg FROM records WHERE dataset = ? AND "
+                               "time_start BETWEEN ? AND ? ORDER BY time_start, id",
+                               (self.dataset, to_seconds(start), to_seconds(end))).fetchall()
+        if not rows:
+            return None, None
+        ids, lats, lons = zip(*rows)
+        m, dist = closest_region(lat, lon, np.array(lats, dtype=float), np.array(lons, dtype=float),
+                                 tol)
+        if m is None:
+            return None, None
+        return self._select("WHERE r.id = ?", (ids[m],), data)[0], dist
+
+    def metadata(self):
+        """
+        returns:    The same queries without the properties, for matching
+                    Type: MetadataView
+        """
+        return MetadataView(self)
+
+    def series(self, harp, pass_time, properties=TS_PROPERTIES, nhours=25):
+        """
+        Same as flarecast_ts.build_timeseries, but only the columns of the properties are
+        read from the store.
+
+        returns:    Record time of every hour (str(nan) if none) and the
+                    (nhours x nproperties) array of values, NaN where missing
+                    Type: (List of strings, array)
+        """
+        if not isinstance(properties, PropertySpec):
+            properties = PropertySpec(properties)
+        t_pass = to_seconds(pass_time)
+        self._refresh()
+        paths = ["data." + p for p in properties.paths]
+        columns = ", ".join(_quote(p) if p in self._kinds else "NULL" for p in paths)
+        rows = self.db.execute("SELECT time_start, record, %s FROM records WHERE dataset = ? AND "
+                               "harp = ? AND time_start > ? AND time_start <= ? "
+                               "ORDER BY time_start, id" % columns,
+                               (self.dataset, harp, t_pass - nhours*3600., t_pass))
+        # LAST RECORD OF EVERY HOUR
+        last = {}
+        for row in rows:
+            hours = int(math.floor((t_pass - row[0])/3600.))
+            if 0 <= hours < nhours:
+                last[nhours - 1 - hours] = row
+        time = [str(np.nan)]*nhours
+        values = np.full((nhours, len(properties)), np.nan)
+        for b, row in last.items():
+            time[b] = json.loads(row[1])["time_start"]
+            for p, v in enumerate(row[2:]):
+                try:
+                    values[b, p] = float(v)
+                except (TypeError, ValueError):
+                    pass
+        return time, values
+
+    def mark(self, start, end, property_type="*", region_fields="*", harp=None):
+        """
+        Records that all the records of [start, end] (of HARP harp if given) with these
+        properties and fields are in the store.
+        """
+        with self.db:
+            self.db.execute("INSERT INTO coverage (dataset, harp, property_type, region_fields, "
+                            "t0, t1) VALUES (?, ?, ?, ?, ?, ?)",
+                            (self.dataset, harp, property_type, region_fields,
+                             to_seconds(start), to_seconds(end)))
+
+    def covers(self, start, end, property_type="*", region_fields="*", harp=None):
+        """
+        returns:    True if all the records of [start, end] (of HARP harp if given) with these
+                    properties and fields are in the store
+                    Type: bool
+        """
+        t0, t1 = to_seconds(start), to_seconds(end)
+        rows = self.db.execute("SELECT t0, t1, property_type, region_fields FROM coverage "
+                               "WHERE dataset = ? AND (harp IS NULL OR harp = ?) AND t0 <= ? "
+                               "AND t1 >= ? ORDER BY t0", (self.dataset, harp, t1, t0))
+        reached = t0
+        for a, b, ps, fields in rows:
+            if not (_includes(ps, property_type) and _includes(fields, region_fields)):
+                continue
+            if a > reached:
+                return False
+            reached = max(reached, b)
+            if reached >= t1:
+                return True
+        return False
+
+    def download(self, service_url, start, end, harp=None, errors=None, **kwargs):
+        """
+        Gets the records of [start, end] (of a single HARP if given) from the store if they
+        were all downloaded before, from the service otherwise (download_range, or
+        download_region for a HARP), adding them to the store.
+
+        service_url:    See download_range
+        start, end:     See download_range
+        harp:           HARP number of the region, None for all the regions
+                        Type: int
+        errors:         See download_range. Ranges with errors are not marked as downloaded
+                        Type: list
+        kwargs:         Passed to download_range / download_region (cache, limiter, query
+                        parameters...). property_type and region_fields are '*' if not given
+
+        returns:        Records, in time order
+                        Type: List of dicts
+        """
+        property_type = kwargs.get("property_type", "*")
+        region_fields = kwargs.get("region_fields", "*")
+        # OTHER QUERY PARAMETERS OR A FILTER: THE ANSWER IS NOT THE WHOLE RANGE, NOT MARKED
+        whole = kwargs.get("keep") is None and all(
+            k in DOWNLOAD_ARGS or k in ("property_type", "region_fields") for k in kwargs)
+        if whole and self.covers(start, end, property_type, region_fields, harp):
+            self.hits += 1
+            if harp is not None:
+                return self.by_harp(harp, start, end)
+            return self.window(start, end)
+        self.misses += 1
+        failed = []
+        if harp is not None:
+            data = download_region(service_url, self.dataset, start, end, harp=harp,
+                                   errors=failed, **kwargs)
+        else:
+            data = download_range(service_url, self.dataset, start, end, errors=failed, **kwargs)
+        self.ingest(data)
+        if whole and not failed:
+            self.mark(start, end, property_type, region_fields, harp)
+        if errors is not None:
+            errors.extend(failed)
+        return data
+
+
+class MetadataView(object):
+    """
+    Queries of a RegionStore (window, by_nar, by_harp, closest) reading only the metadata
+    of the records, "data" is empty. Matching needs no properties, and the store can
+    have hundreds of property columns.
+
+    store:          The store to query
+                    Type: RegionStore
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def window(self, start, end):
+        return self.store.window(start, end, data=False)
+
+    def by_nar(self, nar, start=None, end=None):
+        return self.store.by_nar(nar, start, end, data=False)
+
+    def by_harp(self, harp, start=None, end=None):
+        return self.store.by_harp(harp, start, end, data=False)
+
+    def closest(self, lat, lon, start, end, tol):
+        return self.store.closest(lat, lon, start, end, tol, data=False)
+
+
+if __name__ == "__main__":
+    import sys
+
+    # CONTENT OF A STORE: python flarecast_store.py flarecast_store.sqlite
+    store = RegionStore(sys.argv[1] if len(sys.argv) > 1 else "flarecast_store.sqlite")
+    print("%d records, %d properties" % (len(store), len(store.columns)))
+    for t0, t1, ps, harp in store.db.execute("SELECT t0, t1, property_type, harp FROM coverage "
+                                            "WHERE dataset = ? ORDER BY t0", (store.dataset,)):
+        print("%s - %s  harp=%s  property_type=%s" % (
+            datetime.datetime.utcfromtimestamp(t0), datetime.datetime.utcfromtimestamp(t1), harp, ps))
+    store.close()
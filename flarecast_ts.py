@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Hourly time series of FLARECAST properties for a matched region, see HELC_FL_TS.py
+"""
+import numpy as np
+
+from flarecast_index import to_seconds
+
+# PROPERTIES OF THE TIME SERIES -- NAME IN THE OUTPUT AND DOTTED PATH INSIDE THE RECORD "data"
+TS_PROPERTIES = [
+    ('r_values_br', 'r_value_br_logr'),
+    ('alpha_fft_br', 'alpha_exp_fft_br.alpha'),
+    ('usiz_tot', 'sharp_kw.usiz.total'),
+    ('di4_br', 'decay_index_br.max_l_over_hmin'),
+    ('wlsg_br', 'wlsg_br.value_int'),
+    ('usflux_total', 'sharp_kw.usflux.total'),
+    ('ushz_ave', 'sharp_kw.ushz.ave'),
+    ('hgrad_bh_max', 'sharp_kw.hgradbh.max'),
+    ('ushz_tot', 'sharp_kw.ushz.total'),
+    ('ising_energy_blos', 'ising_energy_blos.ising_energy'),
+    ('usiz_max', 'sharp_kw.usiz.max'),
+    ('hz_max', 'sharp_kw.hz.max'),
+    ('jz_max', 'sharp_kw.jz.max'),
+    ('helicity_tot_dhdt', 'helicity_energy_bvec.abs_tot_dhdt'),
+    ('helicity_tot_dedt', 'helicity_energy_bvec.abs_tot_dedt'),
+]
+
+
+# FUNCTION TO COMPILE A DOTTED PATH (e.g. 'sharp_kw.usiz.total') IN A GETTER -- NaN IF ANY KEY IS MISSING
+def compile_path(path):
+    keys = tuple(path.split('.'))
+    errors = (KeyError, IndexError, TypeError, ValueError)
+    # SPECIALISED GETTERS FOR THE USUAL DEPTHS, AVOID THE LOOP OVER THE KEYS
+    if len(keys) == 1:
+        k0, = keys
+        def getter(data):
+            try:
+                return float(data[k0])
+            except errors:
+                return np.nan
+    elif len(keys) == 2:
+        k0, k1 = keys
+        def getter(data):
+            try:
+                return float(data[k0][k1])
+            except errors:
+                return np.nan
+    elif len(keys) == 3:
+        k0, k1, k2 = keys
+        def getter(data):
+            try:
+                return float(data[k0][k1][k2])
+            except errors:
+                return np.nan
+    else:
+        def getter(data):
+            try:
+                for k in keys:
+                    data = data[k]
+                return float(data)
+            except errors:
+                return np.nan
+    return getter
+
+
+class PropertySpec(object):
+    """
+    List of properties to extract from the region records, compiled once.
+
+    spec:           Dotted paths inside the record "data", e.g. 'sharp_kw.usiz.total', or
+                    (output name, dotted path). Without a name the path is used as name
+                    Type: List of strings or (string, string)
+    """
+
+    def __init__(self, spec):
+        self.names = []
+        self.paths = []
+        for p in spec:
+            name, path = p if isinstance(p, (tuple, list)) else (p, p)
+            self.names.append(str(name))
+            self.paths.append(str(path))
+        self.getters = [compile_path(p) for p in self.paths]
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def property_type(self):
+        """
+        returns:    Value of the property_type query parameter selecting only the
+                    FLARECAST properties of the spec, e.g. 'sharp_kw,wlsg_br'
+                    Type: string
+        """
+        return ",".join(sorted(set(p.split('.')[0] for p in self.paths)))
+
+    def extract(self, data):
+        """
+        returns:    Values of all the properties for one record "data", NaN where missing
+                    Type: List of floats
+        """
+        return [g(data) for g in self.getters]
+
+
+# FUNCTION TO FLATTEN THE NESTED "data" OF A RECORD IN (DOTTED PATH, VALUE)
+def flatten(data, prefix="data"):
+    for k, v in data.items():
+        path = prefix + "." + k
+        if isinstance(v, dict) and v:
+            for item in flatten(v, path):
+                yield item
+        else:
+            yield path, v
+
+
+# FUNCTION TO READ A PROPERTY SPEC FILE
+def load_spec(filename):
+    """
+    filename:       Text file with one property per line, either a dotted path or
+                    'name = dotted.path'. Empty lines and lines starting with '#' are ignored,
+                    e.g.
+                        # SHARP UNSIGNED CURRENT HELICITY
+                        usiz_tot = sharp_kw.usiz.total
+                        helicity_energy_bvec.abs_tot_dedt
+                    Type: string
+
+    returns:        The compiled spec
+                    Type: PropertySpec
+    """
+    spec = []
+    with open(filename) as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            if '=' in line:
+                name, path = [x.strip() for x in line.split('=', 1)]
+                spec.append((name, path))
+            else:
+                spec.append(line)
+    return PropertySpec(spec)
+
+
+def build_timeseries(records, harpnum, pass_time, properties=TS_PROPERTIES, nhours=25):
+    """
+    Hourly time series of the properties of one HARP, up to pass_time. When several
+    records fall in the same hour the last one is kept. The records are read only once
+    and only the last record of every hour is kept, so records can be a generator (e.g.
+    flarecast_client.iter_range) of any length.
+
+    records:        Region records, may include other HARPs
+                    Type: List (or iterable) of dicts
+    harpnum:        HARP number of the matched region
+                    Type: int
+    pass_time:      Time of the last point of the time series
+                    Type: datetime
+    properties:     Properties of the time series, see PropertySpec
+                    Type: PropertySpec or its spec list
+    nhours:         Number of hourly points of the time series
+                    Type: int
+
+    returns:        Record time of every hour (str(nan) if none) and the
+                    (nhours x nproperties) array of values, NaN where missing
+                    Type: (List of strings, array)
+    """
+    if not isinstance(properties, PropertySpec):
+        properties = PropertySpec(properties)
+    t_pass = to_seconds(pass_time)
+    # LAST RECORD OF EVERY HOUR
+    last = {}
+    for r in records:
+        if r["meta"]["harp"] != harpnum:
+            continue
+        # WHOLE HOURS BEFORE pass_time, ROUNDED DOWN
+        hours = int(np.floor((t_pass - to_seconds(r["time_start"]))/3600.))
+        if 0 <= hours < nhours:
+            last[nhours - 1 - hours] = r
+    time = [str(np.nan)]*nhours
+    values = np.full((nhours, len(properties)), np.nan)
+    for b, r in last.items():
+        time[b] = r["time_start"]
+        values[b] = properties.extract(r.get("data", {}))
+    return time, values
+
+
+# FUNCTION TO TRANSFORM A TIME SERIES TO THE FC_data STRUCTURE OF HELC_FL_TS.py
+def timeseries_dict(time, values, properties=TS_PROPERTIES):
+    if not isinstance(properties, PropertySpec):
+        properties = PropertySpec(properties)
+    fc_data = {'time': time}
+    for p, name in enumerate(properties.names):
+        fc_data[name] = values[:, p].tolist()
+    return fc_data
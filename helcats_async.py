@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio version of helcats_pipeline.run_pipeline: downloads, matching and time series
+building run at the same time, so the CPU works while requests are waiting and the
+network works while events are matched. Needs Python 3.
+"""
+import asyncio
+import datetime
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import iso8601
+
+from flarecast_client import download_range, download_region, plan_windows
+from flarecast_index import RegionIndex
+from flarecast_ts import TS_PROPERTIES, PropertySpec
+from helcats_pipeline import (SERVICE_URL, DATASET, MATCH_FIELDS, prepare_events,
+                              match_candidate, build_products)
+
+
+async def _pipeline(loop, executor, events, service_url, dataset, loc_key, tol, ps, spec, nhours,
+                    max_in_flight, queue_size, gap, dedup, kwargs):
+    candidates = prepare_events(events, loc_key)
+    plan = plan_windows([(c["start"], c["end"]) for c in candidates], gap=gap)
+    print('HELCATS events to match:', len(candidates), 'in', len(plan), 'bulk requests')
+    results = [{} for _ in events]
+
+    # AT MOST max_in_flight REQUESTS AT THE SAME TIME, AT MOST queue_size RESPONSES WAITING IN
+    # EVERY QUEUE -- A FULL QUEUE STOPS THE STAGE BEFORE IT, SO MEMORY STAYS BOUNDED
+    in_flight = asyncio.Semaphore(max_in_flight)
+    match_queue = asyncio.Queue(queue_size)
+    ts_queue = asyncio.Queue(queue_size)
+
+    async def fetch(func, *args, **kw):
+        async with in_flight:
+            return await loop.run_in_executor(executor, functools.partial(func, *args, **kw))
+
+    async def produce():
+        for start, end, indices in plan:
+            task = loop.create_task(fetch(download_range, service_url, dataset, start, end,
+                                          property_type="", region_fields=MATCH_FIELDS, **kwargs))
+            await match_queue.put((task, [candidates[i] for i in indices]))
+        await match_queue.put(None)
+
+    async def match():
+        previous = None
+        while True:
+            item = await match_queue.get()
+            if item is None:
+                break
+            task, group = item
+            records = await task
+            if previous is not None:
+                # WINDOWS STARTING IN THE PREVIOUS BULK REQUEST (SEE plan_windows) ALSO NEED ITS RECORDS
+                records = previous.window(min(c["start"] for c in group),
+                                          max(c["end"] for c in group)) + records
+            fc_index = previous = RegionIndex(records)
+            # {harp: [((candidate, record, quality), kind, time series window)]}
+            by_harp = {}
+            for c in group:
+                r, q, kind = match_candidate(c, fc_index, tol)
+                if r is None:
+                    continue
+                t = iso8601.parse_date(r["time_start"])
+                by_harp.setdefault(r["meta"]["harp"], []).append(
+                    ((c, r, q), kind, (t - datetime.timedelta(hours=nhours - 1),
+                                       t + datetime.timedelta(minutes=5))))
+            # WINDOWS OF THE SAME HARP ARE MERGED, LIKE helcats_pipeline.fetch_ts_index
+            for harp, found in by_harp.items():
+                for start, end, covered in plan_windows([w for _, _, w in found],
+                                                        gap=datetime.timedelta(0)):
+                    task = loop.create_task(fetch(download_region, service_url, dataset, start,
+                                                  end, harp=harp, property_type=ps,
+                                                  region_fields="*", dedup=dedup, **kwargs))
+                    await ts_queue.put((task, [found[i][:2] for i in covered]))
+        await ts_queue.put(None)
+
+    async def build():
+        while True:
+            item = await ts_queue.get()
+            if item is None:
+                break
+            task, found = item
+            ts_index = RegionIndex(await task)
+            for m, kind in found:
+                snapshot, ts = build_products(m, ts_index, spec, nhours)
+                if snapshot is not None:
+                    results[m[0]["index"]] = {"harp": m[1]["meta"]["harp"],
+                                              "pass_time": m[1]["time_start"], "match": kind,
+                                              "FC_data": snapshot, "FC_TS": ts}
+
+    await asyncio.gather(produce(), match(), build())
+    print('HELCATS events matched to FLARECAST regions:', sum(1 for r in results if r))
+    return results
+
+
+def run_async(events, service_url=SERVICE_URL, dataset=DATASET, loc_key="FL_LOC", tol=15.0,
+              ps="*", spec=TS_PROPERTIES, nhours=25, max_in_flight=8, queue_size=16,
+              gap=datetime.timedelta(minutes=30), dedup=None, **kwargs):
+    """
+    Same as helcats_pipeline.run_pipeline, with the three stages (candidate download and
+    matching, time series download, products) overlapping.
+
+    events, service_url, dataset, loc_key, tol, ps, spec, nhours:   See run_pipeline
+    max_in_flight:  Maximum number of FLARECAST requests at the same time
+                    Type: int
+    queue_size:     Maximum number of requests waiting for the next stage
+                    Type: int
+    gap:            Event windows closer than this are downloaded together, see plan_windows
+                    Type: timedelta
+    dedup:          Shares the time series requests of the same HARP between bulk requests
+                    (those of a bulk request are already merged per HARP)
+                    Type: flarecast_dedup.SingleFlight
+    kwargs:         Passed to the downloads (cache, session...)
+
+    returns:        Same as run_pipeline
+                    Type: List of dicts
+    """
+    spec = spec if isinstance(spec, PropertySpec) else PropertySpec(spec)
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    try:
+        return loop.run_until_complete(_pipeline(loop, executor, events, service_url, dataset,
+                                                 loc_key, tol, ps, spec, nhours, max_in_flight,
+                                                 queue_size, gap, dedup, kwargs))
+    finally:
+        executor.shutdown()
+        loop.close()
+
+
+if __name__ == "__main__":
+    from flarecast_cache import ResponseCache
+    from flarecast_dedup import SingleFlight
+    from helcats_catalogue import iter_events
+    from helcats_pipeline import SHARP_DATE, MATCH_OUTPUT, TS_OUTPUT, write_product
+
+    # HELCATS/LOWCAT CATALOGUE FILENAME
+    helcats_file = "helcats_list.json"
+    # LOCAL CACHE OF FLARECAST RESPONSES -- SET offline=True TO RUN ONLY FROM THE CACHE
+    cache = ResponseCache("flarecast_cache", max_bytes=10 * 1024 ** 3, offline=False)
+
+    reduced_list = list(iter_events(helcats_file, fl_types=('swpc', 'hessi'), since=SHARP_DATE))
+    print('Total CMEs with associatted Flare source region: ', len(reduced_list))
+    results = run_async(reduced_list, cache=cache, dedup=SingleFlight(), max_in_flight=8)
+    # SAME OUTPUTS AS HELCATS_match_FLARECAST_1.py AND HELC_FL_TS.py
+    write_product(MATCH_OUTPUT, reduced_list, results, "FC_data")
+    write_product(TS_OUTPUT, reduced_list, results, "FC_TS")
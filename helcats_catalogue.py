@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Reading and writing of the HELCATS/LOWCAT event catalogue
+"""
+import datetime
+import io
+import json
+import re
+
+# A COMPLETE JSON STRING, ONE STRUCTURAL CHARACTER, OR THE START OF A STRING CUT BY THE BUFFER END
+_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]"]', re.S)
+_FIELD = '"%s"\\s*:\\s*"((?:[^"\\\\]|\\\\.)*)"'
+
+
+# FUNCTION TO ITERATE OVER THE ELEMENTS OF A JSON ARRAY GIVEN IN PIECES, WITHOUT HOLDING IT ALL
+def iter_json_items(chunks, key=None, accept=None, meta=None):
+    """
+    chunks:         Pieces of the JSON text, in order, e.g. the blocks of a file or of an
+                    HTTP response
+                    Type: iterable of strings
+    key:            If None the JSON text is an array, otherwise it is an object and the
+                    array of the field 'key' is iterated, e.g. key='data' for the
+                    FLARECAST property service answers
+                    Type: string
+    accept:         Called with the raw JSON text of every element before it is decoded,
+                    elements for which it returns False are skipped without being decoded
+                    Type: function(string) -> bool
+    meta:           If given (and key is not None), filled at the end with the other
+                    fields of the object, e.g. the pagination fields
+                    Type: dict
+
+    returns:        Generator of the decoded elements (objects or arrays), in order
+                    Type: generator of dicts
+    """
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    depth = 0
+    start = None
+    eof = False
+    # DEPTH OF THE ELEMENTS, AND IF WE ARE INSIDE THE ITERATED ARRAY
+    item_depth = 2 if key is None else 3
+    inside = key is None
+    # LAST FIELD NAME SEEN IN THE TOP OBJECT, TEXT OF THE TOP OBJECT OUTSIDE THE ARRAY
+    current = None
+    skeleton = []
+    seg = 0 if key is not None else None
+    while True:
+        m = _TOKEN.search(buf, pos)
+        wait = m is None or m.group() == '"'
+        if not wait and key is not None and depth == 1 and m.group()[0] == '"':
+            # A FIELD NAME IS A STRING FOLLOWED BY ':', WHICH MAY NOT BE READ YET
+            wait = not buf[m.end():].strip() and not eof
+        if wait:
+            # NOTHING (COMPLETE) LEFT IN THE BUFFER, KEEP ONLY THE CURRENT ELEMENT AND READ MORE
+            if eof:
+                if depth != 0:
+                    raise ValueError("truncated JSON text")
+                break
+            keep = start if start is not None else (m.start() if m is not None else len(buf))
+            if seg is not None:
+                skeleton.append(buf[seg:keep])
+                seg = 0
+            buf = buf[keep:]
+            pos = (m.start() - keep) if m is not None else len(buf)
+            if start is not None:
+                start = 0
+            chunk = next(chunks, '')
+            eof = not chunk
+            buf += chunk
+            continue
+        pos = m.end()
+        c = m.group()
+        if c[0] == '"':
+            if key is not None and depth == 1 and buf[pos:].lstrip().startswith(':'):
+                current = json.loads(c)
+        elif c in '{[':
+            depth += 1
+            if not inside and depth == 2 and c == '[' and current == key:
+                inside = True
+                skeleton.append(buf[seg:pos])
+                seg = None
+            elif inside and depth == item_depth:
+                start = m.start()
+        else:
+            depth -= 1
+            if inside and depth == item_depth - 1 and start is not None:
+                text = buf[start:pos]
+                start = None
+                if accept is None or accept(text):
+                    yield json.loads(text)
+            elif key is not None and inside and depth == 1:
+                inside = False
+                seg = m.start()
+            if depth == 0:
+                if seg is not None:
+                    skeleton.append(buf[seg:pos])
+                break
+    if meta is not None and key is not None and skeleton:
+        fields = json.loads(''.join(skeleton))
+        fields.pop(key, None)
+        meta.update(fields)
+
+
+# FUNCTION TO ITERATE OVER THE ELEMENTS OF A JSON ARRAY FILE WITHOUT READING IT ALL
+def iter_json_array(fp, accept=None, chunk_size=1 << 16):
+    """
+    fp:             Open file with a JSON array of objects, e.g. helcats_list.json
+                    Type: file
+    accept:         See iter_json_items
+    chunk_size:     Number of characters read at once
+
+    returns:        Generator of the decoded elements, in file order
+                    Type: generator of dicts
+    """
+    chunks = iter(lambda: fp.read(chunk_size), '')
+    for item in iter_json_items(chunks, accept=accept):
+        yield item
+
+
+# FUNCTION TO READ A STRING FIELD FROM THE RAW TEXT OF AN EVENT -- None IF NOT FOUND
+def raw_field(text, key):
+    m = re.search(_FIELD % re.escape(key), text)
+    return m.group(1) if m else None
+
+
+# FUNCTION TO TRANSFORM A HELCATS TIME STRING ('15-May-2007 19:02:00.000') TO DATETIME
+def parse_time(t):
+    t = t.strip()
+    if not t:
+        return None
+    try:
+        return datetime.datetime.strptime(t, "%d-%b-%Y %H:%M:%S.%f")
+    except ValueError:
+        import dateutil.parser
+        return dateutil.parser.parse(t, ignoretz=True)
+
+
+def iter_events(path, fl_types=('swpc', 'hessi'), since=None, time_key="FL_STARTTIME"):
+    """
+    Streams the HELCATS/LOWCAT catalogue one event at a time. The filters are checked
+    on the raw text of every event, so events filtered out are never decoded.
+
+    path:           HELCATS/LOWCAT catalogue filename, e.g. 'helcats_list.json'
+                    Type: string
+    fl_types:       Keep only events with one of these FL_TYPE, None to keep all
+                    Type: tuple of strings
+    since:          Keep only events with time_key after this date, e.g. the SHARP date
+                    Type: datetime
+    time_key:       Event time field used with since
+                    Type: string
+
+    returns:        Generator of events
+                    Type: generator of dicts
+    """
+    def accept(text):
+        if fl_types is not None:
+            fl_type = raw_field(text, "FL_TYPE")
+            if fl_type is None or fl_type not in fl_types:
+                return False
+        if since is not None:
+            t = raw_field(text, time_key)
+            t = parse_time(t) if t is not None else None
+            if t is None or t <= since:
+                return False
+        return True
+
+    with io.open(path, encoding='utf-8') as fp:
+        for event in iter_json_array(fp, accept=accept):
+            yield event
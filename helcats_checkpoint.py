@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Per-event checkpoints of a matching run, so that a run stopped halfway (crash, network
+outage) starts again where it stopped, and events already matched with the same inputs
+are not matched again
+"""
+import hashlib
+import io
+import json
+import os
+
+
+class Checkpoint(object):
+    """
+    Results of the events already done, kept in a JSON Lines file (one line per event,
+    appended as the events are done). A line cut by a crash is ignored when reading.
+
+    path:           Checkpoint filename, e.g. 'output_file.checkpoint.jsonl'
+                    Type: string
+    settings:       Settings of the run (properties, service...). They are part of the
+                    inputs of every event, so changing them matches all the events again
+                    Type: dict
+    batch:          The file is flushed to disk every batch events (and when closed)
+                    Type: int
+    """
+
+    def __init__(self, path, settings=None, batch=20):
+        self.path = path
+        self.settings = settings or {}
+        self.batch = batch
+        self.results = {}
+        self.skipped = 0
+        lines = 0
+        line = u"\n"
+        if os.path.exists(path):
+            with io.open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.results[entry["key"]] = (entry["hash"], entry["result"])
+                        lines += 1
+                    except (ValueError, KeyError):
+                        continue
+        if not line.endswith(u"\n"):
+            # THE LAST LINE WAS CUT BY A CRASH, REMOVE IT SO THAT THE NEXT ONE STARTS ON ITS OWN LINE
+            with open(path, "rb+") as f:
+                f.seek(-len(line.encode("utf-8")), os.SEEK_END)
+                f.truncate()
+        # EVENTS DONE SEVERAL TIMES (INPUTS CHANGED) LEAVE OLD LINES, DROP THEM
+        if lines > 2*len(self.results) + 100:
+            self._rewrite()
+        self._fp = io.open(path, "a", encoding="utf-8")
+        self._pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # FUNCTION TO GET THE KEY OF AN EVENT IN THE CHECKPOINT
+    @staticmethod
+    def key(event):
+        return event["HEL_ID"]
+
+    def input_hash(self, event):
+        """
+        returns:    Hash of the event (without the results added by the run) and the settings
+                    Type: string
+        """
+        e = dict((k, v) for k, v in event.items() if k != "FC_data")
+        text = json.dumps([self.settings, e], sort_keys=True)
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def get(self, event):
+        """
+        returns:    True and the result saved for the event if it was done with the same
+                    inputs, (False, None) otherwise
+                    Type: (bool, object)
+        """
+        entry = self.results.get(self.key(event))
+        if entry is None or entry[0] != self.input_hash(event):
+            return False, None
+        self.skipped += 1
+        return True, entry[1]
+
+    def put(self, event, result):
+        """
+        event:      The event done
+                    Type: dict
+        result:     Its result (None if not matched), anything JSON can store
+        """
+        h = self.input_hash(event)
+        self.results[self.key(event)] = (h, result)
+        self._fp.write(json.dumps({"key": self.key(event), "hash": h, "result": result},
+                                  ensure_ascii=True) + u"\n")
+        self._pending += 1
+        if self._pending >= self.batch:
+            self.flush()
+
+    def flush(self):
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._pending = 0
+
+    def close(self):
+        if not self._fp.closed:
+            self.flush()
+            self._fp.close()
+
+    def _rewrite(self):
+        tmp = self.path + ".tmp"
+        with io.open(tmp, "w", encoding="utf-8") as f:
+            for key, (h, result) in self.results.items():
+                f.write(json.dumps({"key": key, "hash": h, "result": result},
+                                   ensure_ascii=True) + u"\n")
+        os.rename(tmp, self.path)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar export of the matched catalogues: the event fields, the matched snapshot
+properties and the (event x hour x property) time series as typed numpy arrays, one
+.npy file per column in a directory (or all of them in one .npz file). A reader loads
+only the columns it needs, and memory-maps them, e.g.
+
+    columns = read_columns('output_file_columns', ['event.HEL_ID', 'FC_TS.values'])
+"""
+import datetime
+import io
+import json
+import os
+
+import numpy as np
+
+from flarecast_index import to_seconds
+from flarecast_ts import TS_PROPERTIES, PropertySpec, flatten
+
+_HELCATS_TIME = "%d-%b-%Y %H:%M:%S.%f"
+_NUMBERS = (int, float)
+
+
+# FUNCTION TO READ A HELCATS TIME STRING, None IF IT IS NOT ONE
+def _helcats_time(v):
+    try:
+        return datetime.datetime.strptime(v.strip(), _HELCATS_TIME)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _event_column(values):
+    """
+    returns:    float64 for numbers (NaN if missing), datetime64[ms] for HELCATS times (NaT if
+                blank), fixed width unicode for the other fields
+                Type: array
+    """
+    if all(v is None or (isinstance(v, _NUMBERS) and not isinstance(v, bool)) for v in values):
+        return np.array([np.nan if v is None else v for v in values], dtype=float)
+    text = [u"" if v is None else v if isinstance(v, type(u"")) else
+            v.decode("utf-8") if isinstance(v, bytes) else type(u"")(json.dumps(v)) for v in values]
+    given = [v for v in text if v.strip()]
+    times = [_helcats_time(v) for v in given]
+    if given and all(t is not None for t in times):
+        return np.array([np.datetime64(_helcats_time(v), "ms") if v.strip() else np.datetime64("NaT")
+                         for v in text], dtype="datetime64[ms]")
+    return np.array(text, dtype=type(u""))
+
+
+# FUNCTION TO TRANSFORM A FLARECAST TIME (ISO STRING, 'nan' IF NONE) TO datetime64[s]
+def _fc_time(v):
+    try:
+        return np.datetime64(int(round(to_seconds(v))), "s")
+    except (TypeError, ValueError, AttributeError):
+        return np.datetime64("NaT")
+
+
+def event_table(events, snapshots=None, series=None, harps=None, pass_times=None,
+                properties=TS_PROPERTIES, exclude=("FC_data", "FC_TS")):
+    """
+    events:         HELCATS/LOWCAT events
+                    Type: List of dicts
+    snapshots:      FC_data snapshot of every event (matched record "data" with fc_data_q),
+                    None or empty if not matched
+                    Type: List of dicts
+    series:         FC_data time series of every event (see flarecast_ts.timeseries_dict),
+                    None or empty if not matched
+                    Type: List of dicts
+    harps:          Matched HARP of every event, None if not matched
+                    Type: List of ints
+    pass_times:     Matched record time of every event, None if not matched
+                    Type: List of strings
+    properties:     Properties of the time series, their order in FC_TS.values
+                    Type: PropertySpec or its spec list
+    exclude:        Event fields not exported (the products above)
+                    Type: tuple of strings
+
+    returns:        Columns, named
+                    'event.<field>'             (nevents,) one per event field
+                    'match.harp'                (nevents,) int64, -1 if not matched
+                    'match.pass_time'           (nevents,) datetime64[s]
+                    'FC_data.<dotted.path>'     (nevents,) float64, one per numeric property
+                    'FC_TS.time'                (nevents, nhours) datetime64[s]
+                    'FC_TS.values'              (nevents, nhours, nproperties) float64
+                    'FC_TS.properties'          (nproperties,) property names
+                    Type: dict of arrays
+    """
+    n = len(events)
+    columns = {}
+    fields = []
+    for e in events:
+        for k in e:
+            if k not in exclude and k not in fields:
+                fields.append(k)
+    for k in fields:
+        columns["event." + k] = _event_column([e.get(k) for e in events])
+
+    if harps is not None:
+        columns["match.harp"] = np.array([-1 if h is None else h for h in harps], dtype=np.int64)
+    if pass_times is not None:
+        columns["match.pass_time"] = np.array([_fc_time(t) for t in pass_times],
+                                              dtype="datetime64[s]")
+
+    if snapshots is not None:
+        # ONE COLUMN PER NUMERIC PROPERTY FOUND IN ANY SNAPSHOT
+        values = {}
+        for i, s in enumerate(snapshots):
+            for path, v in flatten(s or {}, "FC_data"):
+                if isinstance(v, _NUMBERS) and not isinstance(v, bool):
+                    if path not in values:
+                        values[path] = np.full(n, np.nan)
+                    values[path][i] = v
+        columns.update(values)
+
+    if series is not None:
+        if not isinstance(properties, PropertySpec):
+            properties = PropertySpec(properties)
+        nhours = max([len(s.get("time", [])) for s in series if s] or [0])
+        time = np.full((n, nhours), np.datetime64("NaT"), dtype="datetime64[s]")
+        values = np.full((n, nhours, len(properties)), np.nan)
+        for i, s in enumerate(series):
+            if not s:
+                continue
+            time[i, :len(s["time"])] = [_fc_time(t) for t in s["time"]]
+            for p, name in enumerate(properties.names):
+                if name in s:
+                    values[i, :len(s[name]), p] = np.array(s[name], dtype=float)
+        columns["FC_TS.time"] = time
+        columns["FC_TS.values"] = values
+        columns["FC_TS.properties"] = np.array(properties.names, dtype=type(u""))
+    return columns
+
+
+# FUNCTION TO GET THE COLUMNS OF THE EVENTS AND THE RESULTS OF helcats_pipeline.run_pipeline
+def results_table(events, results, properties=TS_PROPERTIES):
+    return event_table(events, snapshots=[r.get("FC_data") for r in results],
+                       series=[r.get("FC_TS") for r in results],
+                       harps=[r.get("harp") for r in results],
+                       pass_times=[r.get("pass_time") for r in results], properties=properties)
+
+
+def write_columns(path, columns):
+    """
+    path:       Directory of .npy files (one per column, plus columns.json listing them), or
+                a single .npz file if it ends with '.npz'
+                Type: string
+    columns:    See event_table
+                Type: dict of arrays
+    """
+    if path.endswith(".npz"):
+        np.savez(path, **columns)
+        return
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    index = []
+    for name in sorted(columns):
+        a = np.asarray(columns[name])
+        np.save(os.path.join(path, name + ".npy"), a, allow_pickle=False)
+        index.append({"name": name, "dtype": a.dtype.str, "shape": list(a.shape)})
+    with io.open(os.path.join(path, "columns.json"), "w", encoding="utf-8") as f:
+        f.write(type(u"")(json.dumps(index, indent=1)))
+
+
+def read_columns(path, names=None, mmap=True):
+    """
+    path:       See write_columns
+    names:      Columns to read, None for all
+                Type: List of strings
+    mmap:       Memory-map the columns instead of reading them (directories only)
+                Type: bool
+
+    returns:    The columns
+                Type: dict of arrays
+    """
+    if path.endswith(".npz"):
+        with np.load(path, allow_pickle=False) as f:
+            return dict((n, f[n]) for n in (names or f.files))
+    if names is None:
+        with io.open(os.path.join(path, "columns.json"), encoding="utf-8") as f:
+            names = [c["name"] for c in json.load(f)]
+    return dict((n, np.load(os.path.join(path, n + ".npy"), mmap_mode="r" if mmap else None,
+                            allow_pickle=False)) for n in names)
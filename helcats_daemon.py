@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Service mode of helcats_pipeline: watches the HELCATS/LOWCAT catalogue (a file, or a
+directory of .json files standing in for the feed), matches the new events as soon as
+they appear and appends them to a JSON Lines output. Recent events that cannot be
+matched yet are asked again while new FLARECAST data may still arrive for them.
+"""
+from __future__ import print_function
+
+import datetime
+import glob
+import os
+import time
+
+import iso8601
+
+from flarecast_dedup import SingleFlight
+from flarecast_ts import TS_PROPERTIES
+from helcats_catalogue import iter_events
+from helcats_checkpoint import Checkpoint
+from helcats_jsonl import JsonLinesWriter
+from helcats_pipeline import SERVICE_URL, DATASET, SHARP_DATE, prepare_events, run_pipeline
+
+
+class MatchDaemon(object):
+    """
+    source:         Catalogue file, or directory whose *.json files are all read
+                    Type: string
+    output:         JSON Lines output, one line per matched event (the event with FC_data,
+                    FC_TS, harp and pass_time), appended
+                    Type: string
+    checkpoint:     Checkpoint file of the events done, see helcats_checkpoint
+                    Type: string
+    interval:       Time between two looks at the catalogue (seconds)
+                    Type: float
+    retry_interval: Time between two tries of an event not matched yet (seconds)
+                    Type: float
+    retry_window:   Events not matched are tried again while they are more recent than this,
+                    older events are final at the first try
+                    Type: timedelta
+    fl_types, since:    See helcats_catalogue.iter_events
+    kwargs:         Passed to run_pipeline (service_url, dataset, ps, spec, cache, dedup...).
+                    cache, store and dedup only keep the answers of events older than
+                    retry_window
+    """
+
+    def __init__(self, source, output, checkpoint, interval=60., retry_interval=600.,
+                 retry_window=datetime.timedelta(days=3), fl_types=('swpc', 'hessi'),
+                 since=SHARP_DATE, **kwargs):
+        self.source = source
+        self.output = output
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.retry_window = retry_window
+        self.fl_types = fl_types
+        self.since = since
+        self.kwargs = kwargs
+        settings = {"service_url": kwargs.get("service_url", SERVICE_URL),
+                    "dataset": kwargs.get("dataset", DATASET), "ps": kwargs.get("ps", "*"),
+                    "spec": [list(p) if isinstance(p, tuple) else p
+                             for p in kwargs.get("spec", TS_PROPERTIES)]}
+        self.checkpoint = Checkpoint(checkpoint, settings=settings)
+        self.writer = JsonLinesWriter(output, append=True)
+        # FILES ALREADY READ {path: (mtime, size)}, EVENTS WAITING FOR A RETRY {key: (event, next try)}
+        self._seen = {}
+        self.pending = {}
+        self.matched = 0
+
+    # FUNCTION TO LIST THE CATALOGUE FILES
+    def files(self):
+        if os.path.isdir(self.source):
+            return sorted(glob.glob(os.path.join(self.source, "*.json")))
+        return [self.source] if os.path.exists(self.source) else []
+
+    def scan(self):
+        """
+        returns:    Events of the catalogue files changed since the last scan, not done yet
+                    (or done with other inputs)
+                    Type: List of dicts
+        """
+        events = []
+        for path in self.files():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if self._seen.get(path) == (st.st_mtime, st.st_size):
+                continue
+            try:
+                found = list(iter_events(path, fl_types=self.fl_types, since=self.since))
+            except ValueError:
+                # FILE BEING WRITTEN, READ AGAIN AT THE NEXT SCAN
+                print("catalogue %s incomplete, read again later" % path)
+                continue
+            self._seen[path] = (st.st_mtime, st.st_size)
+            for e in found:
+                key = Checkpoint.key(e)
+                if key in self.pending or self.checkpoint.get(e)[0]:
+                    continue
+                events.append(e)
+        return events
+
+    def match(self, events, now):
+        """
+        Matches events, appends the matched ones to the output and decides for the others
+        if they are final (checkpointed as not matched) or tried again later. Events still
+        inside retry_window are downloaded again at every try, never from the cache.
+        """
+        if not events:
+            return
+        failed = []
+        candidates = dict((c["index"], c) for c in
+                          prepare_events(events, self.kwargs.get("loc_key", "FL_LOC")))
+        recent = set(i for i, c in candidates.items() if now - c["end"] < self.retry_window)
+        results = [{} for _ in events]
+        for fresh in (False, True):
+            part = [i for i in range(len(events)) if (i in recent) == fresh]
+            if not part:
+                continue
+            kwargs = self.kwargs
+            if fresh:
+                # THE ANSWERS OF RECENT WINDOWS CAN STILL CHANGE: NO CACHE, NO STORE, AND A
+                # DEDUP THAT ONLY SHARES THE REQUESTS OF THIS STEP
+                kwargs = dict(kwargs, cache=None, store=None,
+                              dedup=SingleFlight() if kwargs.get("dedup") is not None else None)
+            for i, res in zip(part, run_pipeline([events[i] for i in part], errors=failed, **kwargs)):
+                results[i] = res
+        for i, (e, res) in enumerate(zip(events, results)):
+            key = Checkpoint.key(e)
+            if res:
+                out = dict(e)
+                out.update(res)
+                self.writer.write(out)
+                self.checkpoint.put(e, res)
+                self.pending.pop(key, None)
+                self.matched += 1
+                continue
+            c = candidates.get(i)
+            missed = c is not None and any(s0 <= c["end"] and s1 >= c["start"]
+                                           for s0, s1 in failed)
+            if i in recent or missed:
+                # NEW FLARECAST DATA MAY STILL COME, OR THE DOWNLOAD FAILED: TRY AGAIN LATER
+                self.pending[key] = (e, time.time() + self.retry_interval)
+            else:
+                self.checkpoint.put(e, None)
+                self.pending.pop(key, None)
+        # THE MATCHED EVENTS OF A STEP ARE IN THE OUTPUT AS SOON AS THE STEP IS DONE
+        self.writer.flush()
+        self.checkpoint.flush()
+
+    def step(self, now=None):
+        """
+        One look at the catalogue and at the events waiting for a retry.
+
+        now:        Current time, to tell recent events
+                    Type: datetime (with time zone)
+
+        returns:    Number of events matched in this step
+                    Type: int
+        """
+        now = now or datetime.datetime.now(iso8601.UTC)
+        before = self.matched
+        events = self.scan()
+        due = [e for e, t in self.pending.values() if t <= time.time()]
+        if events or due:
+            print("%s: %d new events, %d tried again" % (now.strftime("%Y-%m-%d %H:%M:%S"),
+                                                         len(events), len(due)))
+        self.match(events + due, now)
+        return self.matched - before
+
+    def run(self, max_steps=None):
+        """
+        Looks at the catalogue every interval seconds, until interrupted (Ctrl-C) or
+        max_steps steps are done.
+        """
+        steps = 0
+        try:
+            while max_steps is None or steps < max_steps:
+                t0 = time.time()
+                n = self.step()
+                if n:
+                    print("%d events matched, %d in total" % (n, self.matched))
+                steps += 1
+                if max_steps is None or steps < max_steps:
+                    time.sleep(max(self.interval - (time.time() - t0), 0.))
+        except KeyboardInterrupt:
+            print("stopped")
+        finally:
+            self.writer.close()
+            self.checkpoint.close()
+
+
+if __name__ == "__main__":
+    from flarecast_cache import ResponseCache
+
+    # HELCATS/LOWCAT CATALOGUE FILE, OR DIRECTORY WHERE NEW CATALOGUE FILES ARE DROPPED
+    helcats_source = "helcats_list.json"
+    # MATCHED EVENTS ARE APPENDED HERE, ONE JSON OBJECT PER LINE
+    output_file = "helcats_flarecast_live.jsonl"
+    # EVENTS DONE, SO THAT A RESTART DOES NOT MATCH THEM AGAIN
+    checkpoint_file = "helcats_flarecast_live.checkpoint.jsonl"
+    # LOCAL CACHE OF FLARECAST RESPONSES
+    cache = ResponseCache("flarecast_cache", max_bytes=10 * 1024 ** 3, offline=False)
+
+    daemon = MatchDaemon(helcats_source, output_file, checkpoint_file, interval=60.,
+                         retry_interval=600., retry_window=datetime.timedelta(days=3),
+                         cache=cache, dedup=SingleFlight(), workers=8)
+    daemon.run()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Matched events in JSON Lines files (one JSON object per line), written as the events are
+done and read back one line at a time, also while the file is still being written, e.g.
+
+    for event in iter_jsonl('output_file.jsonl', follow=True):
+        print(event["HEL_ID"], bool(event.get("FC_data")))
+"""
+import io
+import json
+import time
+
+
+class JsonLinesWriter(object):
+    """
+    path:           JSON Lines filename, e.g. 'output_file.jsonl'
+                    Type: string
+    batch:          Lines are flushed to the file every batch lines (and when closed), so
+                    that readers of the file see them
+                    Type: int
+    append:         Add the lines to an existing file instead of starting a new one
+                    Type: bool
+    """
+
+    def __init__(self, path, batch=50, append=False):
+        self.path = path
+        self.batch = batch
+        self.count = 0
+        self._fp = io.open(path, "a" if append else "w", encoding="utf-8")
+        self._pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, obj):
+        self._fp.write(json.dumps(obj, ensure_ascii=True) + u"\n")
+        self.count += 1
+        self._pending += 1
+        if self._pending >= self.batch:
+            self.flush()
+
+    def flush(self):
+        self._fp.flush()
+        self._pending = 0
+
+    def close(self):
+        if not self._fp.closed:
+            self.flush()
+            self._fp.close()
+
+
+def iter_jsonl(path, follow=False, interval=1.):
+    """
+    path:           JSON Lines filename
+                    Type: string
+    follow:         Keep waiting for new lines at the end of the file (like tail -f), the
+                    generator then only ends when it is closed
+                    Type: bool
+    interval:       Time between two looks at the end of the file when following (seconds)
+                    Type: float
+
+    returns:        The objects of the file, one at a time. A last line without its end of
+                    line (being written, or cut by a crash) is not read, unless it is
+                    completed while following. Lines that are not JSON are skipped
+                    Type: generator of dicts
+    """
+    with io.open(path, encoding="utf-8") as f:
+        partial = u""
+        while True:
+            line = f.readline()
+            if line.endswith(u"\n"):
+                line, partial = partial + line, u""
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+                continue
+            partial += line
+            if not follow:
+                return
+            time.sleep(interval)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Location handling and region matching shared by HELCATS_match_FLARECAST_1.py and HELC_FL_TS.py
+"""
+import datetime
+
+import numpy as np
+
+# FUNCTION TO TRANSFORM LOCATION FORMAT
+def location(loc):
+
+    loc1 = []
+    if loc != ' ':
+        slat1 = loc[0:1]
+        slon1 = loc[3:4]
+        if slat1 == 'N':
+            slat = 1
+        else:
+            slat = -1
+        if slon1 == 'E':
+            slon = -1
+        else:
+            slon = 1
+        lat = int(float(loc[1:3]))
+        lon = int(float(loc[4:6]))
+        loc1.append(slat)
+        loc1.append(slon)
+        loc1.append(lat)
+        loc1.append(lon)
+        return loc1
+
+# FUNCTION TO MATCH REGIONS
+def comp_location(hc_loc,fc_lon,fc_lat,tol):
+    # FIRST CONVERT HELCATS LOCATION FORMAT
+    region_match = False
+    #if len(hc_loc) == 1:
+    hg_coor = location(hc_loc)
+    #else:
+    #hg_coor = hc_loc
+    if fc_lon < 0:
+        sfc_lon = -1
+    else:
+        sfc_lon = 1
+    if fc_lat < 0:
+        sfc_lat = -1
+    else:
+        sfc_lat = 1
+    
+    if (sfc_lon == hg_coor[1] and sfc_lat == hg_coor[0]):
+        fc_d = np.sqrt(fc_lon*fc_lon + fc_lat*fc_lat)
+        hc_d = np.sqrt(hg_coor[2]*hg_coor[2] + hg_coor[3]*hg_coor[3])
+        diff_ = np.abs(fc_d - hc_d)       
+        
+        if diff_ < tol:    # TOL DEGREE IS THE TOLERANCE TO MATCH REGIONS
+            region_match = True
+    
+    return region_match
+
+# FUNCTION TO ROTATE REGIONS LOCATION
+def rot_regions(nloc,ntime,srstime):
+    loc = location(nloc)
+    ar_lat = loc[0]*loc[2]
+    ar_lon = loc[1]*loc[3]
+    a=14.713
+    b=-2.396
+    c=-1.787
+    minn = ntime - srstime
+    if ntime > srstime:
+        m = ntime - srstime
+        minn = int(m.total_seconds()/60.)
+    if ntime < srstime:
+        m = srstime - ntime
+        minn = -int(m.total_seconds()/60.)
+    #
+    sin_lat = np.sin(np.radians(ar_lat))
+    rotation=a + b*sin_lat**2.0 + c*sin_lat**4.0 # In deg/day
+    rotation=rotation/1440.0 # In deg/min
+    ar_lon=ar_lon + minn*rotation # In degree
+    if ar_lon > 0.:
+        s1 = 'W'
+    if ar_lon < 0.:
+        s1 = 'E'
+    if ar_lat < 0.:
+        s2 = 'S'
+    if ar_lat > 0.:
+        s2 = 'N'
+    nloc_lat = s2+"%02d" % loc[2]
+    nloc_lon = s1+"%02d" % abs(ar_lon)
+    new_loc = nloc_lat+nloc_lon
+    
+    return new_loc
+
+# FUNCTION TO GET THE SIGNED LATITUDE AND LONGITUDE (DEGREES) OF A LOCATION STRING
+def location_latlon(loc):
+    loc1 = location(loc)
+    if loc1 is None:
+        return None
+    return float(loc1[0]*loc1[2]), float(loc1[1]*loc1[3])
+
+# FUNCTION TO COMPUTE THE HELIOGRAPHIC ANGULAR SEPARATION (DEGREES) -- WORKS ON ARRAYS
+def angular_distance(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = [np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2)]
+    # HAVERSINE FORMULA, ACCURATE ALSO FOR SMALL SEPARATIONS
+    h = np.sin((lat2 - lat1)/2.)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2 - lon1)/2.)**2
+    return np.degrees(2.*np.arcsin(np.sqrt(np.clip(h, 0., 1.))))
+
+# FUNCTION TO FIND THE CLOSEST REGION TO A POSITION
+def closest_region(lat, lon, lats, lons, tol):
+    """
+    lat, lon:       Position of the source region (degrees)
+                    Type: float
+    lats, lons:     Positions of all candidate FLARECAST regions (degrees), NaN if unknown
+                    Type: array
+    tol:            Maximum angular distance (degrees) to match regions
+
+    returns:        Index of the closest candidate and its angular distance (degrees),
+                    (None, None) if no candidate is within tol
+                    Type: (int, float)
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    if lats.size == 0:
+        return None, None
+    dist = angular_distance(lat, lon, lats, lons)
+    dist = np.where(np.isnan(dist), np.inf, dist)
+    m = int(np.argmin(dist))
+    if dist[m] < tol:    # TOL DEGREE IS THE TOLERANCE TO MATCH REGIONS
+        return m, float(dist[m])
+    return None, None
+
+# FUNCTION TO MATCH A HELCATS LOCATION TO THE CLOSEST FLARECAST REGION RECORD
+def match_position(hc_loc, rdata, tol):
+    """
+    hc_loc:         HELCATS location string, e.g. 'N12W34'
+                    Type: string
+    rdata:          Candidate FLARECAST region records (with lat_hg and long_hg)
+                    Type: List of dicts
+    tol:            Maximum angular distance (degrees) to match regions
+
+    returns:        Index in rdata of the closest region and its angular distance (degrees),
+                    (None, None) if no region is within tol
+                    Type: (int, float)
+    """
+    latlon = location_latlon(hc_loc)
+    if latlon is None:
+        return None, None
+    return match_latlon(latlon[0], latlon[1], rdata, tol)
+
+# FUNCTION TO MATCH A SIGNED LATITUDE AND LONGITUDE (DEGREES) TO THE CLOSEST FLARECAST REGION RECORD
+# -- THE POSITIONS ARE READ FROM THE RECORDS AT EVERY CALL, SEE RegionIndex.closest TO MATCH MANY EVENTS
+def match_latlon(lat, lon, rdata, tol):
+    if not rdata or np.isnan(lat) or np.isnan(lon):
+        return None, None
+    lats = np.array([r.get("lat_hg") for r in rdata], dtype=float)
+    lons = np.array([r.get("long_hg") for r in rdata], dtype=float)
+    return closest_region(lat, lon, lats, lons, tol)
+
+# FUNCTION TO TRANSFORM A WHOLE COLUMN OF LOCATION STRINGS -- e.g. ['N12W34', ' ', 'S05E10']
+def parse_locations(locs):
+    """
+    locs:           Stonyhurst location strings in the HELCATS format 'N12W34'
+                    Type: List of strings
+    returns:        Signed latitudes and longitudes (degrees, N and W positive),
+                    NaN where the location is blank or malformed
+                    Type: (array, array)
+    """
+    raw = np.array([l.strip().encode("ascii", "ignore") if l is not None else b"" for l in locs],
+                   dtype="S6")
+    c = raw.view(np.uint8).reshape(len(raw), 6) if len(raw) else np.zeros((0, 6), np.uint8)
+    digits = c - ord("0")
+    isdigit = (digits >= 0) & (digits <= 9)
+    valid = (((c[:, 0] == ord("N")) | (c[:, 0] == ord("S"))) &
+             ((c[:, 3] == ord("E")) | (c[:, 3] == ord("W"))) &
+             isdigit[:, 1] & isdigit[:, 2] & isdigit[:, 4] & isdigit[:, 5])
+    slat = np.where(c[:, 0] == ord("N"), 1., -1.)
+    slon = np.where(c[:, 3] == ord("E"), -1., 1.)
+    lat = slat*(10.*digits[:, 1] + digits[:, 2])
+    lon = slon*(10.*digits[:, 4] + digits[:, 5])
+    return np.where(valid, lat, np.nan), np.where(valid, lon, np.nan)
+
+# FUNCTION TO TRANSFORM SIGNED LATITUDES AND LONGITUDES BACK TO LOCATION STRINGS
+def format_locations(lats, lons):
+    out = []
+    for lat, lon in zip(lats, lons):
+        if np.isnan(lat) or np.isnan(lon):
+            out.append(' ')
+        else:
+            out.append("%s%02d%s%02d" % ('S' if lat < 0 else 'N', abs(lat),
+                                         'E' if lon < 0 else 'W', abs(lon)))
+    return out
+
+# FUNCTION TO TRANSFORM A COLUMN OF HELCATS TIME STRINGS ('15-May-2007 19:02:00.000') TO datetime64
+def parse_times(times):
+    out = np.empty(len(times), dtype="datetime64[ms]")
+    for k, t in enumerate(times):
+        t = t.strip() if t is not None else ''
+        if not t:
+            out[k] = np.datetime64("NaT")
+            continue
+        try:
+            t = datetime.datetime.strptime(t, "%d-%b-%Y %H:%M:%S.%f")
+        except ValueError:
+            import dateutil.parser
+            t = dateutil.parser.parse(t, ignoretz=True)
+        out[k] = np.datetime64(t, "ms")
+    return out
+
+# FUNCTION TO ROTATE MANY REGION LOCATIONS AT ONCE (SEE rot_regions)
+def rot_locations(lats, lons, ntimes, srstimes):
+    """
+    lats, lons:     Signed latitudes and longitudes (degrees) at the SRS time
+                    Type: array
+    ntimes:         Times to rotate the regions to
+                    Type: datetime64 array
+    srstimes:       Times of the SRS locations (midnight)
+                    Type: datetime64 array
+    returns:        Longitudes (degrees) at ntimes, latitudes do not change
+                    Type: array
+    """
+    a=14.713
+    b=-2.396
+    c=-1.787
+    lats = np.asarray(lats, dtype=float)
+    # WHOLE MINUTES BETWEEN THE SRS TIME AND THE EVENT, TRUNCATED LIKE rot_regions
+    minn = np.trunc((np.asarray(ntimes, dtype="datetime64[ms]") -
+                     np.asarray(srstimes, dtype="datetime64[ms]")).astype(float)/60000.)
+    sin_lat = np.sin(np.radians(lats))
+    rotation = (a + b*sin_lat**2.0 + c*sin_lat**4.0)/1440.0 # In deg/min
+    return np.asarray(lons, dtype=float) + minn*rotation
+
+# FUNCTION TO GET THE SOURCE REGION POSITION OF EVERY EVENT OF A CATALOGUE AT ONCE
+def event_locations(events, loc_key="FL_LOC", time_key="FL_STARTTIME"):
+    """
+    events:         HELCATS/LOWCAT events
+                    Type: List of dicts
+    loc_key:        Field with the location at the event time ('FL_LOC' or 'SMART_HGLATLON').
+                    Where it is blank the NOAA SRS_LOC location, rotated from SRS_TIME to the
+                    event time, is used instead
+                    Type: string
+    returns:        Signed latitudes and longitudes (degrees) of the source regions, NaN if
+                    unknown, and a boolean array telling which ones come from SRS_LOC
+                    Type: (array, array, array)
+    """
+    lats, lons = parse_locations([e[loc_key] for e in events])
+    srs = np.isnan(lats) & np.array([e["SRS_LOC"].strip() != '' for e in events], dtype=bool)
+    if srs.any():
+        sel = [e for e, s in zip(events, srs) if s]
+        slats, slons = parse_locations([e["SRS_LOC"] for e in sel])
+        slons = rot_locations(slats, slons, parse_times([e[time_key] for e in sel]),
+                              parse_times([e["SRS_TIME"] for e in sel]))
+        lats[srs] = slats
+        lons[srs] = slons
+    return lats, lons, srs & ~np.isnan(lats)
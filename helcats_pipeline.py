@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+Single pass HELCATS-FLARECAST pipeline: every event is matched once, and both the
+snapshot of HELCATS_match_FLARECAST_1.py and the time series of HELC_FL_TS.py are
+built from the same downloaded data
+"""
+from __future__ import print_function
+
+import datetime
+import io
+import json
+import os
+
+import iso8601
+import numpy as np
+
+from flarecast_client import download_bulk, download_region, plan_windows, same_region
+from flarecast_index import RegionIndex
+from flarecast_ts import TS_PROPERTIES, PropertySpec, build_timeseries, timeseries_dict
+from helcats_catalogue import parse_time
+from helcats_match import event_locations
+
+#KEEP production_02 CHECK API.FLARECAST.EU FOR MOST COMPLETE DATA PRODUCTION
+SERVICE_URL = os.environ.get("FLARECAST_URL", "http://api.flarecast.eu/property")
+DATASET = "production_02"
+# SHARP DATA ONLY EXISTS SINCE SEPT 2012
+SHARP_DATE = datetime.datetime(2012, 9, 1)
+# REGION FIELDS NEEDED TO MATCH
+MATCH_FIELDS = "time_start,lat_hg,long_hg,meta"
+# OUTPUT FILES OF HELCATS_match_FLARECAST_1.py (SNAPSHOTS) AND HELC_FL_TS.py (TIME SERIES)
+MATCH_OUTPUT = 'output_file.txt'
+TS_OUTPUT = 'helcats_list_flarecast_properties_28July17_TS_top15_predictors_1.txt'
+# HOW AN EVENT WAS MATCHED -- A POSITION MATCH CAN ALSO HAVE A QUALITY OF 0 (SAME POSITION)
+MATCH_NOAA = "noaa"
+MATCH_POSITION = "position"
+
+
+# FUNCTION TO TRUNCATE A DATETIME TO THE MINUTE, IN UTC
+def utc_minute(t):
+    return iso8601.parse_date(datetime.datetime.strftime(t, '%Y-%m-%dT%H:%M:00Z'))
+
+
+def prepare_events(events, loc_key="FL_LOC", pre=datetime.timedelta(minutes=60),
+                   post=datetime.timedelta(minutes=5), since=SHARP_DATE):
+    """
+    events:         HELCATS/LOWCAT events with a flare source region
+                    Type: List of dicts
+    loc_key:        Location field, 'FL_LOC' (matcher) or 'SMART_HGLATLON' (time series)
+                    Type: string
+    pre, post:      Time window of the FLARECAST candidates around FL_STARTTIME
+                    Type: timedelta
+    since:          Events with a window starting before this date are skipped
+                    Type: datetime
+
+    returns:        One candidate per event that can be matched, with the keys
+                    index (position in events), event, nar (NOAA number + 10000),
+                    lat, lon (source region position) and start, end (time window)
+                    Type: List of dicts
+    """
+    lats, lons, _ = event_locations(events, loc_key)
+    candidates = []
+    for i, j in enumerate(events):
+        hel_date = parse_time(j["FL_STARTTIME"])
+        if hel_date is None or hel_date - pre <= since or np.isnan(lats[i]):
+            continue
+        candidates.append({"index": i, "event": j, "nar": int(j["SRS_NO"]) + 10000,
+                           "lat": lats[i], "lon": lons[i],
+                           "start": utc_minute(hel_date - pre), "end": utc_minute(hel_date + post)})
+    return candidates
+
+
+def match_candidate(c, fc_index, tol=15.0):
+    """
+    Matches one candidate like HELCATS_match_FLARECAST_1.py: first by NOAA number
+    (single NOAA region), then the closest region within tol degrees.
+
+    c:              Candidate, see prepare_events
+    fc_index:       Index of the downloaded FLARECAST records
+                    Type: RegionIndex
+    tol:            Maximum angular distance (degrees) to match regions
+
+    returns:        Matched record, match quality (0 for NOAA number, distance in degrees
+                    for position) and how it was matched (MATCH_NOAA or MATCH_POSITION),
+                    (None, None, None) if not matched
+                    Type: (dict, float, string)
+    """
+    for r in fc_index.by_nar(c["nar"], c["start"], c["end"]):
+        nnar = r["meta"]["nar"]
+        if nnar and c["nar"] in nnar and len(nnar) == 1:
+            return r, 0, MATCH_NOAA
+    r, q = fc_index.closest(c["lat"], c["lon"], c["start"], c["end"], tol)
+    if r is None:
+        return None, None, None
+    return r, q, MATCH_POSITION
+
+
+def fetch_match_index(candidates, service_url=SERVICE_URL, dataset=DATASET, store=None, **kwargs):
+    """
+    store:          If given, the windows are read from this local store when they were
+                    downloaded before, and the metadata of the store is the index
+                    Type: flarecast_store.RegionStore (of dataset)
+
+    returns:        Index of the metadata of all the candidate regions, downloaded in bulk
+                    Type: RegionIndex (flarecast_store.MetadataView with a store)
+    """
+    windows = [(c["start"], c["end"]) for c in candidates]
+    if store is not None:
+        for start, end, _ in plan_windows(windows):
+            store.download(service_url, start, end, property_type="", region_fields=MATCH_FIELDS,
+                           **kwargs)
+        return store.metadata()
+    return RegionIndex(download_bulk(service_url, dataset, windows, property_type="",
+                                     region_fields=MATCH_FIELDS, **kwargs))
+
+
+def fetch_ts_index(matches, nhours=25, ps="*", service_url=SERVICE_URL, dataset=DATASET,
+                   post=datetime.timedelta(minutes=5), store=None, **kwargs):
+    """
+    Downloads the records of the matched HARPs, nhours-1 hours before the matched time up to
+    post after it. Windows of the same HARP are merged, every HARP is asked in single
+    requests (see download_region).
+
+    matches:        (candidate, matched record, quality)
+                    Type: List of tuples
+    store:          See fetch_match_index
+
+    returns:        Index of the downloaded records, with all the properties ps
+                    Type: RegionIndex
+    """
+    by_harp = {}
+    for _, r, _ in matches:
+        t = iso8601.parse_date(r["time_start"])
+        by_harp.setdefault(r["meta"]["harp"], []).append(
+            (t - datetime.timedelta(hours=nhours - 1), t + post))
+    records = []
+    for harp, windows in by_harp.items():
+        for start, end, _ in plan_windows(windows, gap=datetime.timedelta(0)):
+            if store is not None:
+                store.download(service_url, start, end, harp=harp, property_type=ps,
+                               region_fields="*", **kwargs)
+                continue
+            records.extend(download_region(service_url, dataset, start, end, harp=harp,
+                                           property_type=ps, region_fields="*", **kwargs))
+    return store if store is not None else RegionIndex(records)
+
+
+def build_products(match, ts_index, spec, nhours=25, post=datetime.timedelta(minutes=5)):
+    """
+    match:          (candidate, matched record, quality)
+    ts_index:       See fetch_ts_index
+
+    returns:        Snapshot FC_data of the matched record (with fc_data_q) and the
+                    FC_data time series, both None if the record was not downloaded
+                    Type: (dict, dict)
+    """
+    c, r, q = match
+    harp = r["meta"]["harp"]
+    pass_time = iso8601.parse_date(r["time_start"])
+    records = ts_index.by_harp(harp, pass_time - datetime.timedelta(hours=nhours - 1),
+                               pass_time + post)
+    full = [x for x in records if same_region(x, r)]
+    if not full:
+        return None, None
+    snapshot = dict(full[-1].get("data", {}))
+    snapshot["fc_data_q"] = q
+    time, values = build_timeseries(records, harp, pass_time, spec, nhours=nhours)
+    return snapshot, timeseries_dict(time, values, spec)
+
+
+def run_pipeline(events, service_url=SERVICE_URL, dataset=DATASET, loc_key="FL_LOC", tol=15.0,
+                 ps="*", spec=TS_PROPERTIES, nhours=25, dedup=None, **kwargs):
+    """
+    events:         HELCATS/LOWCAT events with a flare source region
+                    Type: List of dicts
+    loc_key:        See prepare_events
+    tol:            See match_candidate
+    ps:             FLARECAST properties of the snapshot ("*" for all), they must include
+                    those of the time series
+                    Type: string
+    spec:           Properties of the time series, see flarecast_ts.PropertySpec
+    nhours:         Number of hourly points of the time series
+    dedup:          Shares the time series requests of the same HARP between events
+                    Type: flarecast_dedup.SingleFlight
+    kwargs:         Passed to the downloads (cache, workers, session, store...)
+
+    returns:        For every event, a dict with harp, pass_time, match (see match_candidate),
+                    FC_data (snapshot) and FC_TS (time series), empty if the event was not
+                    matched
+                    Type: List of dicts
+    """
+    spec = spec if isinstance(spec, PropertySpec) else PropertySpec(spec)
+    candidates = prepare_events(events, loc_key)
+    print('HELCATS events to match:', len(candidates))
+    fc_index = fetch_match_index(candidates, service_url, dataset, **kwargs)
+    matches = []
+    kinds = {}
+    for c in candidates:
+        r, q, kinds[c["index"]] = match_candidate(c, fc_index, tol)
+        if r is not None:
+            matches.append((c, r, q))
+    print('HELCATS events matched to FLARECAST regions:', len(matches))
+
+    ts_index = fetch_ts_index(matches, nhours, ps, service_url, dataset, dedup=dedup, **kwargs)
+    results = [{} for _ in events]
+    for m in matches:
+        snapshot, ts = build_products(m, ts_index, spec, nhours)
+        if snapshot is None:
+            continue
+        results[m[0]["index"]] = {"harp": m[1]["meta"]["harp"], "pass_time": m[1]["time_start"],
+                                  "match": kinds[m[0]["index"]], "FC_data": snapshot, "FC_TS": ts}
+    return results
+
+
+# CACHE AND REQUEST DE-DUPLICATION OF THE CURRENT WORKER PROCESS, SEE run_parallel
+_worker_cache = None
+_worker_dedup = None
+
+
+def _init_worker(cache_args):
+    import flarecast_client
+    from flarecast_cache import ResponseCache
+    from flarecast_dedup import SingleFlight
+
+    global _worker_cache, _worker_dedup
+    # NEVER SHARE THE CONNECTIONS OF THE PARENT PROCESS, EVERY WORKER OPENS ITS OWN
+    flarecast_client._session = None
+    _worker_cache = ResponseCache(**cache_args) if cache_args is not None else None
+    _worker_dedup = SingleFlight()
+
+
+def _run_chunk(args):
+    events, kwargs = args
+    return run_pipeline(events, cache=_worker_cache, dedup=_worker_dedup, **kwargs)
+
+
+def run_parallel(events, processes=4, chunk_size=50, cache_args=None, **kwargs):
+    """
+    Same as run_pipeline, with the events spread over a pool of processes. The events are
+    split in chunks of consecutive events (close in time, so the bulk downloads of a chunk
+    still merge), every worker has its own HTTP session, cache and request de-duplication.
+
+    events:         HELCATS/LOWCAT events with a flare source region
+                    Type: List of dicts
+    processes:      Number of worker processes
+                    Type: int
+    chunk_size:     Number of events given to a worker at once
+                    Type: int
+    cache_args:     Arguments of the flarecast_cache.ResponseCache opened by every worker,
+                    e.g. {'path': 'flarecast_cache'}, None for no cache
+                    Type: dict
+    kwargs:         Passed to run_pipeline
+
+    returns:        Same as run_pipeline, in the order of events
+                    Type: List of dicts
+    """
+    import multiprocessing
+
+    chunks = [(events[k:k + chunk_size], kwargs) for k in range(0, len(events), chunk_size)]
+    pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(cache_args,))
+    try:
+        parts = pool.map(_run_chunk, chunks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return [res for part in parts for res in part]
+
+
+# FUNCTION TO WRITE THE EVENTS WITH THE GIVEN PRODUCT AS FC_data, LIKE THE TWO SCRIPTS DO
+def write_product(filename, events, results, key):
+    out = []
+    for j, res in zip(events, results):
+        e = dict(j)
+        if res.get(key):
+            e["FC_data"] = res[key]
+        out.append(e)
+    text = json.dumps(out, ensure_ascii=False)
+    if not isinstance(text, type(u"")):
+        text = text.decode('utf-8')
+    with io.open(filename, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+if __name__ == "__main__":
+    from flarecast_cache import ResponseCache
+    from flarecast_dedup import SingleFlight
+    from helcats_catalogue import iter_events
+    from helcats_columnar import results_table, write_columns
+
+    # HELCATS/LOWCAT CATALOGUE FILENAME
+    helcats_file = "helcats_list.json"
+    # LOCAL CACHE OF FLARECAST RESPONSES -- SET offline=True TO RUN ONLY FROM THE CACHE
+    cache_args = dict(path="flarecast_cache", max_bytes=10 * 1024 ** 3, offline=False)
+    # NUMBER OF PROCESSES MATCHING EVENTS AT THE SAME TIME, 1 TO RUN IN THIS PROCESS
+    nprocesses = 4
+
+    reduced_list = list(iter_events(helcats_file, fl_types=('swpc', 'hessi'), since=SHARP_DATE))
+    print('Total CMEs with associatted Flare source region: ', len(reduced_list))
+    if nprocesses > 1:
+        results = run_parallel(reduced_list, processes=nprocesses, cache_args=cache_args, workers=8)
+    else:
+        results = run_pipeline(reduced_list, cache=ResponseCache(**cache_args), dedup=SingleFlight(), workers=8)
+    # SAME OUTPUTS AS HELCATS_match_FLARECAST_1.py AND HELC_FL_TS.py
+    write_product(MATCH_OUTPUT, reduced_list, results, "FC_data")
+    write_product(TS_OUTPUT, reduced_list, results, "FC_TS")
+    # BOTH PRODUCTS AS TYPED COLUMNS, SEE helcats_columnar.py
+    write_columns('helcats_list_flarecast_columns', results_table(reduced_list, results))
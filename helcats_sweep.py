@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Sweep of the matching parameters: grids of time windows (before and after FL_STARTTIME)
+and position tolerances are tried on the same FLARECAST records, downloaded once for the
+widest window, and the number and quality of the matches of every combination is
+reported, e.g.
+
+    python helcats_sweep.py --pre 30 60 120 --post 0 5 15 --tol 5 10 15 20
+"""
+from __future__ import print_function
+
+import datetime
+
+import numpy as np
+
+from flarecast_index import to_seconds
+from helcats_catalogue import parse_time
+from helcats_pipeline import SERVICE_URL, DATASET, MATCH_NOAA, fetch_match_index, match_candidate, \
+    prepare_events
+
+# PARAMETERS OF HELCATS_match_FLARECAST_1.py, THE OTHER COMBINATIONS ARE COMPARED WITH THEM
+REFERENCE = (datetime.timedelta(minutes=60), datetime.timedelta(minutes=5), 15.0)
+
+
+def sweep(events, pres, posts, tols, loc_key="FL_LOC", service_url=SERVICE_URL, dataset=DATASET,
+          reference=REFERENCE, fc_index=None, **kwargs):
+    """
+    events:         HELCATS/LOWCAT events with a flare source region
+                    Type: List of dicts
+    pres, posts:    Time windows before and after FL_STARTTIME to try
+                    Type: List of timedelta
+    tols:           Position tolerances to try (degrees)
+                    Type: List of floats
+    loc_key:        See prepare_events
+    reference:      (pre, post, tol) the other combinations are compared with, if in the grids
+                    Type: tuple
+    fc_index:       Records to match on, downloaded for the widest window if None
+                    Type: RegionIndex (or flarecast_store.RegionStore, MetadataView)
+    kwargs:         Passed to the download (cache, limiter, store...)
+
+    returns:        For every (pre, post, tol): the number of candidates, of matched events
+                    (by NOAA number and by position), of distinct HARPs, the median and
+                    90th percentile distance of the position matches (degrees), the median
+                    time between the event and the matched record (minutes) and, if the
+                    reference is in the grids, the number of events matched to the same
+                    HARP as with the reference
+                    Type: List of dicts
+    """
+    if fc_index is None:
+        # ONE DOWNLOAD FOR THE UNION OF ALL THE WINDOWS
+        union = prepare_events(events, loc_key, pre=max(pres), post=max(posts))
+        fc_index = fetch_match_index(union, service_url, dataset, **kwargs)
+    tol_max = max(tols)
+    # {(pre, post): {event index: (record, quality, match type)}} AT THE LARGEST TOLERANCE
+    found = {}
+    ncandidates = {}
+    for pre in pres:
+        for post in posts:
+            candidates = prepare_events(events, loc_key, pre=pre, post=post)
+            ncandidates[pre, post] = len(candidates)
+            found[pre, post] = {}
+            for c in candidates:
+                r, q, kind = match_candidate(c, fc_index, tol_max)
+                if r is not None:
+                    found[pre, post][c["index"]] = (r, q, kind)
+
+    # THE CLOSEST REGION DOES NOT DEPEND ON THE TOLERANCE: SMALLER TOLERANCES ONLY DROP MATCHES
+    def matches(pre, post, tol):
+        return dict((i, m) for i, m in found[pre, post].items() if m[2] == MATCH_NOAA or m[1] < tol)
+
+    ref = None
+    if reference[0] in pres and reference[1] in posts and reference[2] in tols:
+        ref = dict((i, m[0]["meta"]["harp"]) for i, m in matches(*reference).items())
+    times = {}
+    out = []
+    for pre in pres:
+        for post in posts:
+            for tol in tols:
+                m = matches(pre, post, tol)
+                q = np.array([q for r, q, kind in m.values() if kind != MATCH_NOAA], dtype=float)
+                dt = []
+                for i, (r, _, _) in m.items():
+                    if i not in times:
+                        times[i] = to_seconds(parse_time(events[i]["FL_STARTTIME"]))
+                    dt.append(abs(to_seconds(r["time_start"]) - times[i])/60.)
+                row = {"pre_minutes": pre.total_seconds()/60., "post_minutes": post.total_seconds()/60.,
+                       "tol": tol, "candidates": ncandidates[pre, post], "matched": len(m),
+                       "by_nar": len(m) - len(q), "by_position": len(q),
+                       "harps": len(set(r["meta"]["harp"] for r, _, _ in m.values())),
+                       "q_median": float(np.median(q)) if len(q) else None,
+                       "q_p90": float(np.percentile(q, 90)) if len(q) else None,
+                       "dt_median_minutes": float(np.median(dt)) if dt else None}
+                if ref is not None:
+                    row["same_as_reference"] = sum(1 for i, (r, _, _) in m.items()
+                                                   if ref.get(i) == r["meta"]["harp"])
+                out.append(row)
+    return out
+
+
+# FUNCTION TO PRINT THE RESULTS OF A SWEEP, ONE LINE PER COMBINATION
+def report(rows):
+    columns = ["candidates", "matched", "by_nar", "by_position", "harps", "q_median", "q_p90",
+               "dt_median_minutes", "same_as_reference"]
+    print("%6s %6s %6s" % ("pre", "post", "tol") + "".join(" %11s" % c[:11] for c in columns))
+    for row in rows:
+        line = "%6g %6g %6g" % (row["pre_minutes"], row["post_minutes"], row["tol"])
+        for c in columns:
+            v = row.get(c)
+            line += " %11s" % ("-" if v is None else "%.4g" % v)
+        print(line)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import os
+
+    from flarecast_cache import ResponseCache
+    from helcats_catalogue import iter_events
+    from helcats_pipeline import SHARP_DATE
+
+    parser = argparse.ArgumentParser(description="Sweep of the matching time windows and tolerances")
+    parser.add_argument("--catalogue", default="helcats_list.json")
+    parser.add_argument("--pre", type=float, nargs="+", default=[30, 60, 120],
+                        help="minutes before FL_STARTTIME")
+    parser.add_argument("--post", type=float, nargs="+", default=[0, 5, 15],
+                        help="minutes after FL_STARTTIME")
+    parser.add_argument("--tol", type=float, nargs="+", default=[5, 10, 15, 20], help="degrees")
+    parser.add_argument("--store", help="SQLite store of the records, see flarecast_store.py")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    events = list(iter_events(args.catalogue, fl_types=('swpc', 'hessi'), since=SHARP_DATE))
+    print('Total CMEs with associatted Flare source region: ', len(events))
+    kwargs = dict(service_url=os.environ.get("FLARECAST_URL", SERVICE_URL),
+                  cache=ResponseCache("flarecast_cache", max_bytes=10 * 1024 ** 3, offline=False))
+    if args.store:
+        from flarecast_store import RegionStore
+        kwargs["store"] = RegionStore(args.store)
+    rows = sweep(events, [datetime.timedelta(minutes=m) for m in args.pre],
+                 [datetime.timedelta(minutes=m) for m in args.post], args.tol, **kwargs)
+    report(rows)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(rows, f, indent=2)
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic HELCATS/LOWCAT catalogues and FLARECAST regions, from 10k to 1M events, to see
+how the matching scales. Active regions rotate across the disk with their NOAA numbers
+and HARPs (some HARPs hold two NOAA regions, some none), and flares come in bursts of
+the most productive regions. The regions can be served by flarecast_mock.MockService.
+"""
+from __future__ import print_function
+
+import bisect
+import datetime
+import io
+import json
+import random
+
+from flarecast_index import EPOCH, to_seconds
+from flarecast_mock import Region
+
+# FIELDS OF A HELCATS/LOWCAT EVENT, WITH THEIR BLANK VALUE
+EVENT_FIELDS = [
+    ("HEL_ID", " "), ("HI_SC", " "), ("HI_TIME", " "), ("HI_PAN", 0.0), ("HI_PAS", 0.0),
+    ("COR2_TS", " "), ("COR2_TF", " "), ("COR2_TIME", " "), ("COR2_PA", 0.0),
+    ("COR2_WIDTH", 0.0), ("COR2_V", 0.0), ("COR2_VSIGMA", 0.0), ("COR2_VMIN", 0.0),
+    ("COR2_VMAX", 0.0), ("COR2_TYPE", " "), ("COR2_HALO", " "), ("FL_TS", " "), ("FL_TF", " "),
+    ("FL_TYPE", " "), ("FL_STARTTIME", " "), ("FL_ENDTIME", " "), ("FL_PEAKTIME", " "),
+    ("FL_GOES", " "), ("FL_LOC", " "), ("SRS_TIME", " "), ("SRS_NO", 0.0), ("SRS_LOC", " "),
+    ("SRS_MCINTOSH", " "), ("SRS_HALE", " "), ("SRS_AREA", 0.0), ("SRS_LL", 0.0),
+    ("SRS_NN", 0.0), ("SMART_TIME", " "), ("SMART_HGLATLON", " "), ("SMART_LIMB", " "),
+    ("SMART_TOTFLX", 0.0), ("SMART_POSFLX", 0.0), ("SMART_NEGFLX", 0.0), ("SMART_FRCFLX", 0.0),
+    ("SMART_TOTAREA", 0.0), ("SMART_POSAREA", 0.0), ("SMART_NEGAREA", 0.0),
+    ("SMART_BMIN", 0.0), ("SMART_BMAX", 0.0), ("SMART_BMEAN", 0.0), ("SMART_PSLLEN", 0.0),
+    ("SMART_RVALUE", 0.0), ("SMART_WLSG", 0.0), ("SMART_BIPOLESEP", 0.0),
+]
+# FRACTIONS SEEN IN data/lowcat.json: FLARE TYPES, AND WHICH LOCATIONS ARE GIVEN FOR A FLARE
+FL_TYPES = (("swpc", 0.21), ("hessi", 0.15), (" ", 0.64))
+P_FL_LOC = 0.88
+P_SRS = 0.80
+P_SMART = 0.70
+_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+# FUNCTION TO FORMAT A DATETIME AS A HELCATS TIME STRING (' 7-Dec-2016 11:19:00.000')
+def helcats_time(t):
+    return "%2d-%s-%04d %02d:%02d:%02d.%03d" % (t.day, _MONTHS[t.month - 1], t.year, t.hour,
+                                                t.minute, t.second, t.microsecond//1000)
+
+
+# FUNCTION TO FORMAT A SIGNED LATITUDE AND LONGITUDE AS A HELCATS LOCATION ('S08W53')
+def helcats_location(lat, lon):
+    lat = int(round(lat))
+    lon = int(round(lon))
+    return "%s%02d%s%02d" % ('S' if lat < 0 else 'N', min(abs(lat), 99),
+                             'E' if lon < 0 else 'W', min(abs(lon), 99))
+
+
+def active_regions(start, end, per_day=0.8, lifetime=(3., 14.), seed=0):
+    """
+    Active regions appearing on the disk between start and end, as FLARECAST sees them.
+
+    start, end:     Time span of the catalogue
+                    Type: datetime
+    per_day:        Mean number of new regions per day (about 10 to 15 on the disk at once)
+                    Type: float
+    lifetime:       Shortest and longest time on the disk (days)
+                    Type: (float, float)
+    seed:           Seed of the generator
+                    Type: int
+
+    returns:        The regions, with their HARP number, their NOAA numbers (+10000) in nar
+                    (10% of the HARPs hold two NOAA regions, 5% none) and the flare
+                    productivity of each one in 'activity'
+                    Type: List of flarecast_mock.Region
+    """
+    rnd = random.Random(seed)
+    t = to_seconds(start)
+    t_end = to_seconds(end)
+    harp = 1
+    noaa = 11560
+    regions = []
+    while True:
+        t += rnd.expovariate(per_day)*86400.
+        if t >= t_end:
+            break
+        days = rnd.uniform(*lifetime)
+        # ACTIVITY BELTS, RISING ON THE EAST LIMB (OR ON THE DISK FOR YOUNG REGIONS)
+        lat = rnd.choice((-1, 1))*min(abs(rnd.gauss(15., 7.)), 45.)
+        lon0 = -85. if rnd.random() < 0.7 else rnd.uniform(-60., 40.)
+        u = rnd.random()
+        if u < 0.05:
+            nar = []
+        elif u < 0.15:
+            nar = [noaa, noaa + 1]
+            noaa += 2
+        else:
+            nar = [noaa]
+            noaa += 1
+        r = Region(harp, nar, lat, lon0, t, t, t)
+        # SEEN UNTIL IT DECAYS OR SETS ON THE WEST LIMB
+        r.t1 = t + min(days*86400., (85. - lon0)/r.rate)
+        r.activity = rnd.lognormvariate(0., 1.2)
+        regions.append(r)
+        harp += 1
+    return regions
+
+
+def synthetic_events(regions, nevents, burst=datetime.timedelta(hours=6), seed=0):
+    """
+    Flares of the regions (and CMEs without flare), in time order.
+
+    regions:        See active_regions
+    nevents:        Number of events
+                    Type: int
+    burst:          Mean duration of a burst of flares of the same region
+                    Type: timedelta
+    seed:           Seed of the generator
+                    Type: int
+
+    returns:        HELCATS/LOWCAT events, with all the catalogue fields
+                    Type: generator of dicts
+    """
+    rnd = random.Random(seed)
+    # CUMULATIVE ACTIVITY, THE MOST ACTIVE REGIONS HAVE MOST OF THE FLARES
+    cumulative = []
+    acc = 0.
+    for r in regions:
+        acc += r.activity
+        cumulative.append(acc)
+    # EVENTS COME IN BURSTS: EVERY BURST IS A REGION AND A TIME, WITH SEVERAL EVENTS
+    drawn = []
+    while len(drawn) < nevents:
+        k = bisect.bisect_left(cumulative, rnd.random()*acc)
+        r = regions[min(k, len(regions) - 1)]
+        centre = rnd.uniform(r.t0, r.t1)
+        for _ in range(min(1 + int(rnd.expovariate(1/3.)), nevents - len(drawn))):
+            t = centre + rnd.expovariate(1./burst.total_seconds())
+            drawn.append((min(t, r.t1), r))
+    drawn.sort(key=lambda x: x[0])
+    per_day = {}
+    for t, r in drawn:
+        yield _event(rnd, t, r, per_day)
+
+
+def _event(rnd, t, region, per_day):
+    e = dict(EVENT_FIELDS)
+    start = EPOCH + datetime.timedelta(seconds=int(t))
+    naive = start.replace(tzinfo=None)
+    day = naive.strftime("%Y%m%d")
+    sc = rnd.choice("AB")
+    per_day[day, sc] = per_day.get((day, sc), 0) + 1
+    e["HEL_ID"] = "HCME_%s__%s_%02d" % (sc, day, per_day[day, sc])
+    e["HI_SC"] = sc
+    e["HI_TIME"] = helcats_time(naive + datetime.timedelta(hours=rnd.uniform(2., 8.)))
+    e["COR2_TIME"] = helcats_time(naive + datetime.timedelta(minutes=rnd.uniform(20., 90.)))
+    e["COR2_V"] = float(int(rnd.lognormvariate(6., 0.4)))
+    u = rnd.random()
+    fl_type = " "
+    for name, p in FL_TYPES:
+        if u < p:
+            fl_type = name
+            break
+        u -= p
+    if fl_type == " ":
+        return e
+    e["FL_TYPE"] = fl_type
+    e["FL_STARTTIME"] = helcats_time(naive)
+    e["FL_PEAKTIME"] = helcats_time(naive + datetime.timedelta(minutes=rnd.uniform(2., 20.)))
+    e["FL_ENDTIME"] = helcats_time(naive + datetime.timedelta(minutes=rnd.uniform(20., 90.)))
+    e["FL_GOES"] = "%s%.1f" % (rnd.choice("BBCCCM"), rnd.uniform(1., 9.9))
+    lon = region.longitude(t)
+    # LOCATIONS ARE ROUNDED TO THE DEGREE AND A LITTLE OFF THE FLARECAST POSITION
+    if rnd.random() < P_FL_LOC:
+        e["FL_LOC"] = helcats_location(region.lat + rnd.gauss(0., 1.5), lon + rnd.gauss(0., 1.5))
+    if region.nar and rnd.random() < P_SRS:
+        srs = naive.replace(hour=0, minute=30, second=0)
+        t_srs = to_seconds(srs)
+        e["SRS_TIME"] = helcats_time(srs)
+        e["SRS_NO"] = float(rnd.choice(region.nar) - 10000)
+        e["SRS_LOC"] = helcats_location(region.lat, region.longitude(t_srs))
+        e["SRS_AREA"] = float(10*int(rnd.lognormvariate(4., 0.8)/10))
+    if rnd.random() < P_SMART:
+        e["SMART_TIME"] = e["FL_PEAKTIME"]
+        e["SMART_HGLATLON"] = helcats_location(region.lat + rnd.gauss(0., 1.), lon + rnd.gauss(0., 1.))
+    return e
+
+
+# FUNCTION TO WRITE A CATALOGUE AS A JSON ARRAY, ONE EVENT AT A TIME
+def write_catalogue(path, events):
+    n = 0
+    with io.open(path, "w", encoding="utf-8") as f:
+        f.write(u"[")
+        for e in events:
+            f.write((u"," if n else u"") + u"\n" + json.dumps(e, ensure_ascii=True))
+            n += 1
+        f.write(u"\n]\n")
+    return n
+
+
+def generate(nevents, start=datetime.datetime(2012, 9, 1), end=datetime.datetime(2017, 9, 1),
+             per_day=0.8, seed=0):
+    """
+    nevents:        Number of events of the catalogue
+                    Type: int
+    start, end:     Time span of the catalogue (FLARECAST regions exist from Sept 2012)
+                    Type: datetime
+    per_day, seed:  See active_regions
+
+    returns:        The regions (to give to flarecast_mock.MockService) and the events
+                    Type: (List of Region, generator of dicts)
+    """
+    regions = active_regions(start, end, per_day=per_day, seed=seed)
+    return regions, synthetic_events(regions, nevents, seed=seed + 1)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Synthetic HELCATS/LOWCAT catalogue")
+    parser.add_argument("nevents", type=int)
+    parser.add_argument("--output", default="helcats_list.json")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    regions, events = generate(args.nevents, seed=args.seed)
+    n = write_catalogue(args.output, events)
+    print("%d events of %d regions written to %s" % (n, len(regions), args.output))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of flarecast_client against the local stand-in of the FLARECAST service
+(flarecast_mock), run with: python -m pytest test_flarecast_client.py
+"""
+import datetime
+
+import iso8601
+
+import flarecast_client
+from flarecast_client import download_region, plan_windows
+from flarecast_mock import MockService, start
+from helcats_synthetic import active_regions
+
+T0 = datetime.datetime(2015, 1, 1, tzinfo=iso8601.UTC)
+
+
+def test_region_filter_kept_after_error(monkeypatch):
+    regions = active_regions(T0, T0 + datetime.timedelta(days=5), per_day=3, seed=1)
+    harp = regions[0].harp
+    start_, end = T0 + datetime.timedelta(days=1), T0 + datetime.timedelta(days=1, hours=6)
+    server, url = start(MockService(regions, background=5))
+    sent = []
+    failures = [1]
+    download_slice = flarecast_client.download_slice
+
+    # THE FIRST REQUEST FAILS (TIMEOUT, CONNECTION ERROR...), THE OTHERS ARE ANSWERED
+    def flaky(*args):
+        sent.append(args)
+        if failures:
+            failures.pop()
+            return None
+        return download_slice(*args)
+
+    monkeypatch.setattr(flarecast_client, "download_slice", flaky)
+    try:
+        first = download_region(url, "production_02", start_, end, harp=harp)
+        del sent[:]
+        second = download_region(url, "production_02", start_, end, harp=harp)
+    finally:
+        server.shutdown()
+    # THE FALLBACK SLICES REPEAT THE RECORDS AT THEIR BOUNDARIES
+    assert sorted(set(r["time_start"] for r in first)) == [r["time_start"] for r in second]
+    assert all(r["meta"]["harp"] == harp for r in second)
+    # THE SERVICE STILL FILTERS BY HARP: ONE REQUEST, NOT ONE PER fallback_step
+    assert len(sent) == 1
+    assert flarecast_client._server_filters.get((url, "harp"), True)
+
+
+def hours(a, b):
+    return T0 + datetime.timedelta(hours=a), T0 + datetime.timedelta(hours=b)
+
+
+def test_plan_windows_merge():
+    windows = [hours(0, 2), hours(1, 3), hours(3.2, 4), hours(10, 11)]
+    plan = plan_windows(windows, gap=datetime.timedelta(minutes=30))
+    assert plan == [hours(0, 4) + ([0, 1, 2],), hours(10, 11) + ([3],)]
+
+
+def test_plan_windows_max_span():
+    windows = [hours(k, k + 10) for k in range(0, 60, 5)]
+    plan = plan_windows(windows, max_span=datetime.timedelta(days=1))
+    for (s0, e0, _), (s1, e1, _) in zip(plan, plan[1:]):
+        # NEVER OVERLAPPING, A CUT REQUEST STARTS WHERE THE PREVIOUS ONE ENDS
+        assert s0 < e0 <= s1 < e1
+    assert max(e - s for s, e, _ in plan) <= datetime.timedelta(days=1)
+    assert sorted(i for _, _, c in plan for i in c) == list(range(len(windows)))
+    for s, e, covered in plan:
+        assert all(windows[i][1] <= e for i in covered)
+
+
+def test_plan_windows_nested():
+    # A WINDOW LONGER THAN max_span, THEN WINDOWS INSIDE IT AND ONE GOING PAST ITS END
+    windows = [hours(0, 72), hours(10, 20), hours(30, 72), hours(70, 80)]
+    plan = plan_windows(windows, max_span=datetime.timedelta(days=2))
+    assert plan == [hours(0, 72) + ([0, 1, 2],), hours(72, 80) + ([3],)]
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of flarecast_dedup.SingleFlight, run with: python -m pytest test_flarecast_dedup.py
+"""
+import threading
+import time
+
+import pytest
+
+from flarecast_dedup import SingleFlight
+
+
+# FUNCTION TO CALL dedup.fetch(key, func) FROM n THREADS AT ONCE, func IS BLOCKED UNTIL ALL WAIT
+def fetch_together(dedup, func, n=5):
+    release = threading.Event()
+    calls = []
+    out = [None]*n
+
+    def blocked():
+        calls.append(1)
+        release.wait(5)
+        return func()
+
+    def call(k):
+        try:
+            out[k] = dedup.fetch("key", blocked)
+        except Exception as e:
+            out[k] = e
+
+    threads = [threading.Thread(target=call, args=(k,)) for k in range(n)]
+    for t in threads:
+        t.start()
+    # ONE CALL RUNS func, THE n-1 OTHERS WAIT FOR IT
+    deadline = time.time() + 5
+    while dedup.shared < n - 1 and time.time() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+    return calls, out
+
+
+def test_one_call_shared():
+    dedup = SingleFlight()
+    calls, out = fetch_together(dedup, lambda: [{"time_start": "2015-01-01T00:00:00Z"}])
+    assert len(calls) == 1
+    assert all(o == [{"time_start": "2015-01-01T00:00:00Z"}] for o in out)
+    # EVERY CALLER GETS ITS OWN LIST
+    assert len(set(id(o) for o in out)) == len(out)
+    # ANSWERED FROM MEMORY AFTERWARDS
+    assert dedup.fetch("key", lambda: pytest.fail("asked again")) == out[0]
+
+
+def test_exception_reaches_every_waiter():
+    dedup = SingleFlight()
+
+    def fail():
+        raise ValueError("service down")
+
+    calls, out = fetch_together(dedup, fail)
+    assert len(calls) == 1
+    assert all(isinstance(o, ValueError) for o in out)
+    # ERRORS ARE NOT KEPT, THE NEXT CALL TRIES AGAIN
+    assert dedup.fetch("key", lambda: []) == []
+
+
+def test_failure_not_kept():
+    dedup = SingleFlight()
+    assert dedup.fetch("key", lambda: None) is None
+    assert dedup.fetch("key", lambda: [1]) == [1]
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the adaptive slices of flarecast_rate.SliceSizer (adaptive= of download_range)
+against the local stand-in of the FLARECAST service, run with:
+python -m pytest test_flarecast_rate.py
+"""
+import datetime
+
+import iso8601
+import pytest
+
+import flarecast_client
+from flarecast_cache import ResponseCache
+from flarecast_client import download_range
+from flarecast_index import to_seconds
+from flarecast_mock import MockService, start
+from flarecast_rate import SliceSizer
+from helcats_synthetic import active_regions
+
+T0 = datetime.datetime(2015, 1, 1, tzinfo=iso8601.UTC)
+START = T0 + datetime.timedelta(days=1, hours=5, minutes=17)
+END = T0 + datetime.timedelta(days=4, hours=2, minutes=3)
+MIN_STEP = datetime.timedelta(minutes=12)
+
+
+@pytest.fixture
+def service(monkeypatch):
+    regions = active_regions(T0, T0 + datetime.timedelta(days=6), per_day=3, seed=1)
+    server, url = start(MockService(regions, background=5))
+    sent = []
+    download_slice = flarecast_client.download_slice
+
+    # EVERY SLICE ASKED TO THE SERVICE, service.fail(s) TELLS WHICH ONES FAIL
+    def record(session, url_, dataset, s0, s1, params):
+        sent.append((s0, s1))
+        if service.fail((s0, s1)):
+            return None
+        return download_slice(session, url_, dataset, s0, s1, params)
+
+    service.fail = lambda s: False
+    service.sent = sent
+    service.url = url
+    monkeypatch.setattr(flarecast_client, "download_slice", record)
+    yield service
+    server.shutdown()
+
+
+def on_grid(t):
+    return to_seconds(t) % MIN_STEP.total_seconds() == 0
+
+
+def times(records):
+    return sorted(set((r["time_start"], r["meta"]["harp"]) for r in records))
+
+
+def test_slices_on_grid():
+    for step in (datetime.timedelta(hours=1), datetime.timedelta(hours=5), datetime.timedelta(days=1)):
+        sizer = SliceSizer(step=step, min_step=MIN_STEP)
+        cursor, slices = START, []
+        while cursor < END:
+            slices.append(sizer.next_slice(cursor, START, END))
+            cursor = slices[-1][1]
+        assert slices[0][0] == START and slices[-1][1] == END
+        for s, n in zip(slices, slices[1:]):
+            assert s[1] == n[0] and on_grid(s[1])
+        # EVERY SLICE IS A CELL OF THE GRID (A POWER OF TWO TIMES min_step) CLIPPED TO THE RANGE
+        for s0, s1 in slices[1:-1]:
+            k = int((s1 - s0).total_seconds()/MIN_STEP.total_seconds())
+            assert k & (k - 1) == 0 and to_seconds(s0) % (k*MIN_STEP.total_seconds()) == 0
+
+
+def test_failed_slices_halved(service):
+    reference = download_range(service.url, "production_02", START, END, property_type="")
+    # ANSWERS OF MORE THAN 2 HOURS ARE TOO BIG FOR THE SERVICE
+    service.fail = lambda s: s[1] - s[0] > datetime.timedelta(hours=2)
+    del service.sent[:]
+    sizer = SliceSizer(step=datetime.timedelta(hours=6), min_step=MIN_STEP)
+    errors = []
+    data = download_range(service.url, "production_02", START, END, property_type="",
+                          adaptive=sizer, errors=errors)
+    assert not errors
+    assert times(data) == times(reference)
+    failed = [s for s in service.sent if service.fail(s)]
+    assert failed
+    for s in failed:
+        # ASKED AGAIN AS THE TWO HALVES OF ITS CELL, CUT ON THE GRID
+        halves = sizer.halves(s)
+        assert halves[0][0] == s[0] and halves[1][1] == s[1] and on_grid(halves[0][1])
+        assert all(h in service.sent for h in halves)
+
+
+def test_cached_cells_reused(service, tmpdir):
+    path = str(tmpdir.join("cache"))
+    first = download_range(service.url, "production_02", START, END, property_type="",
+                           cache=ResponseCache(path),
+                           adaptive=SliceSizer(step=datetime.timedelta(hours=1), min_step=MIN_STEP))
+    del service.sent[:]
+    # OTHER SLICE SIZES, BIGGER AND SMALLER: THE CELLS OF THE FIRST RUN ARE FOUND IN THE CACHE
+    for step in (datetime.timedelta(days=2), MIN_STEP):
+        cache, errors = ResponseCache(path, offline=True), []
+        data = download_range(service.url, "production_02", START, END, property_type="",
+                              cache=cache, errors=errors,
+                              adaptive=SliceSizer(step=step, min_step=MIN_STEP))
+        assert not errors and cache.misses == 0
+        assert times(data) == times(first)
+    assert not service.sent
+
+
+def test_offline_not_resized(service, tmpdir):
+    sizer = SliceSizer(step=datetime.timedelta(hours=6), min_step=MIN_STEP)
+    errors = []
+    download_range(service.url, "production_02", START, END, property_type="",
+                   cache=ResponseCache(str(tmpdir), offline=True), adaptive=sizer, errors=errors)
+    # A MISSING SLICE IS NOT A FAILURE: NO HALVES, NO SMALLER SLICES
+    assert sizer.step == datetime.timedelta(hours=6)
+    assert errors[0][0] == START and errors[-1][1] == END
+    assert all(a[1] == b[0] for a, b in zip(errors, errors[1:]))
+    assert not service.sent
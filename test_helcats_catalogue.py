@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the streaming JSON parser of helcats_catalogue, run with:
+python -m pytest test_helcats_catalogue.py
+"""
+import json
+
+from helcats_catalogue import iter_json_items
+
+# ESCAPED QUOTES AND BACKSLASHES, BRACKETS INSIDE STRINGS, UNICODE ESCAPES, NESTED OBJECTS AND ARRAYS
+ITEMS = [
+    {"HEL_ID": "HCME_A__20150101_01", "FL_LOC": "N12W34", "note": "quote \" brace } bracket ] comma ,"},
+    {"HEL_ID": "back\\slash\\", "name": u"Ångström", "tab": "a\tb\nc"},
+    {"nested": {"a": [1, 2, {"b": "}]\""}], "c": {"d": {"e": []}}}, "empty": {}},
+    {"numbers": [1.5e-3, -2, 0], "flags": [True, False, None]},
+]
+
+
+# FUNCTION TO CUT A TEXT IN CHUNKS OF n CHARACTERS
+def chunked(text, n):
+    return [text[k:k + n] for k in range(0, len(text), n)]
+
+
+def test_array_split_everywhere():
+    text = json.dumps(ITEMS, indent=1)
+    # EVERY CHUNK SIZE CUTS STRINGS, ESCAPES AND NESTED OBJECTS AT A DIFFERENT PLACE
+    for n in range(1, 40):
+        assert list(iter_json_items(chunked(text, n))) == ITEMS
+    assert list(iter_json_items([json.dumps(ITEMS, ensure_ascii=False)])) == ITEMS
+
+
+def test_object_field_with_meta():
+    answer = {"has_error": False, "data": ITEMS, "result-count": len(ITEMS),
+              "next": "?time_start=between(a,b)&offset=\"4\""}
+    text = json.dumps(answer)
+    for n in (1, 2, 3, 7, 64):
+        meta = {}
+        assert list(iter_json_items(chunked(text, n), key="data", meta=meta)) == ITEMS
+        assert meta == dict((k, v) for k, v in answer.items() if k != "data")
+
+
+def test_accept_sees_raw_text():
+    text = json.dumps(ITEMS)
+    kept = list(iter_json_items(chunked(text, 5), accept=lambda raw: '"nested"' in raw))
+    assert kept == [ITEMS[2]]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the resume logic of helcats_checkpoint.Checkpoint, run with:
+python -m pytest test_helcats_checkpoint.py
+"""
+import io
+
+from helcats_checkpoint import Checkpoint
+
+
+def event(k):
+    return {"HEL_ID": "HCME_%d" % k, "FL_LOC": "N1%dW20" % k}
+
+
+def test_truncated_line_ignored(tmpdir):
+    path = str(tmpdir.join("ck.jsonl"))
+    with Checkpoint(path) as ck:
+        ck.put(event(1), {"harp": 1})
+        ck.put(event(2), None)
+    # A CRASH WHILE WRITING THE THIRD EVENT
+    with io.open(path, "a", encoding="utf-8") as f:
+        f.write(u'{"key": "HCME_3", "hash": "12')
+
+    with Checkpoint(path) as ck:
+        assert ck.get(event(1)) == (True, {"harp": 1})
+        assert ck.get(event(2)) == (True, None)
+        assert ck.get(event(3)) == (False, None)
+        ck.put(event(3), {"harp": 3})
+    # THE EVENT DONE AFTER THE RESUME IS NOT LOST WITH THE CUT LINE
+    with Checkpoint(path) as ck:
+        assert ck.get(event(3)) == (True, {"harp": 3})
+        assert ck.skipped == 1
+
+
+def test_changed_inputs_done_again(tmpdir):
+    path = str(tmpdir.join("ck.jsonl"))
+    with Checkpoint(path, settings={"ps": "*"}) as ck:
+        ck.put(event(1), {"harp": 1})
+    with Checkpoint(path, settings={"ps": "*"}) as ck:
+        changed = dict(event(1), FL_LOC="S05E10")
+        assert ck.get(changed) == (False, None)
+        # RESULTS ADDED TO THE EVENT BY THE RUN ARE NOT INPUTS
+        assert ck.get(dict(event(1), FC_data={"x": 1})) == (True, {"harp": 1})
+    with Checkpoint(path, settings={"ps": "sharp_kw"}) as ck:
+        assert ck.get(event(1)) == (False, None)
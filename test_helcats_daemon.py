@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of helcats_daemon.MatchDaemon against the local stand-in of the FLARECAST
+service (flarecast_mock), run with: python -m pytest test_helcats_daemon.py
+"""
+import datetime
+import os
+import random
+
+import iso8601
+
+from flarecast_cache import ResponseCache
+from flarecast_dedup import SingleFlight
+from flarecast_index import to_seconds
+from flarecast_mock import MockService, start
+from helcats_daemon import MatchDaemon
+from helcats_synthetic import _event, active_regions, write_catalogue
+
+
+# FUNCTION TO CREATE RECENT EVENTS (3 HOURS AGO) AND THE REGIONS THEY COME FROM
+def recent_events(now, seed=1):
+    regions = active_regions(now - datetime.timedelta(days=10), now - datetime.timedelta(hours=3),
+                             per_day=3, seed=seed)
+    rnd = random.Random(seed)
+    events = []
+    for r in regions:
+        if not r.nar or r.t1 <= to_seconds(now) - 2*86400:
+            continue
+        for _ in range(5):
+            e = _event(rnd, to_seconds(now) - 3*3600, r, {})
+            if e.get("FL_LOC", " ").strip() and e["SRS_NO"] and e["FL_TYPE"] in ("swpc", "hessi"):
+                # HEL_ID IS THE CHECKPOINT KEY, THE SYNTHETIC ONES ARE ONLY UNIQUE PER DAY
+                e["HEL_ID"] = "%s_%d" % (e["HEL_ID"], len(events))
+                events.append(e)
+                break
+    for r in regions:
+        r.t1 = max(r.t1, to_seconds(now))
+    return regions, events
+
+
+def test_data_after_first_poll(tmpdir):
+    now = datetime.datetime.now(iso8601.UTC)
+    regions, events = recent_events(now)
+    assert events
+    feed = str(tmpdir.mkdir("feed"))
+    write_catalogue(os.path.join(feed, "events.json"), events)
+
+    # THE SERVICE HAS NO RECORDS YET AT THE FIRST POLL
+    service = MockService([], background=0)
+    server, url = start(service)
+    try:
+        daemon = MatchDaemon(feed, str(tmpdir.join("out.jsonl")), str(tmpdir.join("ck.jsonl")),
+                             retry_interval=0., service_url=url,
+                             cache=ResponseCache(str(tmpdir.join("cache"))), dedup=SingleFlight())
+        assert daemon.step(now) == 0
+        assert len(daemon.pending) == len(events)
+
+        # THE RECORDS ARRIVE, THE RETRY MUST NOT BE ANSWERED BY THE CACHE OR THE DEDUP MEMO
+        service.__init__(regions, background=0)
+        assert daemon.step(now) == len(events)
+        assert not daemon.pending
+    finally:
+        daemon.writer.close()
+        daemon.checkpoint.close()
+        server.shutdown()